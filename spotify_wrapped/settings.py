@@ -13,7 +13,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 # Security settings
 SECRET_KEY = os.getenv("SECRET_KEY", "default-secret-key")
-DEBUG = True
+DEBUG = os.getenv("DEBUG", "true").lower() == "true"  # Set DEBUG=false in production
 
 ALLOWED_HOSTS = ['*']
 
@@ -22,6 +22,88 @@ SPOTIPY_CLIENT_ID = os.getenv("SPOTIPY_CLIENT_ID")
 SPOTIPY_CLIENT_SECRET = os.getenv("SPOTIPY_CLIENT_SECRET")
 SPOTIPY_REDIRECT_URI = os.getenv("SPOTIPY_REDIRECT_URI")
 
+# Spotify Web API and accounts roots (overridable so a local stub server can stand in for Spotify)
+SPOTIFY_API_BASE_URL = os.getenv("SPOTIFY_API_BASE_URL", "https://api.spotify.com/v1")
+SPOTIFY_ACCOUNTS_BASE_URL = os.getenv("SPOTIFY_ACCOUNTS_BASE_URL", "https://accounts.spotify.com")
+
+# Shared keep-alive HTTP session for all Spotify traffic (see wrapped/spotify_client.py)
+SPOTIFY_HTTP_POOL_CONNECTIONS = int(os.getenv("SPOTIFY_HTTP_POOL_CONNECTIONS", 4))  # Hosts kept pooled
+SPOTIFY_HTTP_POOL_MAXSIZE = int(os.getenv("SPOTIFY_HTTP_POOL_MAXSIZE", 16))  # Connections kept per host
+SPOTIFY_HTTP_CONNECT_TIMEOUT = float(os.getenv("SPOTIFY_HTTP_CONNECT_TIMEOUT", 3.05))
+SPOTIFY_HTTP_READ_TIMEOUT = float(os.getenv("SPOTIFY_HTTP_READ_TIMEOUT", 10))
+SPOTIFY_HTTP_RETRIES = int(os.getenv("SPOTIFY_HTTP_RETRIES", 3))  # Retries on connection errors
+SPOTIFY_HTTP_BACKOFF = float(os.getenv("SPOTIFY_HTTP_BACKOFF", 0.3))
+SPOTIFY_HTTP_ASYNC_MAX_CONNECTIONS = int(os.getenv("SPOTIFY_HTTP_ASYNC_MAX_CONNECTIONS", 200))  # Per ASGI worker
+
+# How generate_wrap builds wraps: 'inline' inside the request, 'stream' inside the request while streaming
+# each slide as its data arrives (WSGI only; the async views build 'stream' wraps inline), or 'background'
+# through the job queue processed by `python manage.py run_wrap_worker`
+WRAP_GENERATION_MODE = os.getenv("WRAP_GENERATION_MODE", "inline")
+
+# Route generate_wrap and the OAuth callback to their async versions (wrapped/async_views.py). Enable this
+# when serving spotify_wrapped.asgi, e.g. `gunicorn spotify_wrapped.asgi -k uvicorn.workers.UvicornWorker`
+WRAP_ASYNC_VIEWS = os.getenv("WRAP_ASYNC_VIEWS", "false").lower() == "true"
+
+# Redis, shared by every worker process (optional in development)
+REDIS_URL = os.getenv("REDIS_URL")
+
+# App-wide Spotify rate limit, shared through Redis when REDIS_URL is set (see wrapped/rate_limit.py)
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", 10))  # Requests per second
+SPOTIFY_RATE_LIMIT_BURST = int(os.getenv("SPOTIFY_RATE_LIMIT_BURST", 20))
+SPOTIFY_RETRY_BUDGET = float(os.getenv("SPOTIFY_RETRY_BUDGET", 15))  # Seconds a call may spend waiting
+SPOTIFY_MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", 3))  # Retries on 429 and 5xx
+
+# Short-TTL cache of Spotify responses per user and endpoint (see wrapped/spotify_cache.py)
+SPOTIFY_CACHE_BACKEND = os.getenv("SPOTIFY_CACHE_BACKEND", "redis" if REDIS_URL else "locmem")
+SPOTIFY_CACHE_MAX_ENTRIES = int(os.getenv("SPOTIFY_CACHE_MAX_ENTRIES", 1000))  # LRU bound for locmem
+SPOTIFY_CACHE_REVALIDATE_WINDOW = 3600  # Seconds expired entries are kept for ETag revalidation
+SPOTIFY_CACHE_TTLS = {  # Seconds; 0 disables caching for the endpoint
+    'profile': 300,
+    'top_artists': 3600,
+    'top_tracks': 3600,
+    'recently_played': 60,
+    'followed_artists': 900,
+}
+
+# Cross-user catalog of artists, albums, tracks and audio features (see wrapped/catalog.py): a per-process
+# LRU in front of Redis (when REDIS_URL is set) in front of the database
+CATALOG_LOCAL_MAX_ENTRIES = int(os.getenv("CATALOG_LOCAL_MAX_ENTRIES", 20000))
+CATALOG_LOCAL_TTL = int(os.getenv("CATALOG_LOCAL_TTL", 600))  # Seconds; bounds staleness across processes
+CATALOG_SHARED_TTL = int(os.getenv("CATALOG_SHARED_TTL", 7 * 24 * 3600))  # Seconds
+
+# Concurrent wrap fetching: size of the shared thread pool and per-endpoint timeouts (seconds). A wrap makes
+# 9 concurrent calls (3 time ranges of top artists and tracks); every time range shares the timeout and
+# cache TTL of its `top_*` entry, and the followed-artists timeout applies to each of its pages.
+SPOTIFY_FETCH_WORKERS = int(os.getenv("SPOTIFY_FETCH_WORKERS", 16))
+SPOTIFY_FETCH_TIMEOUTS = {
+    'profile': 5,
+    'top_artists': 10,
+    'top_tracks': 10,
+    'recently_played': 10,
+    'followed_artists': 10,
+}
+
+# Instrumentation (see wrapped/metrics.py). /metrics serves Prometheus histograms and counters to staff users, or to
+# scrapers sending "Authorization: Bearer <METRICS_TOKEN>". Requests slower than SLOW_REQUEST_LOG_THRESHOLD
+# seconds are logged with their spans (0 disables the log). Spotify response bodies are only logged at
+# DEBUG level, cut to SPOTIFY_LOG_BODY_CHARS characters.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+SLOW_REQUEST_LOG_THRESHOLD = float(os.getenv("SLOW_REQUEST_LOG_THRESHOLD", 0))
+SPOTIFY_LOG_BODY_CHARS = int(os.getenv("SPOTIFY_LOG_BODY_CHARS", 2000))
+
+# JSON API (wrapped/api_views.py): compact JSON only, for signed-in users
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'rest_framework.permissions.IsAuthenticated',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ],
+}
+
 # Django Allauth settings
 SITE_ID = 1
 ACCOUNT_EMAIL_VERIFICATION = "none"  # Or "mandatory" for email verification
@@ -47,11 +129,13 @@ INSTALLED_APPS = [
     'allauth.account',  # For user account management
     'allauth.socialaccount',  # For social account integration
     'allauth.socialaccount.providers.spotify',  # For Spotify integration
+    'rest_framework',  # JSON API under /api/
 ]
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'wrapped.metrics.RequestMetricsMiddleware',  # Request histograms and the slow request log
     "django.contrib.sessions.middleware.SessionMiddleware",
     'django.middleware.locale.LocaleMiddleware',  # Ensure this is included
     "django.middleware.common.CommonMiddleware",
@@ -82,7 +166,37 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "spotify_wrapped.wsgi.application"
 
-# Database
+# Database. Connections to DATABASE_URL are persistent: each worker thread keeps its connection for
+# DATABASE_CONN_MAX_AGE seconds and checks it still works before reusing it (under ASGI, set it to 0 or use
+# the pool). With psycopg 3 installed (pip install "psycopg[pool]"), DATABASE_POOL=true switches to Django's
+# connection pool instead, DATABASE_POOL_MIN_SIZE to DATABASE_POOL_MAX_SIZE connections per process.
+# DATABASE_REPLICA_URL adds a read replica serving the history, replay and admin list pages (see
+# wrapped/db_routing.py); for DATABASE_REPLICA_LAG seconds after generating a wrap, the user's reads stay on
+# the primary so the new wrap is there.
+DATABASE_CONN_MAX_AGE = int(os.getenv("DATABASE_CONN_MAX_AGE", 600))
+DATABASE_POOL = os.getenv("DATABASE_POOL", "false").lower() == "true"
+DATABASE_POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", 2))
+DATABASE_POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", 20))
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+DATABASE_REPLICA_LAG = int(os.getenv("DATABASE_REPLICA_LAG", 30))  # Seconds
+
+
+def _database(url):
+    import dj_database_url
+
+    # The pool hands connections back after every request, so it replaces persistent connections
+    database = dj_database_url.parse(url, conn_max_age=0 if DATABASE_POOL else DATABASE_CONN_MAX_AGE,
+                                     conn_health_checks=not DATABASE_POOL)
+    if DATABASE_POOL:
+        from psycopg_pool import ConnectionPool
+
+        database.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': DATABASE_POOL_MIN_SIZE,
+            'max_size': DATABASE_POOL_MAX_SIZE,
+            'check': ConnectionPool.check_connection,  # Test each connection as it is handed out
+        }
+    return database
+
 
 DATABASES = {
     "default": {
@@ -91,8 +205,46 @@ DATABASES = {
     }
 }
 if 'DATABASE_URL' in os.environ:
-    import dj_database_url
-    DATABASES = {'default': dj_database_url.config()}
+    DATABASES = {'default': _database(os.environ['DATABASE_URL'])}
+    if DATABASE_REPLICA_URL:
+        # Tests read the primary through the replica alias rather than creating a second database
+        DATABASES['replica'] = {**_database(DATABASE_REPLICA_URL), 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['wrapped.db_routing.ReplicaRouter']
+
+# Caches. "default" is shared by every worker through Redis (per process without REDIS_URL) and holds
+# sessions, the users and Spotify profiles of signed-in requests, and the history and replay lookups
+# (see wrapped/caching.py); entries are dropped as soon as their rows change and expire after
+# CACHE_ASIDE_TTL seconds regardless. "wrap_pages" holds rendered wrap slides, which never change once a
+# wrap exists: entries never expire and are deleted with their wrap. Redis should run with maxmemory-policy
+# allkeys-lru so it evicts the least recently replayed wraps; the file-based fallback is bounded by
+# MAX_ENTRIES. Bump WRAP_PAGE_CACHE_VERSION when wrap_slides.html or its translations change.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'spotify-wrapped',
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'wrap_pages': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'wrap-pages',
+        'TIMEOUT': None,
+        'VERSION': int(os.getenv("WRAP_PAGE_CACHE_VERSION", 1)),
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv("WRAP_PAGE_CACHE_DIR", BASE_DIR / '.cache' / 'wrap_pages'),
+        'TIMEOUT': None,
+        'VERSION': int(os.getenv("WRAP_PAGE_CACHE_VERSION", 1)),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv("WRAP_PAGE_CACHE_MAX_ENTRIES", 5000))},
+    },
+}
+CACHE_ASIDE_TTL = int(os.getenv("CACHE_ASIDE_TTL", 3600))  # Seconds
+
+# Sessions are read from the default cache and written through to the database, so they survive a
+# Redis flush
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -132,11 +284,25 @@ STATIC_URL = "static/"
 STATICFILES_DIRS = [BASE_DIR / "wrapped/static"]
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# collectstatic writes content-hashed copies plus gzip and Brotli variants; WhiteNoise serves the hashed
+# files with far-future, immutable cache headers
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+    },
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-# Authentication backends
+# Authentication backends. The cached ones serve the user of each request from the default cache
+# (see wrapped/backends.py); the plain ones stay listed so sessions created before keep resolving.
 AUTHENTICATION_BACKENDS = [
+    'wrapped.backends.CachedModelBackend',
+    'wrapped.backends.CachedAuthenticationBackend',
     'django.contrib.auth.backends.ModelBackend',
     'allauth.account.auth_backends.AuthenticationBackend',
 ]
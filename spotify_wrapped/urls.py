@@ -1,12 +1,27 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.i18n import i18n_patterns
-from wrapped import views  # Import views from the wrapped app
+from wrapped import api_views, async_views, views  # Import views from the wrapped app
 from django.views.generic import RedirectView
 
+# Serve the Spotify-facing views asynchronously when running under ASGI
+if settings.WRAP_ASYNC_VIEWS:
+    spotify_callback_view, generate_wrap_view = async_views.aspotify_callback, async_views.agenerate_wrap
+else:
+    spotify_callback_view, generate_wrap_view = views.spotify_callback, views.generate_wrap
+
 urlpatterns = [
     # Non-localized URLs can go here
     path('i18n/', include('django.conf.urls.i18n')),  # For language switching
+
+    # JSON API
+    path('api/wraps/', api_views.WrapListView.as_view(), name='api_wrap_list'),
+    path('api/wraps/generate/', api_views.WrapGenerateView.as_view(), name='api_wrap_generate'),
+    path('api/wraps/<int:wrap_id>/', api_views.WrapDetailView.as_view(), name='api_wrap_detail'),
+    path('api/stats/', api_views.ListeningStatsView.as_view(), name='api_listening_stats'),
+
+    path('metrics', views.metrics_view, name='metrics'),  # Prometheus histograms and counters
 ]
 
 urlpatterns += i18n_patterns(
@@ -17,11 +32,15 @@ urlpatterns += i18n_patterns(
     path('account/', include('allauth.urls')),  # For user authentication
 
     path('wraps/connect/', views.spotify_connect, name='spotify_connect'),  # Connect to Spotify
-    path('wraps/callback/', views.spotify_callback, name='spotify_callback'),  # Handle Spotify callback
-    path('wraps/generate/', views.generate_wrap, name='generate_wrap'),  # Generate new wrap
+    path('wraps/callback/', spotify_callback_view, name='spotify_callback'),  # Handle Spotify callback
+    path('wraps/generate/', generate_wrap_view, name='generate_wrap'),  # Generate new wrap
     path('wraps/history/', views.wrap_history, name='wrap_history'),  # View wrap history
     path('wraps/replay/<int:wrap_id>/', views.replay_wrap, name='replay_wrap'),  # Replay a saved wrap
+    path('wraps/jobs/<int:job_id>/', views.wrap_job_status, name='wrap_job_status'),  # Poll a queued wrap
+    path('wraps/jobs/stats/', views.wrap_queue_stats, name='wrap_queue_stats'),  # Queue depth and latency
+    path('wraps/catalog/stats/', views.catalog_cache_stats, name='catalog_cache_stats'),  # Catalog cache hit rate
+    path('wraps/spotify/stats/', views.spotify_client_stats, name='spotify_client_stats'),  # Throttled calls, cache hits
 
     # Admin URL
     path('admin/', admin.site.urls),
-)
\ No newline at end of file
+)
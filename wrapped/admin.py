@@ -1,7 +1,20 @@
-
 # Register your models here.
 from django.contrib import admin
-from .models import SpotifyProfile, SpotifyWrap
+from django.utils.decorators import method_decorator
+
+from .db_routing import read_from_replica
+from .models import (
+    Album, Artist, AudioFeatures, ListeningStats, PlayEvent, SpotifyProfile, SpotifyWrap, Track, WrapJob, WrapRun,
+)
+
+
+class ReplicaChangelistAdmin(admin.ModelAdmin):
+    # Browse lists on the read replica; actions (POST) and the change forms use the primary
+    @method_decorator(read_from_replica)
+    def changelist_view(self, request, extra_context=None):
+        return super().changelist_view(request, extra_context)
+
 
-admin.site.register(SpotifyProfile)
-admin.site.register(SpotifyWrap)
+for model in (SpotifyProfile, SpotifyWrap, WrapJob, Artist, Album, Track, PlayEvent, ListeningStats,
+              AudioFeatures, WrapRun):
+    admin.site.register(model, ReplicaChangelistAdmin)
@@ -0,0 +1,162 @@
+import math
+from itertools import chain
+
+import numpy as np
+
+from .models import Artist, AudioFeatures
+from .storage import AUDIO_FEATURE_FIELDS
+
+# Audio features averaged into a listener's mood; all of them range from 0 to 1
+MOOD_FEATURES = ('energy', 'valence', 'danceability', 'acousticness')
+
+# Genres listed in an analysis
+TOP_GENRES = 5
+
+
+def genre_distribution(artist_weights, artist_genres):
+    """
+        Spread the weight of each artist (e.g. its play count) over its genres.
+
+        Args:
+            artist_weights (dict): Weights keyed by artist Spotify ID.
+            artist_genres (dict): Genre lists keyed by artist Spotify ID; artists missing from it
+                have no known genre and are ignored.
+
+        Returns:
+            tuple: The genres and a float64 array of their weights, in the same order.
+        """
+
+    # Walking the (artist, genre) pairs is Python work either way; only the totals go to NumPy for ranking
+    totals = {}
+    for artist_id, weight in artist_weights.items():
+        for genre in artist_genres.get(artist_id) or ():
+            totals[genre] = totals.get(genre, 0) + weight
+    return list(totals), np.fromiter(totals.values(), dtype=np.float64, count=len(totals))
+
+
+def top_genres(genres, weights, limit=TOP_GENRES):
+    """
+        Return the heaviest genres, heaviest first; ties are broken alphabetically.
+        """
+
+    if not genres:
+        return []
+    # Only the genres tied with or above the limit-th heaviest need sorting
+    threshold = np.partition(weights, -limit)[-limit] if len(genres) > limit else weights.min()
+    candidates = np.flatnonzero(weights >= threshold)
+    return [genres[i] for i in sorted(candidates, key=lambda i: (-weights[i], genres[i]))[:limit]]
+
+
+def genre_diversity(weights):
+    """
+        Measure how evenly listening is spread over genres.
+
+        Returns:
+            tuple: The Shannon entropy of the genre distribution, in bits, and the same entropy
+            normalized by its maximum, from 0 (a single genre) to 1 (every genre equally).
+        """
+
+    weights = weights[weights > 0]
+    if weights.size < 2:
+        return 0.0, 0.0
+    p = weights / weights.sum()
+    entropy = float(-(p * np.log2(p)).sum())
+    return entropy, entropy / math.log2(weights.size)
+
+
+def mood_profile(track_weights, features):
+    """
+        Average the mood features of tracks, weighted e.g. by their play counts.
+
+        Args:
+            track_weights (dict): Weights keyed by track Spotify ID.
+            features (dict): Rows of `AUDIO_FEATURE_FIELDS` values keyed by track Spotify ID; tracks
+                missing from it are ignored.
+
+        Returns:
+            dict: The weighted mean of each of `MOOD_FEATURES`, or None if no track has features.
+        """
+
+    track_ids = [track_id for track_id in track_weights if track_id in features]
+    if not track_ids:
+        return None
+    columns = [AUDIO_FEATURE_FIELDS.index(name) for name in MOOD_FEATURES]
+    matrix = np.fromiter(
+        chain.from_iterable(features[track_id] for track_id in track_ids), dtype=np.float64,
+        count=len(track_ids) * len(AUDIO_FEATURE_FIELDS),
+    ).reshape(len(track_ids), len(AUDIO_FEATURE_FIELDS))[:, columns]
+    weights = np.fromiter((track_weights[track_id] for track_id in track_ids), dtype=np.float64, count=len(track_ids))
+    means = weights @ matrix / weights.sum()
+    return {name: round(float(value), 3) for name, value in zip(MOOD_FEATURES, means)}
+
+
+def feature_rows(audio_features):
+    """
+        Turn `AudioFeatures` instances keyed by track Spotify ID into the rows `mood_profile` takes.
+        """
+
+    return {
+        track_id: tuple(getattr(features, field) for field in AUDIO_FEATURE_FIELDS)
+        for track_id, features in audio_features.items()
+    }
+
+
+def _analysis(genres, weights, mood):
+    entropy, diversity = genre_diversity(weights)
+    return {
+        'top_genres': top_genres(genres, weights),
+        'genre_entropy': round(entropy, 3),
+        'genre_diversity': round(diversity, 3),
+        'mood': mood,
+    }
+
+
+def wrap_analysis(wrap_data, catalog, features):
+    """
+        Analyze the genres and mood of a new wrap.
+
+        Genres come from the top artists, the best ranked weighing the most; the mood averages the
+        audio features of the top and recently played tracks.
+
+        Args:
+            wrap_data (dict): The compact wrap data.
+            catalog (dict): The catalog rows referenced by `wrap_data`.
+            features (dict): Rows of `AUDIO_FEATURE_FIELDS` values keyed by track Spotify ID, as
+                returned by `feature_rows`.
+
+        Returns:
+            dict: `top_genres`, `genre_entropy`, `genre_diversity` and `mood` (None without features).
+        """
+
+    top_artists = wrap_data['top_artists']
+    artist_weights = {artist_id: len(top_artists) - rank for rank, artist_id in enumerate(top_artists)}
+    artist_genres = {artist_id: catalog['artists'][artist_id].genres for artist_id in artist_weights}
+    genres, weights = genre_distribution(artist_weights, artist_genres)
+
+    track_weights = {}
+    for track_id in wrap_data['top_tracks'] + [item['track'] for item in wrap_data['recently_played']]:
+        track_weights[track_id] = track_weights.get(track_id, 0) + 1
+    return _analysis(genres, weights, mood_profile(track_weights, features))
+
+
+def listening_analysis(stats):
+    """
+        Analyze the genres and mood of a user's whole listening history, from their `ListeningStats`.
+
+        Genres are weighted by artist play counts and the mood by track play counts, using the genres
+        and audio features already in the catalog.
+
+        Returns:
+            dict: The same keys as `wrap_analysis`.
+        """
+
+    artist_genres = dict(
+        Artist.objects.filter(spotify_id__in=list(stats.artist_counts)).values_list('spotify_id', 'genres')
+    )
+    features = {
+        row[0]: row[1:]
+        for row in AudioFeatures.objects.filter(spotify_id__in=list(stats.track_counts))
+        .values_list('spotify_id', *AUDIO_FEATURE_FIELDS)
+    }
+    genres, weights = genre_distribution(stats.artist_counts, artist_genres)
+    return _analysis(genres, weights, mood_profile(stats.track_counts, features))
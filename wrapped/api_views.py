@@ -0,0 +1,175 @@
+import hashlib
+import logging
+
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+from rest_framework import generics, status
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .analytics import listening_analysis
+from .caching import get_profile
+from .db_routing import pin_reads_to_primary
+from .jobs import enqueue_wrap_job
+from .models import ListeningStats, SpotifyWrap
+from .serializers import WrapDetailSerializer, WrapSummarySerializer
+from .stats import stats_summary
+from .storage import load_wrap_data
+from .tokens import ensure_valid_token
+from .wraps import WrapBuildError, create_wrap
+
+# Keys of the wrap data that `?fields=` can select
+WRAP_DATA_FIELDS = ('spotify_username', 'top_artists', 'top_tracks', 'recently_played', 'followed_artists',
+                    'time_ranges', 'analysis')
+
+
+class WrapCursorPagination(CursorPagination):
+    """
+        Newest wraps first, paged with an opaque cursor so deep pages cost the same as the first.
+        """
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+
+def _requested_fields(request):
+    """
+        Parse `?fields=a,b` into the selected wrap data keys, ignoring unknown ones.
+
+        Returns:
+            list: The selected keys in a stable order, or an empty list for all of them.
+        """
+
+    requested = set(request.GET.get('fields', '').split(','))
+    return [field for field in WRAP_DATA_FIELDS if field in requested]
+
+
+def _wrap_created_at(request, wrap_id):
+    # Looked up once per request and shared by the ETag and Last-Modified functions
+    if not hasattr(request, '_api_wrap_created_at'):
+        request._api_wrap_created_at = SpotifyWrap.objects.filter(
+            id=wrap_id, user=request.user
+        ).values_list('created_at', flat=True).first()
+    return request._api_wrap_created_at
+
+
+def _wrap_etag(request, wrap_id):
+    created_at = _wrap_created_at(request, wrap_id)
+    if not created_at:
+        return None
+    parts = [wrap_id, created_at.isoformat(), ','.join(_requested_fields(request))]
+    return hashlib.sha1(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+@method_decorator(gzip_page, name='dispatch')
+class WrapListView(generics.ListAPIView):
+    """
+        List the signed-in user's wraps, newest first: metadata only, without the wrap data.
+        """
+
+    serializer_class = WrapSummarySerializer
+    pagination_class = WrapCursorPagination
+
+    def get_queryset(self):
+        return SpotifyWrap.objects.filter(user=self.request.user).only('id', 'created_at', 'top_genre')
+
+
+@method_decorator(gzip_page, name='dispatch')
+class WrapDetailView(APIView):
+    """
+        Return one of the signed-in user's wraps with its data.
+
+        `?fields=top_tracks,top_artists` limits the data to the listed keys. A wrap never changes, so
+        the response carries an ETag and Last-Modified and revalidations are answered with a 304.
+        """
+
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(condition(etag_func=_wrap_etag, last_modified_func=_wrap_created_at))
+    def get(self, request, wrap_id):
+        wrap = get_object_or_404(SpotifyWrap, id=wrap_id, user=request.user)
+        serializer = WrapDetailSerializer(wrap, context={
+            'request': request,
+            'wrap_data': load_wrap_data(wrap),
+            'fields': _requested_fields(request),
+        })
+        return Response(serializer.data)
+
+
+@method_decorator(gzip_page, name='dispatch')
+class ListeningStatsView(APIView):
+    """
+        Summarize the signed-in user's listening history from its precomputed aggregates.
+
+        `?limit=` sets how many top artists, tracks and genres are returned (5 by default, at most 50).
+        `?analysis=1` adds the genre diversity and mood of the history, which reads the genres and
+        audio features of every artist and track played.
+        """
+
+    def get(self, request):
+        stats = ListeningStats.objects.filter(user=request.user).first()
+        if not stats:
+            stats = ListeningStats(user=request.user, hour_counts=[0] * 24, weekday_counts=[0] * 7)
+        try:
+            limit = min(max(int(request.GET.get('limit', 5)), 1), 50)
+        except ValueError:
+            limit = 5
+        summary = stats_summary(stats, limit=limit)
+        if request.GET.get('analysis'):
+            summary['analysis'] = listening_analysis(stats)
+        return Response(summary)
+
+
+def _reconnect_response():
+    """
+        Tell the client that the user has to connect Spotify (again) before a wrap can be generated.
+        """
+
+    return Response(
+        {'detail': 'Spotify is not connected.', 'code': WrapBuildError.RECONNECT,
+         'connect_url': reverse('spotify_connect')},
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
+class WrapGenerateView(APIView):
+    """
+        Generate a wrap for the signed-in user.
+
+        In 'background' generation mode the wrap is queued and a 202 points to the job's status URL;
+        otherwise it is built right away and returned like the detail endpoint, with a 201.
+        """
+
+    def post(self, request):
+        profile = get_profile(request.user)
+        if not profile:
+            return _reconnect_response()
+
+        if settings.WRAP_GENERATION_MODE == 'background':
+            job = enqueue_wrap_job(request.user)
+            return Response(
+                {'job': job.id, 'status': job.status, 'status_url': reverse('wrap_job_status', args=[job.id])},
+                status=status.HTTP_202_ACCEPTED,
+            )
+
+        if not ensure_valid_token(profile):
+            return _reconnect_response()
+        try:
+            wrap = create_wrap(profile)
+        except WrapBuildError as e:
+            logging.error(f"Failed to build wrap: {e}")
+            if e.reason == WrapBuildError.THROTTLED:
+                return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            return _reconnect_response()
+
+        serializer = WrapDetailSerializer(wrap, context={'request': request, 'wrap_data': load_wrap_data(wrap)})
+        # The client is likely to open the new wrap next, which the replica may not have yet
+        return pin_reads_to_primary(Response(serializer.data, status=status.HTTP_201_CREATED,
+                                             headers={'Location': serializer.data['url']}))
@@ -0,0 +1,137 @@
+import logging
+import time
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import redirect, render
+
+from . import spotify_client
+from .db_routing import pin_reads_to_primary
+from .decorators import aget_user, spotify_profile_required, spotify_token_required
+from .jobs import enqueue_wrap_job
+from .models import SpotifyProfile
+from .spotify_api import aget_current_user_profile
+from .spotify_client import SpotifyRateLimited
+from .tokens import code_exchange_request
+from .wrap_pages import render_wrap_slides
+from .wraps import WrapBuildError, acreate_wrap
+
+# Async (ASGI) versions of the views that talk to Spotify. They are routed instead of their
+# counterparts in views.py when settings.WRAP_ASYNC_VIEWS is on.
+
+
+@login_required
+async def aspotify_callback(request):
+    """
+        Async version of `views.spotify_callback`.
+
+        Args:
+            request (HttpRequest): The HTTP request object containing the callback data from Spotify.
+
+        Returns:
+            HttpResponse: Redirect response to the 'generate_wrap' page if successful, or an error page if not.
+        """
+
+    user = await aget_user(request)
+    code = request.GET.get('code')
+    if not code:
+        return render(request, 'error.html', {'message': 'No code provided in the callback.'})
+
+    try:
+        response = await spotify_client.apost(**code_exchange_request(code))
+    except (httpx.HTTPError, SpotifyRateLimited) as e:
+        logging.warning(f"Spotify token exchange failed: {e}")
+        return render(request, 'error.html', {'message': 'Failed to obtain token information from Spotify.'})
+    if response.status_code != 200:
+        logging.warning(f"Spotify token exchange answered {response.status_code}")
+        return render(request, 'error.html', {'message': 'Failed to obtain token information from Spotify.'})
+
+    token_info = response.json()
+    if not token_info:
+        logging.warning("Spotify token exchange returned no token")
+        return render(request, 'error.html', {'message': 'Failed to obtain token information from Spotify.'})
+
+    access_token = token_info.get('access_token')
+    refresh_token = token_info.get('refresh_token')
+    expires_at = int(time.time()) + token_info.get('expires_in')
+
+    # Use the access token to get user profile
+    try:
+        spotify_user = await aget_current_user_profile(access_token)
+    except (httpx.HTTPError, SpotifyRateLimited) as e:
+        logging.warning(f"Failed to get the Spotify profile of user {user.id}: {e}")
+        spotify_user = None
+    if not spotify_user:
+        return render(request, 'error.html', {'message': 'Failed to get user profile from Spotify.'})
+
+    spotify_id = spotify_user['id']
+    try:
+        # Check if a SpotifyProfile with this spotify_id already exists
+        profile = await SpotifyProfile.objects.aget(spotify_id=spotify_id)
+        if profile.user_id != user.id:
+            # The Spotify account is already linked to another user
+            return render(request, 'error.html', {
+                'message': 'This Spotify account is already linked to another user.'
+            })
+        profile.access_token = access_token
+        profile.refresh_token = refresh_token
+        profile.expires_at = expires_at
+        await profile.asave()
+    except SpotifyProfile.DoesNotExist:
+        await SpotifyProfile.objects.acreate(
+            user=user,
+            spotify_id=spotify_id,
+            access_token=access_token,
+            refresh_token=refresh_token,
+            expires_at=expires_at
+        )
+
+    return redirect('generate_wrap')
+
+
+@login_required
+@spotify_profile_required
+async def agenerate_wrap(request):
+    """
+        Async version of `views.generate_wrap`.
+
+        The Spotify calls share the event loop's connection pool and the ORM is used through its async
+        API, so a single ASGI worker can serve many wraps at once.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            HttpResponse: Renders the 'wrap.html' template with wrap data (or 'wrap_pending.html' for a queued job),
+            or redirects to the Spotify connection page if an error occurs.
+        """
+
+    if settings.WRAP_GENERATION_MODE == 'background':
+        job = await sync_to_async(enqueue_wrap_job)(request.user)
+        return render(request, 'wrap_pending.html', {'job': job})
+    return await _agenerate_wrap_now(request)
+
+
+@spotify_token_required
+async def _agenerate_wrap_now(request):
+    """
+        Build, save and render a wrap right away, with a usable access token ensured by the decorator.
+        """
+
+    profile = request.spotify_profile
+    try:
+        wrap = await acreate_wrap(profile)
+    except WrapBuildError as e:
+        logging.error(f"Failed to build wrap: {e}")
+        if e.reason == WrapBuildError.THROTTLED:
+            return render(request, 'error.html', {'message': str(e)})
+        return redirect('spotify_connect')
+    except Exception as e:
+        logging.error(f"Unexpected error: {e}")
+        return redirect('spotify_connect')
+
+    # Pass data to the template
+    wrap_slides = await sync_to_async(render_wrap_slides)(wrap)
+    return pin_reads_to_primary(render(request, 'wrap.html', {'wrap_slides': wrap_slides}))
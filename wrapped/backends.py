@@ -0,0 +1,25 @@
+from allauth.account.auth_backends import AuthenticationBackend
+from django.contrib.auth.backends import ModelBackend
+
+from .caching import get_or_set, user_key
+
+
+class CachedUserMixin:
+    """
+        Serve the user of every authenticated request from the default cache instead of the database.
+
+        The entry is dropped whenever the user is saved or deleted (see signals.py), which includes
+        the `last_login` update of every login and any password change, so session verification
+        always sees the current password hash.
+        """
+
+    def get_user(self, user_id):
+        return get_or_set(user_key(user_id), lambda: super(CachedUserMixin, self).get_user(user_id))
+
+
+class CachedModelBackend(CachedUserMixin, ModelBackend):
+    pass
+
+
+class CachedAuthenticationBackend(CachedUserMixin, AuthenticationBackend):
+    pass
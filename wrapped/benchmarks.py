@@ -0,0 +1,175 @@
+import json
+import math
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import CommandError
+
+# Where the benchmark commands keep their baselines by default, one JSON file per command
+BASELINE_DIR = Path(settings.BASE_DIR) / 'benchmarks'
+
+# Latency percentiles reported for every scenario
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(latencies, percent):
+    """
+        Return a percentile of sorted latencies, by the nearest-rank method.
+
+        Args:
+            latencies (list): Latencies in seconds, sorted in ascending order.
+            percent (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The latency, or 0 when there are none.
+        """
+
+    if not latencies:
+        return 0.0
+    rank = max(1, math.ceil(len(latencies) * percent / 100))
+    return latencies[rank - 1]
+
+
+def summarize(outcomes, elapsed):
+    """
+        Summarize the timed requests of one scenario.
+
+        Args:
+            outcomes (list): `(ok, seconds)` pairs, one per request.
+            elapsed (float): Wall-clock seconds the whole scenario took.
+
+        Returns:
+            dict: `requests`, `ok`, `throughput` (requests per second) and `p50`, `p95` and `p99` latencies
+            in seconds.
+        """
+
+    latencies = sorted(seconds for _, seconds in outcomes)
+    summary = {
+        'requests': len(outcomes),
+        'ok': sum(1 for ok, _ in outcomes if ok),
+        'throughput': len(outcomes) / elapsed if elapsed else 0.0,
+    }
+    for percent in PERCENTILES:
+        summary[f'p{percent}'] = percentile(latencies, percent)
+    return summary
+
+
+def format_summary(name, summary):
+    """
+        Format a scenario summary as one line of command output.
+        """
+
+    latencies = ', '.join(f"p{percent} {summary[f'p{percent}'] * 1000:.1f} ms" for percent in PERCENTILES)
+    return (f"{name}: {summary['ok']}/{summary['requests']} ok, {summary['throughput']:.1f} req/s, "
+            f"{latencies}")
+
+
+def baseline_path(command, path=None):
+    """
+        Return the baseline file of a benchmark command: `path` if given, else `benchmarks/<command>.json`.
+        """
+
+    return Path(path) if path else BASELINE_DIR / f"{command}.json"
+
+
+def load_baseline(path):
+    """
+        Read stored scenario summaries, or return None if there is no baseline yet.
+        """
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results):
+    """
+        Store scenario summaries as the baseline later runs are compared with.
+
+        Args:
+            path (Path): The baseline file; its directory is created if needed.
+            results (dict): Summaries keyed by scenario name, as returned by `summarize`.
+        """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def _success_rate(summary):
+    return summary['ok'] / summary['requests'] if summary['requests'] else 0.0
+
+
+def regressions(results, baseline, tolerance):
+    """
+        Compare scenario summaries with a baseline.
+
+        A scenario regressed if its p95 latency grew, or its throughput or share of successful requests
+        dropped, by more than `tolerance`. Scenarios missing from either side are not compared.
+
+        Args:
+            results (dict): Summaries keyed by scenario name, as returned by `summarize`.
+            baseline (dict): Summaries of the baseline run, in the same format.
+            tolerance (float): The accepted relative change, e.g. 0.2 for 20%.
+
+        Returns:
+            list: A description of each regression; empty if there is none.
+        """
+
+    found = []
+    for name, summary in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if summary['p95'] > before['p95'] * (1 + tolerance):
+            found.append(f"{name}: p95 {summary['p95'] * 1000:.1f} ms, baseline {before['p95'] * 1000:.1f} ms")
+        if summary['throughput'] < before['throughput'] * (1 - tolerance):
+            found.append(f"{name}: {summary['throughput']:.1f} req/s, baseline {before['throughput']:.1f} req/s")
+        success, success_before = _success_rate(summary), _success_rate(before)
+        if success < success_before * (1 - tolerance):
+            found.append(f"{name}: {success:.0%} ok, baseline {success_before:.0%}")
+    return found
+
+
+def add_baseline_arguments(parser):
+    """
+        Add the `--baseline`, `--save-baseline` and `--tolerance` options of the benchmark commands.
+        """
+
+    parser.add_argument('--baseline', help="Baseline file (default: benchmarks/<command>.json).")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Store this run as the baseline instead of comparing it with the baseline.")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Relative slowdown accepted before a scenario counts as a regression.")
+
+
+def check_baseline(command, results, options, stdout):
+    """
+        Save the results as the command's baseline, or compare them with it.
+
+        Args:
+            command (str): The name of the benchmark command.
+            results (dict): Summaries keyed by scenario name, as returned by `summarize`.
+            options (dict): The command options added by `add_baseline_arguments`.
+            stdout (OutputWrapper): Where to report what was done.
+
+        Raises:
+            CommandError: If a scenario regressed compared with the baseline.
+        """
+
+    path = baseline_path(command, options['baseline'])
+    if options['save_baseline']:
+        save_baseline(path, results)
+        stdout.write(f"Baseline saved to {path}")
+        return
+    baseline = load_baseline(path)
+    if baseline is None:
+        stdout.write(f"No baseline at {path}; run with --save-baseline to store one")
+        return
+    found = regressions(results, baseline, options['tolerance'])
+    if found:
+        raise CommandError("Regressions against the baseline:\n" + '\n'.join(found))
+    stdout.write(f"No regression against {path} (tolerance {options['tolerance']:.0%})")
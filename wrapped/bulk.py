@@ -0,0 +1,132 @@
+import logging
+import time
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .caching import forget_wraps
+from .models import ListeningStats, SpotifyProfile, SpotifyWrap, WrapRun
+from .stats import top_genre
+from .storage import save_catalog
+from .tokens import is_token_expired, refresh_token_single_flight
+from .wraps import WrapBuildError, build_wrap_data
+
+# Seconds a worker waits before retrying a wrap Spotify throttled, and how many times it retries
+THROTTLE_PAUSE = 30
+THROTTLE_RETRIES = 3
+
+# Seconds a token must stay valid to build a wrap with it, throttling pauses included. Tokens live for an
+# hour, so a margin that long would refresh every token of every run.
+TOKEN_MARGIN = 300
+
+
+def start_run(label, since=None):
+    """
+        Start a bulk wrap run, or return the existing run with that label so it resumes from its checkpoint.
+
+        Args:
+            label (str): Identifies the run, e.g. "2024-annual".
+            since (datetime, optional): Users with a wrap created since then are skipped. Defaults to
+                now, which only skips wraps generated while the run is going on.
+
+        Returns:
+            WrapRun: The run.
+        """
+
+    run, _ = WrapRun.objects.get_or_create(label=label, defaults={'since': since or timezone.now()})
+    return run
+
+
+def _build(profile, token_margin):
+    """
+        Refresh the profile's token if needed and build its wrap, retrying while Spotify throttles us.
+
+        Returns:
+            tuple: The profile, and either the `(wrap_data, catalog)` pair or the failure reason.
+        """
+
+    try:
+        if is_token_expired(profile, margin=token_margin) and not refresh_token_single_flight(profile, token_margin):
+            return profile, WrapBuildError.RECONNECT
+        for attempt in range(THROTTLE_RETRIES + 1):
+            try:
+                return profile, build_wrap_data(profile)
+            except WrapBuildError as e:
+                if e.reason != WrapBuildError.THROTTLED or attempt == THROTTLE_RETRIES:
+                    return profile, e.reason
+                time.sleep(THROTTLE_PAUSE)
+    except Exception as e:
+        logging.exception(f"Bulk wrap for profile {profile.pk} failed")
+        return profile, str(e) or e.__class__.__name__
+    finally:
+        # Worker threads hold their own connections; don't keep broken ones between profiles
+        close_old_connections()
+
+
+def _top_genres(user_ids, built):
+    # One query for the listening stats of the whole chunk instead of one per wrap
+    stats = ListeningStats.objects.filter(user_id__in=user_ids).only('user_id', 'genre_counts')
+    genres = {s.user_id: top_genre(s) for s in stats}
+    for user_id, (wrap_data, _) in built.items():
+        if not genres.get(user_id):
+            analysis_genres = (wrap_data.get('analysis') or {}).get('top_genres')
+            genres[user_id] = analysis_genres[0] if analysis_genres else None
+    return {user_id: genre[:255] if genre else None for user_id, genre in genres.items()}
+
+
+def process_chunk(run, profiles, pool, token_margin=TOKEN_MARGIN):
+    """
+        Generate the wraps of a chunk of profiles and save them, together with the run's checkpoint.
+
+        Wraps are built concurrently on `pool`; tokens expiring within `token_margin` seconds are
+        refreshed first, on the same pool, so none expires while its wrap is being fetched. All the
+        wraps of the chunk, their catalog rows and the new checkpoint are then written in a single
+        transaction with `bulk_create`, so a crash either keeps the whole chunk or none of it.
+
+        Args:
+            run (WrapRun): The run; its counters and checkpoint are updated and saved.
+            profiles (list): Profiles ordered by ID, all above the run's checkpoint.
+            pool (ThreadPoolExecutor): The worker pool.
+            token_margin (int): Seconds of remaining token validity below which tokens are refreshed.
+        """
+
+    user_ids = [profile.user_id for profile in profiles]
+    done = set(SpotifyWrap.objects.filter(user_id__in=user_ids, created_at__gte=run.since)
+               .values_list('user_id', flat=True))
+    to_build = [profile for profile in profiles if profile.user_id not in done]
+
+    built, failed = {}, 0
+    for profile, outcome in pool.map(lambda profile: _build(profile, token_margin), to_build):
+        if isinstance(outcome, tuple):
+            built[profile.user_id] = outcome
+        else:
+            logging.warning(f"No wrap for profile {profile.pk}: {outcome}")
+            failed += 1
+
+    catalog = {'artists': {}, 'albums': {}, 'tracks': {}}
+    for _, wrap_catalog in built.values():
+        for kind, rows in wrap_catalog.items():
+            catalog[kind].update(rows)
+    genres = _top_genres(list(built), built)
+
+    with transaction.atomic():
+        save_catalog(catalog)
+        wraps = SpotifyWrap.objects.bulk_create([
+            SpotifyWrap(user_id=user_id, data=wrap_data, top_genre=genres.get(user_id))
+            for user_id, (wrap_data, _) in built.items()
+        ])
+        run.last_profile_id = profiles[-1].id
+        run.generated += len(built)
+        run.failed += failed
+        run.skipped += len(done)
+        run.save()
+    # bulk_create sends no post_save signals
+    forget_wraps(wraps)
+
+
+def pending_profiles(run):
+    """
+        Return the profiles the run has not processed yet, in checkpoint order.
+        """
+
+    return SpotifyProfile.objects.filter(id__gt=run.last_profile_id).order_by('id')
@@ -0,0 +1,142 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import SpotifyProfile
+
+# Returned by the cache for a missing key, so that None can be cached like any other value
+_MISSING = object()
+
+# Profile fields never written to the shared cache; `ensure_valid_token` loads them from the database
+SECRET_PROFILE_FIELDS = ('access_token', 'refresh_token')
+
+
+def user_key(user_id):
+    return f"user:{user_id}"
+
+
+def profile_key(user_id):
+    return f"spotify-profile:{user_id}"
+
+
+def history_key(user_id):
+    return f"wrap-history:{user_id}"
+
+
+def replay_key(user_id, wrap_id):
+    return f"wrap-created-at:{user_id}:{wrap_id}"
+
+
+def get_or_set(key, load, timeout=None):
+    """
+        Read a value through the default cache, loading and caching it on a miss.
+
+        None is cached like any other value, so rows that don't exist are not looked up every time
+        either. Cache errors are logged and the value loaded anyway, so an unreachable cache never
+        breaks a page.
+
+        Args:
+            key (str): The cache key, built with one of the `*_key` functions of this module.
+            load (callable): Called without arguments to load the value on a miss.
+            timeout (int, optional): Seconds the value is kept; defaults to `settings.CACHE_ASIDE_TTL`.
+
+        Returns:
+            The cached or loaded value.
+        """
+
+    try:
+        value = cache.get(key, _MISSING)
+    except Exception as e:
+        logging.warning(f"Default cache unavailable: {e}")
+        return load()
+    if value is _MISSING:
+        value = load()
+        try:
+            cache.set(key, value, settings.CACHE_ASIDE_TTL if timeout is None else timeout)
+        except Exception as e:
+            logging.warning(f"Default cache unavailable: {e}")
+    return value
+
+
+async def aget_or_set(key, aload, timeout=None):
+    """
+        Async counterpart of `get_or_set`; `aload` is a coroutine function.
+        """
+
+    try:
+        value = await cache.aget(key, _MISSING)
+    except Exception as e:
+        logging.warning(f"Default cache unavailable: {e}")
+        return await aload()
+    if value is _MISSING:
+        value = await aload()
+        try:
+            await cache.aset(key, value, settings.CACHE_ASIDE_TTL if timeout is None else timeout)
+        except Exception as e:
+            logging.warning(f"Default cache unavailable: {e}")
+    return value
+
+
+def invalidate(*keys):
+    """
+        Drop cached values after the rows they were loaded from changed.
+        """
+
+    try:
+        cache.delete_many(keys)
+    except Exception as e:
+        logging.warning(f"Default cache unavailable, could not invalidate {', '.join(keys)}: {e}")
+
+
+def get_profile(user):
+    """
+        Return the user's Spotify profile, or None if they have not linked one, through the default cache.
+
+        Args:
+            user (User): An authenticated user.
+
+        Returns:
+            SpotifyProfile | None: The profile, without its tokens (`SECRET_PROFILE_FIELDS` are deferred),
+            so they never sit in a cache shared by every worker. `ensure_valid_token` loads them from the
+            database, re-reading the row before any refresh, so a stale copy is never used to refresh twice.
+        """
+
+    return get_or_set(
+        profile_key(user.pk), lambda: SpotifyProfile.objects.defer(*SECRET_PROFILE_FIELDS).filter(user=user).first()
+    )
+
+
+async def aget_profile(user):
+    """
+        Async counterpart of `get_profile`.
+        """
+
+    return await aget_or_set(
+        profile_key(user.pk), lambda: SpotifyProfile.objects.defer(*SECRET_PROFILE_FIELDS).filter(user=user).afirst()
+    )
+
+
+def forget_user(user_id):
+    """
+        Drop everything cached for a user: the user row, their Spotify profile and their newest history page.
+        """
+
+    invalidate(user_key(user_id), profile_key(user_id), history_key(user_id))
+
+
+def forget_wraps(wraps):
+    """
+        Drop the cached history pages and replay lookups that created or deleted wraps make stale.
+
+        Args:
+            wraps (Iterable[SpotifyWrap]): The wraps; those without an ID only invalidate their user's history.
+        """
+
+    keys = set()
+    for wrap in wraps:
+        keys.add(history_key(wrap.user_id))
+        if wrap.pk is not None:
+            keys.add(replay_key(wrap.user_id, wrap.pk))
+    if keys:
+        invalidate(*keys)
@@ -0,0 +1,243 @@
+import json
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Album, Artist, AudioFeatures, Track
+from .rate_limit import get_redis
+from .spotify_cache import LocMemLRUBackend
+
+# Catalog models by kind; every kind is keyed by Spotify ID
+MODELS = {
+    'artists': Artist,
+    'albums': Album,
+    'tracks': Track,
+    'audio_features': AudioFeatures,
+}
+
+# Counters reported by `get_stats`: where each looked-up entry was found
+STAT_NAMES = ('local_hits', 'shared_hits', 'db_hits', 'misses')
+
+_local = None
+_local_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _fields(kind):
+    # Cached columns, in a fixed order; the first one is the Spotify ID
+    return [field.attname for field in MODELS[kind]._meta.concrete_fields]
+
+
+def _values(kind, instance):
+    return [getattr(instance, name) for name in _fields(kind)]
+
+
+def _instance(kind, values):
+    return MODELS[kind](**dict(zip(_fields(kind), values)))
+
+
+def _shared_key(kind, spotify_id):
+    return f"catalog:{kind}:{spotify_id}"
+
+
+def _get_local():
+    """
+        Return this process's LRU of catalog entries, creating it on first use.
+        """
+
+    global _local
+    if _local is None:
+        with _local_lock:
+            if _local is None:
+                _local = LocMemLRUBackend(settings.CATALOG_LOCAL_MAX_ENTRIES)
+    return _local
+
+
+def _record(counts):
+    with _stats_lock:
+        _stats.update(counts)
+
+
+def _shared_get(kind, ids):
+    import redis
+
+    client = get_redis()
+    if client is None or not ids:
+        return {}
+    try:
+        values = client.mget([_shared_key(kind, spotify_id) for spotify_id in ids])
+    except redis.RedisError as e:
+        logging.warning(f"Shared catalog cache unavailable: {e}")
+        return {}
+    return {spotify_id: json.loads(value) for spotify_id, value in zip(ids, values) if value is not None}
+
+
+def _shared_set(kind, entries):
+    import redis
+
+    client = get_redis()
+    if client is None or not entries:
+        return
+    try:
+        pipeline = client.pipeline(transaction=False)
+        for spotify_id, values in entries.items():
+            pipeline.set(_shared_key(kind, spotify_id), json.dumps(values), ex=settings.CATALOG_SHARED_TTL)
+        pipeline.execute()
+    except redis.RedisError as e:
+        logging.warning(f"Shared catalog cache unavailable: {e}")
+
+
+def _fill(kind, entries, shared=True):
+    local = _get_local()
+    for spotify_id, values in entries.items():
+        local.set(_shared_key(kind, spotify_id), values, settings.CATALOG_LOCAL_TTL)
+    if shared:
+        _shared_set(kind, entries)
+
+
+def get_many(kind, ids):
+    """
+        Look up catalog entries by Spotify ID: in this process's LRU, then in the cache shared by
+        every process (Redis, when configured), then in the database.
+
+        Entries found in a lower layer are copied into the layers above it; rows read from the database
+        only once the current transaction commits, so the caches never hold rows that may be rolled
+        back. IDs found nowhere are not remembered, so they are looked up in the database again next time.
+
+        Args:
+            kind (str): `artists`, `albums`, `tracks` or `audio_features`.
+            ids (Iterable[str]): Spotify IDs.
+
+        Returns:
+            dict: Model instances keyed by Spotify ID, for the IDs that exist. Related objects are not
+            loaded; see `get_tracks` for tracks with their albums.
+        """
+
+    local = _get_local()
+    found = {}
+    missing = []
+    for spotify_id in dict.fromkeys(ids):
+        values = local.get(_shared_key(kind, spotify_id))
+        if values is not None:
+            found[spotify_id] = values
+        else:
+            missing.append(spotify_id)
+    counts = Counter(local_hits=len(found))
+
+    shared = _shared_get(kind, missing)
+    counts['shared_hits'] = len(shared)
+    missing = [spotify_id for spotify_id in missing if spotify_id not in shared]
+
+    from_db = {}
+    if missing:
+        from_db = {
+            spotify_id: _values(kind, instance) for spotify_id, instance in MODELS[kind].objects.in_bulk(missing).items()
+        }
+        counts['db_hits'] = len(from_db)
+        counts['misses'] = len(missing) - len(from_db)
+        if from_db:
+            transaction.on_commit(lambda: _fill(kind, from_db))
+
+    _fill(kind, shared, shared=False)
+    found.update(shared)
+    found.update(from_db)
+    _record(counts)
+    return {spotify_id: _instance(kind, values) for spotify_id, values in found.items()}
+
+
+def get_tracks(ids):
+    """
+        Look up tracks like `get_many`, with their albums attached.
+        """
+
+    tracks = get_many('tracks', ids)
+    albums = get_many('albums', {track.album_id for track in tracks.values() if track.album_id})
+    for track in tracks.values():
+        track.album = albums.get(track.album_id)
+    return tracks
+
+
+def put_many(kind, instances):
+    """
+        Store catalog entries that were just saved to the database in the LRU and the shared cache.
+
+        Inside a transaction the caches are only updated once it commits, so they never hold rows
+        that were rolled back.
+
+        Args:
+            kind (str): `artists`, `albums`, `tracks` or `audio_features`.
+            instances (Iterable[Model]): The saved model instances.
+        """
+
+    entries = {instance.pk: _values(kind, instance) for instance in instances}
+    if entries:
+        transaction.on_commit(lambda: _fill(kind, entries))
+
+
+def warm(kind, ids):
+    """
+        Copy catalog entries from the database into the shared cache and this process's LRU,
+        restarting their TTL.
+
+        Args:
+            kind (str): `artists`, `albums`, `tracks` or `audio_features`.
+            ids (list): Spotify IDs.
+
+        Returns:
+            list: The instances found in the database.
+        """
+
+    instances = list(MODELS[kind].objects.filter(pk__in=ids))
+    put_many(kind, instances)
+    return instances
+
+
+def forget(kind, ids):
+    """
+        Drop catalog entries from this process's LRU and from the shared cache, e.g. once deleted.
+
+        Other processes keep their LRU copy for at most `CATALOG_LOCAL_TTL` seconds.
+        """
+
+    import redis
+
+    local = _get_local()
+    keys = [_shared_key(kind, spotify_id) for spotify_id in ids]
+    for key in keys:
+        local.delete(key)
+    client = get_redis()
+    if client is not None and keys:
+        try:
+            client.delete(*keys)
+        except redis.RedisError as e:
+            logging.warning(f"Shared catalog cache unavailable: {e}")
+
+
+def clear_local():
+    """
+        Empty this process's LRU, e.g. between tests.
+        """
+
+    _get_local().clear()
+
+
+def get_stats():
+    """
+        Return this process's catalog lookup counters.
+
+        Returns:
+            dict: Counts of entries found in this process's LRU (`local_hits`), in the shared cache
+            (`shared_hits`), in the database (`db_hits`) or nowhere (`misses`), the share served from
+            either cache (`hit_rate`) and the LRU's current size.
+        """
+
+    with _stats_lock:
+        stats = {name: _stats[name] for name in STAT_NAMES}
+    lookups = sum(stats.values())
+    stats['hit_rate'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+    stats['local_entries'] = len(_get_local().entries)
+    return stats
@@ -0,0 +1,112 @@
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# The read replica in settings.DATABASES, present when DATABASE_REPLICA_URL is set
+REPLICA_ALIAS = 'replica'
+
+# Cookie holding the Unix time until which a user's reads stay on the primary after a write
+PRIMARY_COOKIE = 'read_primary_until'
+
+# The database reads go to while a replica-routed view runs; None means the primary
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def _reads_primary(request):
+    # Right after generating a wrap, the replica may not have it yet
+    try:
+        return float(request.COOKIES.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _read_alias_for(request):
+    if request.method not in ('GET', 'HEAD') or not replica_configured() or _reads_primary(request):
+        return None
+    return REPLICA_ALIAS
+
+
+def read_from_replica(view_func):
+    """
+        Decorator for read-only views whose queries can be served by the read replica.
+
+        Only GET and HEAD requests are routed, and only when a replica is configured and the user has
+        no recent write pinned to the primary (see `pin_reads_to_primary`). Writes always go to the
+        primary. Works for both sync and async views.
+
+        Args:
+            view_func (callable): The view to wrap.
+
+        Returns:
+            callable: The wrapped view.
+        """
+
+    if iscoroutinefunction(view_func):
+        async def _view_wrapper(request, *args, **kwargs):
+            token = _read_alias.set(_read_alias_for(request))
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                _read_alias.reset(token)
+
+        markcoroutinefunction(_view_wrapper)
+    else:
+        def _view_wrapper(request, *args, **kwargs):
+            token = _read_alias.set(_read_alias_for(request))
+            try:
+                return view_func(request, *args, **kwargs)
+            finally:
+                _read_alias.reset(token)
+
+    return wraps(view_func)(_view_wrapper)
+
+
+def pin_reads_to_primary(response):
+    """
+        Keep the user's replica-routed reads on the primary for `settings.DATABASE_REPLICA_LAG` seconds.
+
+        Called on the responses of views that write what the user is about to read, such as a new wrap,
+        so history and replay never show a replica that has not caught up yet.
+
+        Args:
+            response (HttpResponse): The response to set the cookie on.
+
+        Returns:
+            HttpResponse: The same response.
+        """
+
+    if replica_configured():
+        lag = settings.DATABASE_REPLICA_LAG
+        response.set_cookie(PRIMARY_COOKIE, str(int(time.time()) + lag), max_age=lag, httponly=True,
+                            samesite='Lax')
+    return response
+
+
+class ReplicaRouter:
+    """
+        Send the reads of views decorated with `read_from_replica` to the replica, and everything else
+        to the primary.
+
+        The replica is a copy of the primary, so relations between objects loaded from either are
+        allowed, and migrations only run on the primary.
+        """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,120 @@
+import logging
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.shortcuts import redirect
+
+from .caching import aget_profile, get_profile
+from .tokens import aensure_valid_token, ensure_valid_token
+
+
+async def aget_user(request):
+    """
+        Resolve the authenticated user without blocking the event loop.
+
+        The resolved user is also set as `request.user`, so template context processors never
+        have to query the ORM from async code.
+        """
+
+    user = await request.auser()
+    request.user = user
+    return user
+
+
+def _get_profile(request):
+    """
+        Return the user's Spotify profile, looking it up once per request through the default cache.
+        """
+
+    if getattr(request, 'spotify_profile', None) is None:
+        request.spotify_profile = get_profile(request.user)
+    return request.spotify_profile
+
+
+async def _aget_profile(request):
+    """
+        Async counterpart of `_get_profile`.
+        """
+
+    if getattr(request, 'spotify_profile', None) is None:
+        user = await aget_user(request)
+        request.spotify_profile = await aget_profile(user)
+    return request.spotify_profile
+
+
+def _no_profile():
+    logging.warning("No Spotify profile found for the user")
+    return redirect('spotify_connect')
+
+
+def _refresh_failed():
+    logging.error("Failed to refresh token. Redirecting to Spotify connect.")
+    return redirect('spotify_connect')
+
+
+def spotify_profile_required(view_func):
+    """
+        Decorator for views that need the user's linked Spotify profile but do not call Spotify themselves.
+
+        The profile is set as `request.spotify_profile`; users without one are redirected to the
+        Spotify connection page. Works for both sync and async views and must be applied below
+        `login_required`.
+
+        Args:
+            view_func (callable): The view to wrap.
+
+        Returns:
+            callable: The wrapped view.
+        """
+
+    if iscoroutinefunction(view_func):
+        async def _view_wrapper(request, *args, **kwargs):
+            if not await _aget_profile(request):
+                return _no_profile()
+            return await view_func(request, *args, **kwargs)
+
+        markcoroutinefunction(_view_wrapper)
+    else:
+        def _view_wrapper(request, *args, **kwargs):
+            if not _get_profile(request):
+                return _no_profile()
+            return view_func(request, *args, **kwargs)
+
+    return wraps(view_func)(_view_wrapper)
+
+
+def spotify_token_required(view_func):
+    """
+        Decorator for views that call the Spotify API on the user's behalf.
+
+        Like `spotify_profile_required`, but also makes sure the profile's access token is usable,
+        refreshing it first if it is expired or about to expire. Only views that actually talk to
+        Spotify should opt in, so pages served from the database never wait on accounts.spotify.com.
+
+        Args:
+            view_func (callable): The view to wrap.
+
+        Returns:
+            callable: The wrapped view.
+        """
+
+    if iscoroutinefunction(view_func):
+        async def _view_wrapper(request, *args, **kwargs):
+            profile = await _aget_profile(request)
+            if not profile:
+                return _no_profile()
+            if not await aensure_valid_token(profile):
+                return _refresh_failed()
+            return await view_func(request, *args, **kwargs)
+
+        markcoroutinefunction(_view_wrapper)
+    else:
+        def _view_wrapper(request, *args, **kwargs):
+            profile = _get_profile(request)
+            if not profile:
+                return _no_profile()
+            if not ensure_valid_token(profile):
+                return _refresh_failed()
+            return view_func(request, *args, **kwargs)
+
+    return wraps(view_func)(_view_wrapper)
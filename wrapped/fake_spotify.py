@@ -0,0 +1,431 @@
+import hashlib
+import json
+import random
+import secrets
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+# Spotify lists the ~185 markets a track or album is available in, which makes up most of a track's size
+MARKETS = [f"{chr(65 + i // 26)}{chr(65 + i % 26)}" for i in range(185)]
+
+# Most items the paged endpoints return, and how many items the fake user has on each of them
+MAX_LIMIT = 50
+
+# How many artists the fake user follows, so that paging needs several cursors
+FOLLOWED_ARTISTS = 120
+
+# Where each time range of the fake user's top items starts, so the ranges differ but overlap
+TIME_RANGE_OFFSETS = {'short_term': 5, 'medium_term': 0, 'long_term': 10}
+
+
+def _image(seed, size=640):
+    """
+        Build a Spotify-style image object.
+
+        Args:
+            seed (str): A value used to make the URL unique.
+            size (int): The width and height of the image.
+
+        Returns:
+            dict: An image object with `url`, `height` and `width`.
+        """
+
+    return {'url': f"https://i.scdn.co/image/{seed}-{size}", 'height': size, 'width': size}
+
+
+def fake_artist(index):
+    """
+        Build a fake artist object shaped like the Spotify Web API's full artist object.
+
+        Args:
+            index (int): The position of the artist, used to make its fields unique.
+
+        Returns:
+            dict: The artist object.
+        """
+
+    artist_id = f"artist{index:04d}"
+    return {
+        'id': artist_id,
+        'name': f"Artist {index}",
+        'type': 'artist',
+        'uri': f"spotify:artist:{artist_id}",
+        'href': f"https://api.spotify.com/v1/artists/{artist_id}",
+        'external_urls': {'spotify': f"https://open.spotify.com/artist/{artist_id}"},
+        'followers': {'href': None, 'total': 1000 * (index + 1)},
+        'genres': ['pop', 'indie pop'] if index % 2 else ['rock', 'alt rock'],
+        'images': [_image(artist_id, size) for size in (640, 320, 160)],
+        'popularity': 50 + index % 50,
+    }
+
+
+def fake_track(index):
+    """
+        Build a fake track object shaped like the Spotify Web API's full track object.
+
+        Args:
+            index (int): The position of the track, used to make its fields unique.
+
+        Returns:
+            dict: The track object.
+        """
+
+    track_id = f"track{index:04d}"
+    album_id = f"album{index // 2:04d}"
+    artist = fake_artist(index % 7)
+    return {
+        'id': track_id,
+        'name': f"Track {index}",
+        'type': 'track',
+        'uri': f"spotify:track:{track_id}",
+        'duration_ms': 180000 + index * 1000,
+        'explicit': False,
+        'popularity': 40 + index % 60,
+        'artists': [{key: artist[key] for key in ('id', 'name', 'type', 'uri', 'href', 'external_urls')}],
+        'album': {
+            'id': album_id,
+            'name': f"Album {index // 2}",
+            'album_type': 'album',
+            'release_date': '2024-01-01',
+            'images': [_image(album_id, size) for size in (640, 300, 64)],
+            'available_markets': MARKETS,
+        },
+        'available_markets': MARKETS,
+        'external_ids': {'isrc': f"USFAKE{index:06d}"},
+        'preview_url': f"https://p.scdn.co/mp3-preview/{track_id}",
+    }
+
+
+def fake_audio_features(track_id):
+    """
+        Build a fake audio features object for a track, derived from its ID so repeated calls agree.
+
+        Args:
+            track_id (str): The Spotify ID of the track.
+
+        Returns:
+            dict: The audio features object.
+        """
+
+    digest = hashlib.md5(track_id.encode()).digest()
+    features = {
+        name: round(digest[i] / 255, 3)
+        for i, name in enumerate(('danceability', 'energy', 'valence', 'acousticness',
+                                  'instrumentalness', 'speechiness', 'liveness'))
+    }
+    return {'id': track_id, 'type': 'audio_features', 'tempo': 60 + digest[7] % 120, **features}
+
+
+def _fake_by_id(build, prefix, spotify_id):
+    # Rebuild the fake object an ID was generated for, or None for an unknown ID, like Spotify does
+    suffix = spotify_id[len(prefix):]
+    return build(int(suffix)) if spotify_id.startswith(prefix) and suffix.isdigit() else None
+
+
+# The fake user's play history: one play per minute, newest first
+FAKE_PLAYS = [
+    {'track': fake_track(i), 'played_at': f"2024-11-30T12:{i:02d}:00.000Z"} for i in range(9, -1, -1)
+]
+
+
+def _limit(query, default=20):
+    # Spotify caps page sizes at 50
+    return min(int(query.get('limit', [default])[0]), MAX_LIMIT)
+
+
+def fake_top_items(build, query):
+    """
+        Build the paging object of `/me/top/artists` or `/me/top/tracks`.
+
+        Args:
+            build (callable): `fake_artist` or `fake_track`.
+            query (dict): The parsed query string, with optional `limit`, `offset` and `time_range`.
+
+        Returns:
+            dict: The paging object with `items`.
+        """
+
+    start = TIME_RANGE_OFFSETS.get(query.get('time_range', ['medium_term'])[0], 0)
+    start += int(query.get('offset', [0])[0])
+    return {'items': [build(i) for i in range(start, start + _limit(query))], 'limit': _limit(query)}
+
+
+def fake_followed_artists(query):
+    """
+        Build the cursor-based paging object of `/me/following?type=artist`.
+
+        Args:
+            query (dict): The parsed query string, with optional `limit` and `after` (the last artist ID
+                of the previous page).
+
+        Returns:
+            dict: `{'artists': paging object}` with `items`, `cursors`, `next` and `total`.
+        """
+
+    after = query.get('after', [None])[0]
+    start = int(after[len('artist'):]) + 1 if after else 0
+    end = min(start + _limit(query), FOLLOWED_ARTISTS)
+    items = [fake_artist(i) for i in range(start, end)]
+    last = items[-1]['id'] if items else None
+    more = end < FOLLOWED_ARTISTS
+    return {'artists': {
+        'items': items,
+        'cursors': {'after': last if more else None},
+        'next': f"/v1/me/following?type=artist&limit={_limit(query)}&after={last}" if more else None,
+        'limit': _limit(query),
+        'total': FOLLOWED_ARTISTS,
+    }}
+
+
+def fake_play_history(limit, after=None):
+    """
+        Build a cursor-based paging object of recently played tracks, like `/me/player/recently-played`.
+
+        Args:
+            limit (int): The most plays returned.
+            after (int, optional): Only return plays after this Unix timestamp in milliseconds.
+
+        Returns:
+            dict: The paging object with `items`, newest first, and `cursors`.
+        """
+
+    def played_at_ms(play):
+        return int(datetime.fromisoformat(play['played_at']).timestamp() * 1000)
+
+    plays = [play for play in FAKE_PLAYS if after is None or played_at_ms(play) > after][:limit]
+    cursors = {'after': str(played_at_ms(plays[0])), 'before': str(played_at_ms(plays[-1]))} if plays else None
+    return {'items': plays, 'cursors': cursors, 'limit': limit}
+
+
+def fake_token(grant):
+    """
+        Build the response of the accounts service's `/api/token` endpoint.
+
+        Args:
+            grant (dict): The form fields of the token request.
+
+        Returns:
+            tuple: The HTTP status and the JSON payload; an error payload for a malformed request.
+        """
+
+    grant_type = grant.get('grant_type')
+    if grant_type == 'authorization_code' and grant.get('code'):
+        refresh_token = f"fake-refresh-{grant['code']}"
+    elif grant_type == 'refresh_token' and grant.get('refresh_token'):
+        # Spotify keeps the refresh token unless it rotates it, in which case it sends a new one
+        refresh_token = None
+    else:
+        return 400, {'error': 'invalid_grant', 'error_description': 'Invalid authorization code or refresh token'}
+
+    token = {
+        'access_token': f"fake-access-{secrets.token_hex(16)}",
+        'token_type': 'Bearer',
+        'scope': 'user-top-read user-read-recently-played user-follow-read',
+        'expires_in': 3600,
+    }
+    if refresh_token:
+        token['refresh_token'] = refresh_token
+    return 200, token
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    """
+        Request handler answering the subset of the Spotify Web API and accounts service used by the app.
+
+        Every request waits for the server's latency first, and may then be answered with an injected
+        5xx error or 429, as configured on `FakeSpotifyServer`.
+        """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        """
+            Serve a canned payload for the requested endpoint.
+            """
+
+        if not self._begin():
+            return
+        url = urlparse(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+        ids = [spotify_id for spotify_id in query.get('ids', [''])[0].split(',') if spotify_id]
+        if path == '/authorize':
+            self._authorize(query)
+            return
+        routes = {
+            '/v1/me': lambda: {'id': 'fakeuser', 'display_name': 'Fake User'},
+            '/v1/me/top/artists': lambda: fake_top_items(fake_artist, query),
+            '/v1/me/top/tracks': lambda: fake_top_items(fake_track, query),
+            '/v1/me/player/recently-played': lambda: fake_play_history(
+                _limit(query), int(query['after'][0]) if 'after' in query else None
+            ),
+            '/v1/me/following': lambda: fake_followed_artists(query),
+            '/v1/artists': lambda: {'artists': [_fake_by_id(fake_artist, 'artist', i) for i in ids]},
+            '/v1/tracks': lambda: {'tracks': [_fake_by_id(fake_track, 'track', i) for i in ids]},
+            '/v1/audio-features': lambda: {'audio_features': [fake_audio_features(i) for i in ids]},
+        }
+        if path not in routes:
+            self._send_json(404, {'error': {'status': 404, 'message': 'Not found'}})
+            return
+        self._send_json(200, routes[path]())
+
+    def do_POST(self):
+        """
+            Issue tokens from `/api/token`, like the accounts service does for both grant types.
+            """
+
+        if not self._begin():
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        if urlparse(self.path).path != '/api/token':
+            self._send_json(404, {'error': {'status': 404, 'message': 'Not found'}})
+            return
+        grant = {key: values[0] for key, values in parse_qs(body).items()}
+        self._send_json(*fake_token(grant))
+
+    def _begin(self):
+        """
+            Wait for the configured latency and inject a failure if one is due.
+
+            Returns:
+                bool: True if the request should be answered normally.
+            """
+
+        server = self.server
+        time.sleep(server.latency + (server.jitter * server.random() if server.jitter else 0))
+        with server.lock:
+            server.requests_served += 1
+        fault = server.pick_fault()
+        if fault == 'throttle':
+            # The body must be read before answering, or the client sees a reset connection
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            self._send_json(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                            headers={'Retry-After': str(server.retry_after)})
+            return False
+        if fault == 'error':
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            self._send_json(503, {'error': {'status': 503, 'message': 'Service unavailable'}})
+            return False
+        return True
+
+    def _authorize(self, query):
+        # Consent is implied: send the user straight back to the app with a code
+        params = {'code': 'fake-code'}
+        if 'state' in query:
+            params['state'] = query['state'][0]
+        self.send_response(302)
+        self.send_header('Location', f"{query.get('redirect_uri', ['/'])[0]}?{urlencode(params)}")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_json(self, status, payload, headers=None):
+        """
+            Write a JSON response with the given status code, answering 304 when the client's ETag still matches.
+            """
+
+        body = json.dumps(payload).encode()
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 200:
+            self.send_header('ETag', etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep benchmark output readable
+        pass
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # Accept bursts from load tests without dropping connections
+
+    def random(self):
+        with self.lock:
+            return self.rng.random()
+
+    def pick_fault(self):
+        """
+            Decide whether the next request fails: returns 'throttle', 'error' or None.
+            """
+
+        if not self.throttle_rate and not self.error_rate:
+            return None
+        roll = self.random()
+        if roll < self.throttle_rate:
+            return 'throttle'
+        if roll < self.throttle_rate + self.error_rate:
+            return 'error'
+        return None
+
+
+class FakeSpotifyServer:
+    """
+        A local stand-in for the Spotify Web API and accounts service, run on a background thread.
+
+        Use it as a context manager and point `settings.SPOTIFY_API_BASE_URL` at `base_url` and
+        `settings.SPOTIFY_ACCOUNTS_BASE_URL` at `accounts_url`.
+
+        Args:
+            latency (float): Seconds every request waits before being answered.
+            jitter (float): Up to this many extra seconds, drawn at random for each request.
+            error_rate (float): Share of requests answered with a 503.
+            throttle_rate (float): Share of requests answered with a 429.
+            retry_after (int): The `Retry-After` of injected 429s, in seconds.
+            seed (int, optional): Seed of the jitter and fault draws, for repeatable runs.
+            host (str): The interface to listen on.
+            port (int): The port to listen on; 0 picks a free one.
+        """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1, seed=None,
+                 host='127.0.0.1', port=0):
+        self.httpd = _FakeHTTPServer((host, port), FakeSpotifyHandler)
+        self.httpd.latency = latency
+        self.httpd.jitter = jitter
+        self.httpd.error_rate = error_rate
+        self.httpd.throttle_rate = throttle_rate
+        self.httpd.retry_after = retry_after
+        self.httpd.rng = random.Random(seed)
+        self.httpd.lock = threading.Lock()
+        self.httpd.requests_served = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def requests_served(self):
+        return self.httpd.requests_served
+
+    @property
+    def accounts_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        return f"{self.accounts_url}/v1"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
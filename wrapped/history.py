@@ -0,0 +1,116 @@
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .loaders import CatalogLoader
+from .models import Artist, PlayEvent
+from .spotify_api import get_recently_played_after
+from .stats import apply_plays, lock_listening_stats
+from .storage import album_from_api, save_catalog, simplified_artist_from_api, track_from_api
+
+# Plays per request; the most Spotify allows
+PAGE_SIZE = 50
+
+
+def record_plays(user_id, items):
+    """
+        Store play history items as `PlayEvent`s, skipping plays that are already stored.
+
+        The played tracks and their albums are upserted into the catalog first. Their artists are
+        only inserted when missing, since the simplified artists on a track carry no genres or images.
+
+        Args:
+            user_id (int): The ID of the user who played them.
+            items (list): Play history objects as returned by Spotify.
+
+        Returns:
+            list: The `PlayEvent`s that were new.
+        """
+
+    # Tracks without an ID (e.g. local files) cannot be stored in the catalog
+    items = [item for item in items if item['track'].get('id')]
+    if not items:
+        return []
+
+    catalog = {'artists': {}, 'albums': {}, 'tracks': {}}
+    artists = {}
+    plays = {}
+    for item in items:
+        track = item['track']
+        artists.update(
+            (artist['id'], simplified_artist_from_api(artist))
+            for artist in track['artists'] if artist.get('id')
+        )
+        if track.get('album'):
+            catalog['albums'][track['album']['id']] = album_from_api(track['album'])
+        catalog['tracks'][track['id']] = track_from_api(track)
+        plays[parse_datetime(item['played_at'])] = track['id']
+
+    existing = set(PlayEvent.objects.filter(user_id=user_id, played_at__in=plays).values_list('played_at', flat=True))
+    events = [
+        PlayEvent(user_id=user_id, track_id=track_id, played_at=played_at)
+        for played_at, track_id in sorted(plays.items()) if played_at not in existing
+    ]
+    save_catalog(catalog)
+    Artist.objects.bulk_create(artists.values(), ignore_conflicts=True)
+    # A concurrent ingestion of the same user may have stored some of them in the meantime
+    PlayEvent.objects.bulk_create(events, ignore_conflicts=True)
+    return events
+
+
+def ingest_recent_plays(profile, max_pages=10):
+    """
+        Fetch the plays made since the profile's last ingestion and append them to its listening history.
+
+        Pages through `/me/player/recently-played` with the `after` cursor saved on the profile, so each
+        call only fetches plays that are not stored yet. Spotify only returns a user's 50 most recent
+        plays, so nothing is lost as long as users play fewer than 50 tracks between two ingestions.
+        The new plays are added to the user's `ListeningStats` in the transaction that stores them.
+
+        Args:
+            profile (SpotifyProfile): The profile to ingest for; its access token must be valid.
+            max_pages (int): The most pages fetched in one call.
+
+        Returns:
+            list: The new `PlayEvent`s, oldest first.
+
+        Raises:
+            requests.RequestException: If Spotify could not be reached.
+            SpotifyRateLimited: If Spotify kept throttling us.
+        """
+
+    after = profile.recently_played_after
+    new_events = []
+    for _ in range(max_pages):
+        page = get_recently_played_after(profile.access_token, after=after, limit=PAGE_SIZE)
+        items = page.get('items', []) if page else []
+        if not items:
+            break
+
+        # Load the genres of newly seen artists before the plays are counted, outside the transaction
+        loader = CatalogLoader(profile.access_token)
+        loader.want('artists', [artist['id'] for item in items for artist in item['track']['artists'] if artist.get('id')])
+        loader.load()
+
+        with transaction.atomic():
+            # Locking the stats first serializes ingestions of the same user
+            stats = lock_listening_stats(profile.user_id)
+            events = record_plays(profile.user_id, items)
+            apply_plays(stats, events)
+            new_events += events
+            # The `after` cursor is the newest play of the page
+            cursor = (page.get('cursors') or {}).get('after')
+            newest = max(parse_datetime(item['played_at']) for item in items)
+            after = int(cursor) if cursor else int(newest.timestamp() * 1000)
+            profile.recently_played_after = after
+            profile.save(update_fields=['recently_played_after'])
+
+        if len(items) < PAGE_SIZE:
+            break
+
+    profile.history_synced_at = timezone.now()
+    profile.save(update_fields=['history_synced_at'])
+    logging.info(f"Ingested {len(new_events)} new plays for profile {profile.pk}")
+    return new_events
@@ -0,0 +1,165 @@
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import SpotifyProfile, WrapJob
+from .tokens import ensure_valid_token
+from .wraps import WrapBuildError, create_wrap
+
+
+def enqueue_wrap_job(user):
+    """
+        Queue a wrap generation job for the user, unless one is already queued or running.
+
+        Args:
+            user (User): The user to generate a wrap for.
+
+        Returns:
+            WrapJob: The new job, or the user's existing active job.
+        """
+
+    job = WrapJob.objects.filter(user=user, status__in=WrapJob.ACTIVE_STATUSES).first()
+    if job:
+        return job
+    try:
+        with transaction.atomic():
+            return WrapJob.objects.create(user=user)
+    except IntegrityError:
+        # Another request queued a job for this user in the meantime
+        return WrapJob.objects.get(user=user, status__in=WrapJob.ACTIVE_STATUSES)
+
+
+def claim_next_job():
+    """
+        Atomically move the oldest pending job to running, so that no two workers pick the same job.
+
+        Returns:
+            WrapJob | None: The claimed job, or None if the queue is empty.
+        """
+
+    candidates = WrapJob.objects.filter(status=WrapJob.PENDING).order_by('created_at').values_list('id', flat=True)
+    for job_id in candidates[:10]:
+        now = timezone.now()
+        claimed = WrapJob.objects.filter(id=job_id, status=WrapJob.PENDING).update(
+            status=WrapJob.RUNNING, started_at=now, heartbeat_at=now, progress=10
+        )
+        if claimed:
+            return WrapJob.objects.select_related('user').get(id=job_id)
+    return None
+
+
+def heartbeat_jobs(job_ids):
+    """
+        Record that the worker running some jobs is still alive, so they are not requeued as stale.
+
+        Args:
+            job_ids (iterable): The IDs of the jobs the worker is running.
+
+        Returns:
+            int: The number of jobs still running.
+        """
+
+    return WrapJob.objects.filter(id__in=list(job_ids), status=WrapJob.RUNNING).update(heartbeat_at=timezone.now())
+
+
+def requeue_stale_jobs(timeout):
+    """
+        Put jobs back in the queue whose worker died mid-run.
+
+        A job is stale once its worker has not sent a heartbeat (see `heartbeat_jobs`) for `timeout`,
+        however long the job itself has been running.
+
+        Args:
+            timeout (timedelta): How long a running job may go without a heartbeat before it is
+                considered abandoned.
+
+        Returns:
+            int: The number of jobs requeued.
+        """
+
+    # Jobs claimed before heartbeats were recorded only have their start time
+    return WrapJob.objects.alias(last_seen=Coalesce('heartbeat_at', 'started_at')).filter(
+        status=WrapJob.RUNNING, last_seen__lt=timezone.now() - timeout
+    ).update(status=WrapJob.PENDING, started_at=None, heartbeat_at=None, progress=0)
+
+
+def _finish(job, status, wrap=None, error=''):
+    job.status = status
+    job.wrap = wrap
+    job.error = error[:255]
+    job.progress = 100
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'wrap', 'error', 'progress', 'finished_at'])
+
+
+def run_job(job):
+    """
+        Generate and save the wrap for a claimed job, recording the outcome on the job.
+
+        Args:
+            job (WrapJob): A job in the running state.
+
+        Returns:
+            WrapJob: The finished job.
+        """
+
+    def report(percent):
+        WrapJob.objects.filter(id=job.id).update(progress=percent)
+
+    # Any error, including from the token refresh or the database, must finish the job; a job left
+    # running keeps the user from generating another wrap until it is requeued as stale
+    try:
+        profile = SpotifyProfile.objects.filter(user=job.user).first()
+        if not profile or not ensure_valid_token(profile):
+            _finish(job, WrapJob.FAILED, error=WrapBuildError.RECONNECT)
+            return job
+        try:
+            wrap = create_wrap(profile, progress=report)
+        except WrapBuildError as e:
+            _finish(job, WrapJob.FAILED, error=e.reason)
+        else:
+            _finish(job, WrapJob.DONE, wrap=wrap)
+    except Exception as e:
+        logging.exception(f"Wrap job {job.id} failed")
+        try:
+            _finish(job, WrapJob.FAILED, error=str(e) or e.__class__.__name__)
+        except Exception:
+            logging.exception(f"Could not record the failure of wrap job {job.id}; it is requeued once stale")
+    return job
+
+
+def queue_stats(sample_size=100):
+    """
+        Summarize the queue for monitoring.
+
+        Args:
+            sample_size (int): How many recently finished jobs to derive latencies from.
+
+        Returns:
+            dict: Queue `depth` (pending jobs), `running` jobs, `oldest_pending_seconds`, and the mean
+            and 95th percentile of end-to-end job latency (enqueue to finish) in seconds.
+        """
+
+    now = timezone.now()
+    oldest = WrapJob.objects.filter(status=WrapJob.PENDING).order_by('created_at').values_list(
+        'created_at', flat=True
+    ).first()
+    latencies = sorted(
+        (finished - created).total_seconds()
+        for created, finished in WrapJob.objects.filter(finished_at__isnull=False)
+        .order_by('-finished_at')
+        .values_list('created_at', 'finished_at')[:sample_size]
+    )
+    return {
+        'depth': WrapJob.objects.filter(status=WrapJob.PENDING).count(),
+        'running': WrapJob.objects.filter(status=WrapJob.RUNNING).count(),
+        'oldest_pending_seconds': (now - oldest).total_seconds() if oldest else 0,
+        'latency_mean_seconds': sum(latencies) / len(latencies) if latencies else None,
+        'latency_p95_seconds': latencies[round(0.95 * (len(latencies) - 1))] if latencies else None,
+        'failed_last_hour': WrapJob.objects.filter(
+            status=WrapJob.FAILED, finished_at__gte=now - timedelta(hours=1)
+        ).count(),
+    }
@@ -0,0 +1,118 @@
+import logging
+
+import requests
+
+from . import catalog as catalog_store
+from .models import AudioFeatures
+from .spotify_api import SEVERAL_ENDPOINTS, get_several
+from .spotify_client import SpotifyRateLimited
+from .storage import album_from_api, artist_from_api, audio_features_from_api, save_catalog, track_from_api
+
+
+def _known_artists(ids):
+    # Simplified artists are in the catalog but still miss their genres and image
+    return {
+        spotify_id: artist for spotify_id, artist in catalog_store.get_many('artists', ids).items()
+        if not artist.is_simplified
+    }
+
+
+def _known_tracks(ids):
+    return catalog_store.get_tracks(ids)
+
+
+def _known_audio_features(ids):
+    return catalog_store.get_many('audio_features', ids)
+
+
+def _save_artists(items):
+    catalog = {'artists': {item['id']: artist_from_api(item) for item in items}, 'albums': {}, 'tracks': {}}
+    save_catalog(catalog)
+    return catalog['artists']
+
+
+def _save_tracks(items):
+    catalog = {
+        'artists': {},
+        'albums': {item['album']['id']: album_from_api(item['album']) for item in items if item.get('album')},
+        'tracks': {item['id']: track_from_api(item) for item in items},
+    }
+    save_catalog(catalog)
+    for track in catalog['tracks'].values():
+        track.album = catalog['albums'].get(track.album_id)
+    return catalog['tracks']
+
+
+def _save_audio_features(items):
+    rows = {item['id']: audio_features_from_api(item) for item in items}
+    AudioFeatures.objects.bulk_create(rows.values(), ignore_conflicts=True)
+    catalog_store.put_many('audio_features', rows.values())
+    return rows
+
+
+class CatalogLoader:
+    """
+        Gather the catalog objects needed while building a wrap, then load them all at once.
+
+        Callers queue IDs with `want` as they discover them; `load` looks them up in the shared,
+        cross-user catalog (see `catalog.get_many`) and fetches only the misses from Spotify, with
+        the several-IDs endpoints in full-size chunks, all chunks concurrently. What was fetched is stored in the
+        catalog, so the next wrap mentioning the same artists or tracks makes no request at all.
+
+        A failed fetch is logged and the objects already in the catalog are still returned.
+
+        Args:
+            access_token (str): The access token used for fetching the misses.
+        """
+
+    KINDS = {
+        'artists': (_known_artists, _save_artists),
+        'tracks': (_known_tracks, _save_tracks),
+        'audio_features': (_known_audio_features, _save_audio_features),
+    }
+
+    def __init__(self, access_token):
+        self.access_token = access_token
+        self._wanted = {kind: {} for kind in self.KINDS}
+        self.loaded = {kind: {} for kind in self.KINDS}
+
+    def want(self, kind, ids):
+        """
+            Queue IDs of one kind (`artists`, `tracks` or `audio_features`) for the next `load`.
+            """
+
+        self._wanted[kind].update((spotify_id, None) for spotify_id in ids if spotify_id not in self.loaded[kind])
+
+    def load(self):
+        """
+            Load every queued ID.
+
+            Returns:
+                dict: Model instances keyed by Spotify ID, for each kind; includes what earlier calls
+                loaded. IDs that Spotify does not know are left out.
+            """
+
+        misses = {}
+        for kind, wanted in self._wanted.items():
+            if not wanted:
+                continue
+            known = self.KINDS[kind][0](list(wanted))
+            self.loaded[kind].update(known)
+            misses[kind] = [spotify_id for spotify_id in wanted if spotify_id not in known]
+            wanted.clear()
+        misses = {kind: ids for kind, ids in misses.items() if ids}
+        if not misses:
+            return self.loaded
+
+        requests_made = sum(-(-len(ids) // SEVERAL_ENDPOINTS[kind][2]) for kind, ids in misses.items())
+        logging.info(f"Fetching catalog misses in {requests_made} request(s): "
+                     + ', '.join(f"{len(ids)} {kind}" for kind, ids in misses.items()))
+        try:
+            fetched = get_several(self.access_token, misses)
+        except (requests.RequestException, SpotifyRateLimited) as e:
+            logging.warning(f"Failed to fetch catalog objects from Spotify: {e}")
+            return self.loaded
+
+        for kind, items in fetched.items():
+            self.loaded[kind].update(self.KINDS[kind][1](items))
+        return self.loaded
@@ -0,0 +1,90 @@
+import math
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from wrapped.analytics import MOOD_FEATURES, genre_distribution, genre_diversity, mood_profile, top_genres
+from wrapped.storage import AUDIO_FEATURE_FIELDS
+
+
+def python_genre_analysis(artist_weights, artist_genres):
+    # Reference implementation: plain dict accumulation
+    totals = {}
+    for artist_id, weight in artist_weights.items():
+        for genre in artist_genres.get(artist_id) or []:
+            totals[genre] = totals.get(genre, 0) + weight
+    ranked = sorted(totals, key=lambda genre: (-totals[genre], genre))
+    positive = [weight for weight in totals.values() if weight > 0]
+    total = sum(positive)
+    entropy = -sum(w / total * math.log2(w / total) for w in positive) if len(positive) > 1 else 0.0
+    return totals, ranked[:5], entropy
+
+
+def python_mood(track_weights, features):
+    columns = [AUDIO_FEATURE_FIELDS.index(name) for name in MOOD_FEATURES]
+    sums = [0.0] * len(columns)
+    total = 0
+    for track_id, weight in track_weights.items():
+        row = features.get(track_id)
+        if row is None:
+            continue
+        total += weight
+        for i, column in enumerate(columns):
+            sums[i] += row[column] * weight
+    return {name: round(value / total, 3) for name, value in zip(MOOD_FEATURES, sums)}
+
+
+class Command(BaseCommand):
+    help = "Compare the NumPy listening analytics with a pure-Python implementation on synthetic listeners."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tracks', type=int, default=5000, help="Distinct tracks played per listener.")
+        parser.add_argument('--artists', type=int, default=2000, help="Distinct artists played per listener.")
+        parser.add_argument('--genres', type=int, default=400, help="Size of the genre vocabulary.")
+        parser.add_argument('--rounds', type=int, default=5, help="Timed repetitions of each analysis.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        genre_names = [f"genre {i}" for i in range(options['genres'])]
+        artist_genres = {
+            f"artist{i}": rng.sample(genre_names, rng.randint(0, 5)) for i in range(options['artists'])
+        }
+        artist_weights = {artist_id: rng.randint(1, 200) for artist_id in artist_genres}
+        features = {
+            f"track{i}": tuple(rng.random() for _ in AUDIO_FEATURE_FIELDS) for i in range(options['tracks'])
+        }
+        track_weights = {track_id: rng.randint(1, 50) for track_id in features}
+
+        def numpy_genres():
+            genres, weights = genre_distribution(artist_weights, artist_genres)
+            return genres, weights, top_genres(genres, weights), genre_diversity(weights)[0]
+
+        # Both implementations must agree before their timings mean anything
+        genres, weights, top, entropy = numpy_genres()
+        totals, python_top, python_entropy = python_genre_analysis(artist_weights, artist_genres)
+        assert top == python_top and math.isclose(entropy, python_entropy, rel_tol=1e-9)
+        assert np.allclose(weights, [totals[genre] for genre in genres])
+        assert mood_profile(track_weights, features) == python_mood(track_weights, features)
+
+        self.stdout.write(f"{options['tracks']} tracks, {options['artists']} artists, {options['genres']} genres, "
+                          f"{options['rounds']} rounds")
+        for name, vectorized, reference in (
+            ('Genres, top genres and entropy', numpy_genres,
+             lambda: python_genre_analysis(artist_weights, artist_genres)),
+            ('Mood averages', lambda: mood_profile(track_weights, features),
+             lambda: python_mood(track_weights, features)),
+        ):
+            numpy_ms = self._time(options['rounds'], vectorized)
+            python_ms = self._time(options['rounds'], reference)
+            self.stdout.write(f"{name}: NumPy {numpy_ms:.2f} ms, pure Python {python_ms:.2f} ms "
+                              f"({python_ms / numpy_ms:.1f}x)")
+
+    @staticmethod
+    def _time(rounds, analyze):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            analyze()
+        return (time.perf_counter() - start) / rounds * 1000
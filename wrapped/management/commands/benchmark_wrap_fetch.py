@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from wrapped.fake_spotify import FakeSpotifyServer
+from wrapped.spotify_api import WRAP_ENDPOINTS, fetch_wrap_payloads
+
+
+class Command(BaseCommand):
+    help = "Compare sequential and concurrent wrap fetching against a local stub Spotify server."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help="Simulated per-request latency of the stub server, in seconds.")
+        parser.add_argument('--rounds', type=int, default=5,
+                            help="Number of wraps to fetch in each mode.")
+
+    def handle(self, *args, **options):
+        latency = options['latency']
+        rounds = options['rounds']
+
+        with FakeSpotifyServer(latency=latency) as server, override_settings(
+            SPOTIFY_API_BASE_URL=server.base_url,
+            # Measure the fetch layer, not our own app-wide rate limit
+            SPOTIFY_RATE_LIMIT=1000000,
+            SPOTIFY_RATE_LIMIT_BURST=1000000,
+        ):
+            sequential = self._time(rounds, self._fetch_sequentially)
+            concurrent = self._time(rounds, self._fetch_concurrently)
+
+        self.stdout.write(f"Stub latency per call: {latency * 1000:.0f} ms, "
+                          f"{len(WRAP_ENDPOINTS)} endpoints, {rounds} rounds")
+        self.stdout.write(f"Sequential: {sequential * 1000:.1f} ms per wrap")
+        self.stdout.write(f"Concurrent: {concurrent * 1000:.1f} ms per wrap")
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {sequential / concurrent:.2f}x"))
+
+    @staticmethod
+    def _time(rounds, fetch):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            fetch('fake-access-token')
+        return (time.perf_counter() - start) / rounds
+
+    @staticmethod
+    def _fetch_sequentially(access_token):
+        return {name: fetch(access_token) for name, fetch in WRAP_ENDPOINTS.items()}
+
+    @staticmethod
+    def _fetch_concurrently(access_token):
+        results, errors = fetch_wrap_payloads(access_token)
+        if errors:
+            raise RuntimeError(f"Concurrent fetch failed: {errors}")
+        return results
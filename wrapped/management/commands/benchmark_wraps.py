@@ -0,0 +1,100 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.urls import reverse
+from django.utils import translation
+
+from wrapped import catalog
+from wrapped.benchmarks import add_baseline_arguments, check_baseline, format_summary, summarize
+from wrapped.fake_spotify import FakeSpotifyServer
+from wrapped.models import SpotifyProfile, SpotifyWrap
+
+SCENARIOS = ('generate', 'history', 'replay')
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the generate, history and replay pages one request at a time, in-process, against the fake "
+        "Spotify server and a throwaway test database, and compare p50/p95/p99 with a stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--rounds', type=int, default=30, help="Timed requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=3, help="Untimed requests before each scenario.")
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help="Simulated per-request latency of the fake Spotify server, in seconds.")
+        parser.add_argument('--generation-mode', choices=['inline', 'stream'], default='inline',
+                            help="WRAP_GENERATION_MODE used by the generate scenario.")
+        add_baseline_arguments(parser)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        databases = setup_databases(verbosity=0, interactive=False)
+        try:
+            with FakeSpotifyServer(latency=options['latency'], seed=0) as spotify, override_settings(
+                SPOTIFY_API_BASE_URL=spotify.base_url,
+                SPOTIFY_ACCOUNTS_BASE_URL=spotify.accounts_url,
+                # Measure the app, not our own app-wide rate limit
+                SPOTIFY_RATE_LIMIT=1000000,
+                SPOTIFY_RATE_LIMIT_BURST=1000000,
+                WRAP_GENERATION_MODE=options['generation_mode'],
+            ), translation.override(settings.LANGUAGES[0][0]):
+                results = self._run(options)
+        finally:
+            teardown_databases(databases, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f"Fake Spotify latency {options['latency'] * 1000:.0f} ms, {options['rounds']} rounds "
+                          f"after {options['warmup']} warm-up requests")
+        for scenario, summary in results.items():
+            self.stdout.write(format_summary(scenario, summary))
+        check_baseline('benchmark_wraps', results, options, self.stdout)
+
+    def _run(self, options):
+        catalog.clear_local()
+        count = options['warmup'] + options['rounds']
+        # One user per generated wrap, so every wrap misses the per-user Spotify response cache
+        clients = []
+        for i in range(count):
+            user = User.objects.create(username=f"benchmark{i}")
+            SpotifyProfile.objects.create(user=user, spotify_id=f"benchmark{i}", access_token="token",
+                                          refresh_token="refresh", expires_at=int(time.time()) + 3600)
+            client = Client()
+            client.force_login(user)
+            clients.append((user, client))
+
+        results = {}
+        # The other scenarios show the wraps generated here, so generate always runs
+        outcomes = [self._time(client, reverse('generate_wrap')) for _, client in clients]
+        if 'generate' in options['scenarios']:
+            results['generate'] = self._summarize(outcomes, options['warmup'])
+        for scenario in ('history', 'replay'):
+            if scenario not in options['scenarios']:
+                continue
+            outcomes = []
+            for user, client in clients:
+                if scenario == 'history':
+                    url = reverse('wrap_history')
+                else:
+                    url = reverse('replay_wrap', args=[SpotifyWrap.objects.filter(user=user).latest('id').id])
+                outcomes.append(self._time(client, url))
+            results[scenario] = self._summarize(outcomes, options['warmup'])
+        return results
+
+    @staticmethod
+    def _time(client, url):
+        start = time.perf_counter()
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response.status_code == 200, time.perf_counter() - start
+
+    @staticmethod
+    def _summarize(outcomes, warmup):
+        timed = outcomes[warmup:]
+        return summarize(timed, sum(seconds for _, seconds in timed))
@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from wrapped.bulk import pending_profiles, process_chunk, start_run
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a wrap for every linked Spotify profile, in chunks, resuming from the last checkpoint of "
+        "the run with the same --label. Spotify calls are bounded by SPOTIFY_RATE_LIMIT and "
+        "SPOTIFY_FETCH_WORKERS: a wrap takes about 12 calls, so 100k wraps in 8 hours need roughly 40 "
+        "requests per second."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--label', required=True,
+                            help="Name of the run, e.g. 2024-annual. Re-running a label resumes it.")
+        parser.add_argument('--since', type=datetime.fromisoformat,
+                            help="Skip users with a wrap created since this date (new runs only; default: now).")
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help="Profiles generated and saved together; the checkpoint advances per chunk.")
+        parser.add_argument('--workers', type=int, default=16,
+                            help="Wraps built at the same time.")
+        parser.add_argument('--limit', type=int, default=0,
+                            help="Stop after this many profiles (default: all).")
+
+    def handle(self, *args, **options):
+        since = options['since']
+        if since and timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        run = start_run(options['label'], since)
+        if run.finished_at:
+            raise CommandError(f"Run {run.label} already finished at {run.finished_at:%Y-%m-%d %H:%M}.")
+        if run.last_profile_id:
+            self.stdout.write(f"Resuming run {run.label} after profile {run.last_profile_id}")
+
+        profiles = pending_profiles(run)
+        total = profiles.count()
+        if options['limit']:
+            total = min(total, options['limit'])
+        self.stdout.write(f"{total} profile(s) to process with {options['workers']} workers "
+                          f"(Spotify limit {settings.SPOTIFY_RATE_LIMIT:g} req/s)")
+
+        start = time.perf_counter()
+        processed = 0
+        generated_before = run.generated
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='bulk-wrap') as pool:
+            while processed < total:
+                chunk = list(pending_profiles(run)[:min(options['chunk_size'], total - processed)])
+                if not chunk:
+                    break
+                process_chunk(run, chunk, pool)
+                processed += len(chunk)
+
+                elapsed = time.perf_counter() - start
+                rate = (run.generated - generated_before) / elapsed if elapsed else 0.0
+                eta = (total - processed) * elapsed / processed
+                self.stdout.write(
+                    f"{processed}/{total} profiles: {run.generated} generated, {run.failed} failed, "
+                    f"{run.skipped} skipped; {rate:.1f} wraps/s, ETA {eta / 60:.0f} min"
+                )
+
+        if not pending_profiles(run).exists():
+            run.finished_at = timezone.now()
+            run.save(update_fields=['finished_at'])
+            self.stdout.write(self.style.SUCCESS(f"Run {run.label} finished"))
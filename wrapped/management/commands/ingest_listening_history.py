@@ -0,0 +1,56 @@
+import time
+from datetime import timedelta
+
+import requests
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.utils import timezone
+
+from wrapped.history import ingest_recent_plays
+from wrapped.models import SpotifyProfile
+from wrapped.spotify_client import SpotifyRateLimited
+from wrapped.tokens import ensure_valid_token
+
+
+class Command(BaseCommand):
+    help = (
+        "Append the plays made since the last run to each active user's listening history. Run it from a "
+        "scheduler (e.g. Heroku Scheduler every 30 minutes) or keep it running with --interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--active-days', type=int, default=30,
+                            help="Only ingest for users who logged in within this many days.")
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Repeat every this many seconds instead of running once.")
+
+    def handle(self, *args, **options):
+        while True:
+            self._ingest(options['active_days'])
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def _ingest(self, active_days):
+        active_since = timezone.now() - timedelta(days=active_days)
+        # Least recently synced first, so a throttled run resumes where the last one stopped
+        profiles = SpotifyProfile.objects.filter(user__last_login__gte=active_since).order_by(
+            F('history_synced_at').asc(nulls_first=True)
+        )
+
+        plays = synced = failed = 0
+        for profile in profiles.iterator():
+            if not ensure_valid_token(profile):
+                failed += 1
+                continue
+            try:
+                plays += len(ingest_recent_plays(profile))
+            except SpotifyRateLimited as e:
+                self.stderr.write(f"Spotify is throttling us, stopping this run: {e}")
+                break
+            except requests.RequestException as e:
+                self.stderr.write(f"Failed to ingest plays for profile {profile.pk}: {e}")
+                failed += 1
+                continue
+            synced += 1
+        self.stdout.write(f"Ingested {plays} new play(s) for {synced} user(s), {failed} failed")
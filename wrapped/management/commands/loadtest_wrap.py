@@ -0,0 +1,193 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from wrapped.benchmarks import add_baseline_arguments, check_baseline, format_summary, summarize
+from wrapped.fake_spotify import FakeSpotifyServer
+
+# Run inside the app under test to create one logged-in user (with a linked Spotify profile) per client
+CREATE_SESSIONS = """
+import json, time
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from wrapped.models import SpotifyProfile
+
+keys = []
+for i in range({count}):
+    user = User.objects.create(username=f"loadtest{{i}}")
+    SpotifyProfile.objects.create(user=user, spotify_id=f"loadtest{{i}}", access_token="token",
+                                  refresh_token="refresh", expires_at=int(time.time()) + 3600)
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    keys.append(session.session_key)
+print(json.dumps(keys))
+"""
+
+# Run after the generate scenario to find the wrap each client replays
+WRAP_IDS = """
+import json
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.models import Session
+from wrapped.models import SpotifyWrap
+
+ids = {{}}
+for session in Session.objects.filter(session_key__in={keys!r}):
+    user_id = session.get_decoded()[SESSION_KEY]
+    ids[session.session_key] = SpotifyWrap.objects.filter(user_id=user_id).values_list('id', flat=True).last()
+print(json.dumps(ids))
+"""
+
+# Page requested by each client in each scenario, given the ID of the client's wrap
+SCENARIOS = {
+    'generate': lambda wrap_id: "/en/wraps/generate/",
+    'history': lambda wrap_id: "/en/wraps/history/",
+    'replay': lambda wrap_id: f"/en/wraps/replay/{wrap_id}/",
+}
+
+SERVERS = {
+    'wsgi': ['spotify_wrapped.wsgi', '-k', 'sync'],
+    'asgi': ['spotify_wrapped.asgi', '-k', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"Server did not start listening on port {port}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the generate, history and replay pages under WSGI (sync views) and ASGI (async views) "
+        "against a fake Spotify, reporting throughput and p50/p95/p99 latencies and comparing them with "
+        "a stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+        parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help="Simulated per-request latency of the fake Spotify server, in seconds.")
+        parser.add_argument('--jitter', type=float, default=0.0,
+                            help="Extra random latency of the fake Spotify server, up to this many seconds.")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Share of Spotify requests answered with a 503.")
+        parser.add_argument('--throttle-rate', type=float, default=0.0,
+                            help="Share of Spotify requests answered with a 429.")
+        parser.add_argument('--seed', type=int, help="Seed of the fake Spotify's latency and fault draws.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Concurrent clients.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario and server.")
+        parser.add_argument('--workers', type=int, default=1, help="Server worker processes.")
+        parser.add_argument('--generation-mode', choices=['inline', 'stream'], default='inline',
+                            help="WRAP_GENERATION_MODE of the server under test.")
+        add_baseline_arguments(parser)
+
+    def handle(self, *args, **options):
+        fake = {name: options[name] for name in ('latency', 'jitter', 'error_rate', 'throttle_rate', 'seed')}
+        results = {}
+        with FakeSpotifyServer(**fake) as spotify, tempfile.TemporaryDirectory() as tmp:
+            for server in options['servers']:
+                env = self._environment(spotify, Path(tmp) / f"{server}.sqlite3", server, options['generation_mode'])
+                session_keys = self._prepare_database(env, options['requests'])
+                for scenario, summary in self._run(server, env, session_keys, options).items():
+                    results[f"{server}.{scenario}"] = summary
+                    self.stdout.write(format_summary(f"{server.upper()} {scenario}", summary))
+        check_baseline('loadtest_wrap', results, options, self.stdout)
+
+    @staticmethod
+    def _environment(spotify, database, server, generation_mode):
+        env = dict(os.environ)
+        env.update({
+            'DJANGO_SETTINGS_MODULE': 'spotify_wrapped.settings',
+            'DATABASE_URL': f"sqlite:///{database}",
+            'SPOTIFY_API_BASE_URL': spotify.base_url,
+            'SPOTIFY_ACCOUNTS_BASE_URL': spotify.accounts_url,
+            # Measure the servers, not our own app-wide rate limit
+            'SPOTIFY_RATE_LIMIT': '1000000',
+            'SPOTIFY_RATE_LIMIT_BURST': '1000000',
+            'WRAP_GENERATION_MODE': generation_mode,
+            'WRAP_ASYNC_VIEWS': 'true' if server == 'asgi' else 'false',
+        })
+        return env
+
+    @staticmethod
+    def _shell(env, script):
+        # Run a script in the app under test and return the JSON it printed last
+        manage = [sys.executable, str(settings.BASE_DIR / 'manage.py')]
+        output = subprocess.run(manage + ['shell', '-c', script], env=env, check=True, capture_output=True,
+                                text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def _prepare_database(self, env, count):
+        manage = [sys.executable, str(settings.BASE_DIR / 'manage.py')]
+        subprocess.run(manage + ['migrate', '--verbosity', '0'], env=env, check=True)
+        return self._shell(env, CREATE_SESSIONS.format(count=count))
+
+    def _run(self, server, env, session_keys, options):
+        port = _free_port()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', *SERVERS[server], '--workers', str(options['workers']),
+             '--bind', f"127.0.0.1:{port}", '--timeout', '120', '--log-level', 'warning'],
+            env=env, cwd=settings.BASE_DIR,
+        )
+        summaries = {}
+        try:
+            _wait_for_port(port)
+            # The other scenarios show the wraps generated here, so generate always runs
+            outcomes, elapsed = self._load(port, SCENARIOS['generate'], session_keys, {}, options['concurrency'])
+            if 'generate' in options['scenarios']:
+                summaries['generate'] = summarize(outcomes, elapsed)
+            wrap_ids = self._shell(env, WRAP_IDS.format(keys=session_keys))
+            for scenario in ('history', 'replay'):
+                if scenario in options['scenarios']:
+                    outcomes, elapsed = self._load(port, SCENARIOS[scenario], session_keys, wrap_ids,
+                                                   options['concurrency'])
+                    summaries[scenario] = summarize(outcomes, elapsed)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+        return summaries
+
+    @staticmethod
+    def _load(port, path, session_keys, wrap_ids, concurrency):
+        """
+            Request one page per client session, `concurrency` at a time.
+
+            Returns:
+                tuple: The `(ok, seconds)` outcome of every request and the elapsed wall-clock seconds.
+            """
+
+        def fetch(session_key):
+            url = f"http://127.0.0.1:{port}{path(wrap_ids.get(session_key))}"
+            start = time.perf_counter()
+            response = requests.get(url, cookies={'sessionid': session_key}, allow_redirects=False, timeout=120)
+            return response.status_code == 200, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(fetch, session_keys))
+        return outcomes, time.perf_counter() - start
@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from wrapped.models import PlayEvent
+from wrapped.stats import rebuild_listening_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute listening stats from the stored listening history, e.g. after a backfill or once "
+        "genres were added to the catalog."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help="Only rebuild the stats of these users (default: everyone with plays).")
+
+    def handle(self, *args, **options):
+        if options['usernames']:
+            user_ids = list(User.objects.filter(username__in=options['usernames']).values_list('id', flat=True))
+            if len(user_ids) != len(set(options['usernames'])):
+                raise CommandError("Some of the given users do not exist.")
+        else:
+            user_ids = PlayEvent.objects.values_list('user_id', flat=True).distinct().order_by('user_id')
+
+        rebuilt = 0
+        for user_id in user_ids:
+            stats = rebuild_listening_stats(user_id)
+            rebuilt += 1
+            self.stdout.write(f"User {user_id}: {stats.play_count} play(s), {stats.total_ms // 60000} minute(s)")
+        self.stdout.write(f"Rebuilt the listening stats of {rebuilt} user(s)")
@@ -0,0 +1,49 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from wrapped.models import SpotifyProfile
+from wrapped.tokens import refresh_token_single_flight
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh the Spotify tokens of recently active users before they expire, so request paths "
+        "almost never pay for a refresh. Run it from a scheduler (e.g. Heroku Scheduler every 10 "
+        "minutes) or keep it running with --interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=900,
+                            help="Renew tokens that expire within this many seconds.")
+        parser.add_argument('--active-days', type=int, default=30,
+                            help="Only renew tokens of users who logged in within this many days.")
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Repeat every this many seconds instead of running once.")
+
+    def handle(self, *args, **options):
+        while True:
+            self._renew(options['window'], options['active_days'])
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def _renew(self, window, active_days):
+        expiring_before = int(time.time()) + window
+        active_since = timezone.now() - timedelta(days=active_days)
+        profiles = SpotifyProfile.objects.filter(
+            Q(expires_at__isnull=True) | Q(expires_at__lt=expiring_before),
+            user__last_login__gte=active_since,
+        )
+
+        renewed = failed = 0
+        for profile in profiles.iterator():
+            # The single-flight refresh skips profiles a request already renewed in the meantime
+            if refresh_token_single_flight(profile, margin=window):
+                renewed += 1
+            else:
+                failed += 1
+        self.stdout.write(f"Renewed {renewed} Spotify token(s), {failed} failed")
@@ -0,0 +1,104 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from wrapped.jobs import claim_next_job, heartbeat_jobs, requeue_stale_jobs, run_job
+
+# Seconds between two checks for jobs abandoned by a dead worker
+REQUEUE_INTERVAL = 60
+
+# Seconds between two heartbeats of the jobs a worker is running; kept well below --stale-after
+HEARTBEAT_INTERVAL = 30
+
+# Longest pause, in seconds, after failing to claim a job, e.g. while the database is unreachable
+MAX_CLAIM_BACKOFF = 30
+
+
+class Command(BaseCommand):
+    help = "Process queued wrap generation jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help="Number of jobs processed at the same time.")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help="Seconds without a heartbeat after which a running job is assumed abandoned "
+                                 "and requeued.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of polling forever.")
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        stale_after = timedelta(seconds=options['stale_after'])
+        heartbeat_interval = min(HEARTBEAT_INTERVAL, options['stale_after'] / 3)
+        last_requeue = last_heartbeat = None
+        claim_failures = 0
+
+        running = {}  # Future of each job being run, mapped to the job's ID
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='wrap-worker') as pool:
+            while True:
+                # Like a request, every iteration drops the connections that broke or outlived CONN_MAX_AGE
+                close_old_connections()
+                if last_requeue is None or time.monotonic() - last_requeue >= REQUEUE_INTERVAL:
+                    self._requeue(stale_after)
+                    last_requeue = time.monotonic()
+                running = {future: job_id for future, job_id in running.items() if not future.done()}
+                if running and (last_heartbeat is None or time.monotonic() - last_heartbeat >= heartbeat_interval):
+                    self._heartbeat(running.values())
+                    last_heartbeat = time.monotonic()
+
+                try:
+                    job = claim_next_job() if len(running) < concurrency else None
+                except Exception:
+                    claim_failures += 1
+                    backoff = min(options['poll_interval'] * 2 ** claim_failures, MAX_CLAIM_BACKOFF)
+                    logging.exception(f"Could not claim a wrap job; retrying in {backoff:.0f}s")
+                    time.sleep(backoff)
+                    continue
+                claim_failures = 0
+                if job:
+                    self.stdout.write(f"Running wrap job {job.id} for {job.user.username}")
+                    future = pool.submit(self._run, job)
+                    future.add_done_callback(self._log_failure)
+                    running[future] = job.id
+                    continue
+                if options['once'] and not running:
+                    break
+                time.sleep(options['poll_interval'])
+
+    def _requeue(self, stale_after):
+        # Jobs of workers that died, or whose outcome could not be saved, go back to the queue
+        try:
+            requeued = requeue_stale_jobs(stale_after)
+        except Exception:
+            logging.exception("Could not requeue abandoned wrap jobs")
+            return
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} abandoned job(s)")
+
+    @staticmethod
+    def _heartbeat(job_ids):
+        # A missed heartbeat is harmless unless the database stays unreachable for --stale-after
+        try:
+            heartbeat_jobs(job_ids)
+        except Exception:
+            logging.exception("Could not record the heartbeat of running wrap jobs")
+
+    @staticmethod
+    def _log_failure(future):
+        error = future.exception()
+        if error is not None:
+            logging.error("Wrap worker thread failed", exc_info=error)
+
+    @staticmethod
+    def _run(job):
+        try:
+            run_job(job)
+        finally:
+            # Worker threads hold their own connections; don't leak them between jobs
+            close_old_connections()
@@ -0,0 +1,54 @@
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from wrapped import catalog
+from wrapped.models import ListeningStats, PlayEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the most played tracks and artists, with their albums and audio features, into the shared "
+        "catalog cache, e.g. after a Redis restart or before a bulk wrap run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=1000,
+                            help="How many of the most played tracks, and of the most played artists, to load.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Entries loaded from the database per query.")
+
+    def handle(self, *args, **options):
+        if not settings.REDIS_URL:
+            self.stderr.write("REDIS_URL is not set: only this process's LRU would be warmed.")
+            return
+
+        start = time.perf_counter()
+        top, batch_size = options['top'], options['batch_size']
+        track_ids = list(
+            PlayEvent.objects.values('track_id').annotate(plays=Count('id')).order_by('-plays')
+            .values_list('track_id', flat=True)[:top]
+        )
+        artist_plays = Counter()
+        for artist_counts in ListeningStats.objects.values_list('artist_counts', flat=True).iterator():
+            artist_plays.update(artist_counts)
+        artist_ids = [artist_id for artist_id, _ in artist_plays.most_common(top)]
+
+        warmed = Counter()
+        album_ids = set()
+        for kind, ids in (('tracks', track_ids), ('audio_features', track_ids), ('artists', artist_ids)):
+            for offset in range(0, len(ids), batch_size):
+                instances = catalog.warm(kind, ids[offset:offset + batch_size])
+                warmed[kind] += len(instances)
+                if kind == 'tracks':
+                    album_ids.update(track.album_id for track in instances if track.album_id)
+        album_ids = list(album_ids)
+        for offset in range(0, len(album_ids), batch_size):
+            warmed['albums'] += len(catalog.warm('albums', album_ids[offset:offset + batch_size]))
+
+        elapsed = time.perf_counter() - start
+        details = ', '.join(f"{count} {kind}" for kind, count in warmed.items()) or 'nothing played yet'
+        self.stdout.write(f"Warmed {sum(warmed.values())} catalog entries ({details}) in {elapsed:.1f}s")
@@ -0,0 +1,213 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Histograms exposed by `render_prometheus`: name -> (help text, label names)
+HISTOGRAMS = {
+    'spotify_request_duration_seconds': ("Spotify API calls, per attempt", ('endpoint', 'method', 'status')),
+    'wrap_step_duration_seconds': ("Steps of building and showing a wrap", ('step',)),
+    'http_request_duration_seconds': ("Requests served, until the view returned", ('view', 'method', 'status')),
+}
+
+# Counters exposed by `render_prometheus`: name -> (help text, label name)
+COUNTERS = {
+    'spotify_rate_limit_calls_total': ("Spotify calls throttled, retried or dropped by the rate limiter", 'outcome'),
+    'spotify_response_cache_lookups_total': ("Spotify response cache lookups", 'result'),
+}
+
+_histograms = {name: {} for name in HISTOGRAMS}
+_lock = threading.Lock()
+
+# The spans recorded while serving the current request, for the slow request log
+_request_spans = ContextVar('request_spans', default=None)
+
+
+def observe(name, seconds, *labels):
+    """
+        Record one duration in a histogram of this process.
+
+        Args:
+            name (str): A key of `HISTOGRAMS`.
+            seconds (float): The duration.
+            *labels (str): The label values, in the order of the histogram's label names.
+        """
+
+    with _lock:
+        series = _histograms[name].get(labels)
+        if series is None:
+            # One count per bucket, then the sum and the count of every observation
+            series = _histograms[name][labels] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                series[i] += 1
+        series[-2] += seconds
+        series[-1] += 1
+
+
+@contextmanager
+def span(step):
+    """
+        Time a step of building or showing a wrap.
+
+        The duration goes to the `wrap_step_duration_seconds` histogram and, while a request is being
+        served, to the breakdown logged for slow requests. It is recorded even if the step raises.
+
+        Args:
+            step (str): The name of the step, e.g. `fetch` or `db_write`.
+        """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe('wrap_step_duration_seconds', seconds, step)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((step, seconds))
+
+
+def spotify_endpoint(url):
+    """
+        Return the label of a Spotify URL: its path without the query string, so IDs passed as
+        parameters don't create a series per call.
+        """
+
+    return urlsplit(url).path
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+def _counter_values():
+    # Imported here because both modules import this one
+    from . import spotify_cache, spotify_client
+
+    # The rate limiter also reports the whole fleet, but every process exports only its own share
+    limiter = spotify_client.get_stats()['process']
+    responses = spotify_cache.get_stats()
+    return {
+        'spotify_rate_limit_calls_total': [(name, limiter[name]) for name in spotify_client.STAT_NAMES],
+        'spotify_response_cache_lookups_total': [(name, responses[name]) for name in spotify_cache.STAT_NAMES],
+    }
+
+
+def render_prometheus():
+    """
+        Render this process's histograms, and its rate limiter and Spotify response cache counters,
+        in the Prometheus text exposition format.
+
+        Every process keeps its own histograms, so with several workers each of them has to be
+        scraped (or the series summed) to see the whole traffic.
+
+        Returns:
+            str: The exposition text.
+        """
+
+    with _lock:
+        snapshot = {name: {labels: list(series) for labels, series in by_labels.items()}
+                    for name, by_labels in _histograms.items()}
+
+    lines = []
+    for name, (help_text, label_names) in HISTOGRAMS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, series in sorted(snapshot[name].items()):
+            pairs = list(zip(label_names, labels))
+            for bound, count in zip(BUCKETS, series):
+                lines.append(f"{name}_bucket{{{_labels(pairs + [('le', f'{bound:g}')])}}} {count}")
+            lines.append(f"{name}_bucket{{{_labels(pairs + [('le', '+Inf')])}}} {series[-1]}")
+            lines.append(f"{name}_sum{{{_labels(pairs)}}} {series[-2]:.6f}")
+            lines.append(f"{name}_count{{{_labels(pairs)}}} {series[-1]}")
+    counters = _counter_values()
+    for name, (help_text, label_name) in COUNTERS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for label, value in counters[name]:
+            lines.append(f"{name}{{{_labels([(label_name, label)])}}} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """
+        Forget every recorded duration, e.g. between tests.
+        """
+
+    with _lock:
+        for by_labels in _histograms.values():
+            by_labels.clear()
+
+
+class RequestMetricsMiddleware:
+    """
+        Time every request into `http_request_duration_seconds`, labelled with the name of its URL pattern.
+
+        When `SLOW_REQUEST_LOG_THRESHOLD` is set, requests that took longer are logged as a warning
+        together with the spans recorded while serving them. A streamed response is timed until the
+        view returns, so its body is not included. Works in both sync and async middleware chains.
+        """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        spans = []
+        token = _request_spans.set(spans)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        self._record(request, response, time.perf_counter() - start, spans)
+        return response
+
+    async def __acall__(self, request):
+        spans = []
+        token = _request_spans.set(spans)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        self._record(request, response, time.perf_counter() - start, spans)
+        return response
+
+    def _record(self, request, response, seconds, spans):
+        view = self._view_name(request)
+        observe('http_request_duration_seconds', seconds, view, request.method, str(response.status_code))
+        threshold = settings.SLOW_REQUEST_LOG_THRESHOLD
+        if threshold and seconds >= threshold:
+            logging.warning(
+                "Slow request: %s %s (%s) answered %s in %.3fs; %s",
+                request.method, request.path, view, response.status_code, seconds,
+                ', '.join(f"{step} {step_seconds:.3f}s" for step, step_seconds in spans) or "no spans",
+            )
+
+    @staticmethod
+    def _view_name(request):
+        # Label by URL pattern rather than path, so IDs in URLs don't create a series per object
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unmatched'
+        return match.url_name or match.view_name
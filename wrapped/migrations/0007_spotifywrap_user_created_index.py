@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0006_wrapjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='spotifywrap',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='wrap_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0007_spotifywrap_user_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Album',
+            fields=[
+                ('spotify_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('cover_url', models.URLField(blank=True, max_length=500, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('spotify_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('image_url', models.URLField(blank=True, max_length=500, null=True)),
+                ('genres', models.JSONField(blank=True, default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Track',
+            fields=[
+                ('spotify_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('artist_ids', models.JSONField(blank=True, default=list)),
+                ('artist_names', models.CharField(blank=True, max_length=500)),
+                ('duration_ms', models.IntegerField(blank=True, null=True)),
+                ('album', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='wrapped.album')),
+            ],
+        ),
+    ]
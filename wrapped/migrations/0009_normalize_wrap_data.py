@@ -0,0 +1,144 @@
+import hashlib
+import json
+
+from django.db import migrations
+
+WRAP_DATA_VERSION = 2
+
+
+def legacy_id(*fields):
+    # Wraps saved before the catalog kept no Spotify IDs for artists and tracks, so derive a stable
+    # one from what was kept. The same artist or track saved by different wraps maps to one row.
+    digest = hashlib.sha1(json.dumps(fields).encode()).hexdigest()[:22]
+    return f"legacy:{digest}"
+
+
+def followed_items(followed_artists):
+    # Followed artists were saved as returned by Spotify, either as the list or as the paging object
+    if isinstance(followed_artists, dict):
+        return followed_artists.get('artists', {}).get('items', [])
+    return followed_artists or []
+
+
+def compact_legacy_data(data, catalog):
+    """
+        Convert the expanded data of a wrap into the compact format, collecting its catalog rows.
+        """
+
+    def add_artist(name, image_url, spotify_id=None, genres=None):
+        spotify_id = spotify_id or legacy_id(name, image_url)
+        catalog['artists'][spotify_id] = {'name': (name or '')[:255], 'image_url': image_url, 'genres': genres or []}
+        return spotify_id
+
+    def add_track(name, artist, album_name, album_cover):
+        album_id = legacy_id(album_name, album_cover)
+        catalog['albums'][album_id] = {'name': (album_name or '')[:255], 'cover_url': album_cover}
+        track_id = legacy_id(name, artist, album_name)
+        catalog['tracks'][track_id] = {
+            'name': (name or '')[:255], 'album_id': album_id, 'artist_names': (artist or '')[:500],
+        }
+        return track_id
+
+    compact = {key: value for key, value in data.items()
+               if key not in ('top_artists', 'top_tracks', 'recently_played', 'followed_artists')}
+    compact['version'] = WRAP_DATA_VERSION
+    compact['top_artists'] = [
+        add_artist(artist.get('name'), artist.get('profile_pic')) for artist in data.get('top_artists', [])
+    ]
+    compact['top_tracks'] = [
+        add_track(track.get('name'), track.get('artist'), track.get('album_name'), track.get('album_cover'))
+        for track in data.get('top_tracks', [])
+    ]
+    compact['recently_played'] = [
+        {
+            'track': add_track(item.get('track'), item.get('artist'), item.get('album_name'), item.get('album_cover')),
+            'played_at': item.get('played_at'),
+        }
+        for item in data.get('recently_played', [])
+    ]
+    compact['followed_artists'] = [
+        add_artist(artist['name'], (artist.get('images') or [{}])[0].get('url'), artist['id'], artist.get('genres'))
+        for artist in followed_items(data.get('followed_artists')) if artist.get('id')
+    ]
+    return compact
+
+
+def normalize_wraps(apps, schema_editor):
+    SpotifyWrap = apps.get_model('wrapped', 'SpotifyWrap')
+    Artist = apps.get_model('wrapped', 'Artist')
+    Album = apps.get_model('wrapped', 'Album')
+    Track = apps.get_model('wrapped', 'Track')
+
+    wraps = SpotifyWrap.objects.only('id', 'data').order_by('id')
+    last_id = 0
+    while True:
+        batch = list(wraps.filter(id__gt=last_id)[:500])
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        catalog = {'artists': {}, 'albums': {}, 'tracks': {}}
+        converted = []
+        for wrap in batch:
+            if not isinstance(wrap.data, dict) or wrap.data.get('version') == WRAP_DATA_VERSION:
+                continue
+            wrap.data = compact_legacy_data(wrap.data, catalog)
+            converted.append(wrap)
+
+        for model, rows in ((Artist, catalog['artists']), (Album, catalog['albums']), (Track, catalog['tracks'])):
+            model.objects.bulk_create(
+                [model(spotify_id=spotify_id, **fields) for spotify_id, fields in rows.items()],
+                ignore_conflicts=True,
+            )
+        SpotifyWrap.objects.bulk_update(converted, ['data'])
+
+
+def expand_wraps(apps, schema_editor):
+    SpotifyWrap = apps.get_model('wrapped', 'SpotifyWrap')
+    Artist = apps.get_model('wrapped', 'Artist')
+    Track = apps.get_model('wrapped', 'Track')
+
+    def track_fields(track):
+        return {
+            'artist': track.artist_names,
+            'album_name': track.album.name if track.album else '',
+            'album_cover': track.album.cover_url if track.album else None,
+        }
+
+    for wrap in SpotifyWrap.objects.only('id', 'data').iterator():
+        data = wrap.data
+        if not isinstance(data, dict) or data.get('version') != WRAP_DATA_VERSION:
+            continue
+        artists = Artist.objects.in_bulk(data['top_artists'] + data['followed_artists'])
+        tracks = Track.objects.select_related('album').in_bulk(
+            data['top_tracks'] + [item['track'] for item in data['recently_played']]
+        )
+        expanded = {key: value for key, value in data.items() if key != 'version'}
+        expanded['top_artists'] = [
+            {'name': artists[i].name, 'profile_pic': artists[i].image_url} for i in data['top_artists'] if i in artists
+        ]
+        expanded['top_tracks'] = [
+            {'name': tracks[i].name, **track_fields(tracks[i])} for i in data['top_tracks'] if i in tracks
+        ]
+        expanded['recently_played'] = [
+            {'track': tracks[item['track']].name, **track_fields(tracks[item['track']]), 'played_at': item['played_at']}
+            for item in data['recently_played'] if item['track'] in tracks
+        ]
+        expanded['followed_artists'] = [
+            {'id': i, 'name': artists[i].name, 'genres': artists[i].genres,
+             'images': [{'url': artists[i].image_url}] if artists[i].image_url else []}
+            for i in data['followed_artists'] if i in artists
+        ]
+        wrap.data = expanded
+        wrap.save(update_fields=['data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0008_artist_album_track'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_wraps, expand_wraps),
+    ]
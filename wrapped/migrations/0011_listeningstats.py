@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0010_playevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListeningStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('play_count', models.PositiveIntegerField(default=0)),
+                ('total_ms', models.BigIntegerField(default=0)),
+                ('artist_counts', models.JSONField(blank=True, default=dict)),
+                ('track_counts', models.JSONField(blank=True, default=dict)),
+                ('genre_counts', models.JSONField(blank=True, default=dict)),
+                ('hour_counts', models.JSONField(blank=True, default=list)),
+                ('weekday_counts', models.JSONField(blank=True, default=list)),
+                ('last_played_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='listening_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0011_listeningstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudioFeatures',
+            fields=[
+                ('spotify_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('danceability', models.FloatField()),
+                ('energy', models.FloatField()),
+                ('valence', models.FloatField()),
+                ('acousticness', models.FloatField()),
+                ('instrumentalness', models.FloatField()),
+                ('speechiness', models.FloatField()),
+                ('liveness', models.FloatField()),
+                ('tempo', models.FloatField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:17
+
+from django.db import migrations, models
+
+
+def mark_simplified_artists(apps, schema_editor):
+    # Artists inserted from play history kept only a name; fetch their details again
+    Artist = apps.get_model('wrapped', 'Artist')
+    Artist.objects.filter(genres=[], image_url__isnull=True).exclude(spotify_id__startswith='legacy:').update(
+        is_simplified=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0012_audiofeatures'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artist',
+            name='is_simplified',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_simplified_artists, migrations.RunPython.noop),
+    ]
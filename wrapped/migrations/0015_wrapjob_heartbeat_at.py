@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrapped', '0014_wraprun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wrapjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
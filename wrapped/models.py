@@ -7,15 +7,152 @@ class SpotifyProfile(models.Model):
     access_token = models.TextField()
     refresh_token = models.TextField()
     expires_at = models.IntegerField(null=True, blank=True)  # Token expiry
+    recently_played_after = models.BigIntegerField(null=True, blank=True)  # Spotify cursor (ms) of the newest ingested play
+    history_synced_at = models.DateTimeField(null=True, blank=True)  # Last listening-history ingestion
 
     def __str__(self):
         return f"{self.user.username}'s Spotify Profile"
 
+class Artist(models.Model):
+    spotify_id = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255)
+    image_url = models.URLField(max_length=500, blank=True, null=True)
+    genres = models.JSONField(default=list, blank=True)
+    is_simplified = models.BooleanField(default=False)  # Only known from a track's credits: no genres or image yet
+
+    def __str__(self):
+        return self.name
+
+class Album(models.Model):
+    spotify_id = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255)
+    cover_url = models.URLField(max_length=500, blank=True, null=True)
+
+    def __str__(self):
+        return self.name
+
+class Track(models.Model):
+    spotify_id = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255)
+    album = models.ForeignKey(Album, on_delete=models.SET_NULL, null=True, blank=True)
+    artist_ids = models.JSONField(default=list, blank=True)  # Spotify IDs, in credit order
+    artist_names = models.CharField(max_length=500, blank=True)  # Display string, e.g. "Artist A, Artist B"
+    duration_ms = models.IntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+class AudioFeatures(models.Model):
+    # Spotify's audio features of a track, keyed by the track's Spotify ID (no FK: fetched before tracks are saved)
+    spotify_id = models.CharField(max_length=64, primary_key=True)
+    danceability = models.FloatField()
+    energy = models.FloatField()
+    valence = models.FloatField()
+    acousticness = models.FloatField()
+    instrumentalness = models.FloatField()
+    speechiness = models.FloatField()
+    liveness = models.FloatField()
+    tempo = models.FloatField()  # BPM
+
+    def __str__(self):
+        return f"Audio features of {self.spotify_id}"
+
+class PlayEvent(models.Model):
+    # One play from the user's listening history; append-only
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    track = models.ForeignKey(Track, on_delete=models.PROTECT)
+    played_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            # A user cannot start two plays at the same instant; also the (user, played_at) index
+            models.UniqueConstraint(fields=['user', 'played_at'], name='unique_play_per_user_and_time'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} played {self.track_id} at {self.played_at}"
+
+class ListeningStats(models.Model):
+    # Rolling aggregates of a user's PlayEvents, updated as plays are ingested (see wrapped/stats.py)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='listening_stats')
+    play_count = models.PositiveIntegerField(default=0)
+    total_ms = models.BigIntegerField(default=0)  # Summed track durations
+    artist_counts = models.JSONField(default=dict, blank=True)  # Artist Spotify ID -> plays
+    track_counts = models.JSONField(default=dict, blank=True)  # Track Spotify ID -> plays
+    genre_counts = models.JSONField(default=dict, blank=True)  # Genre -> plays
+    hour_counts = models.JSONField(default=list, blank=True)  # 24 play counts, by hour of day (TIME_ZONE)
+    weekday_counts = models.JSONField(default=list, blank=True)  # 7 play counts, Monday first
+    last_played_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}'s listening stats"
+
 class SpotifyWrap(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    data = models.JSONField()
+    data = models.JSONField()  # Ordered catalog IDs; expand with storage.load_wrap_data
     top_genre = models.CharField(max_length=255, blank=True, null=True)  # Field for top genre
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Serves the paginated history of one user, newest first
+            models.Index(fields=['user', 'created_at', 'id'], name='wrap_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}'s Spotify Wrap"
+
+class WrapJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = [PENDING, RUNNING]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.PositiveSmallIntegerField(default=0)  # Percent complete
+    wrap = models.ForeignKey(SpotifyWrap, on_delete=models.SET_NULL, null=True, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Last sign of life from the worker running it
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # At most one queued or running job per user
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_wrap_job_per_user',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}'s wrap job ({self.status})"
+
+class WrapRun(models.Model):
+    # A bulk generation of wraps for every linked profile (see wrapped/bulk.py), resumable from its checkpoint
+    label = models.CharField(max_length=100, unique=True)  # e.g. "2024-annual"
+    since = models.DateTimeField()  # Users with a wrap created since then are skipped
+    last_profile_id = models.IntegerField(default=0)  # Checkpoint: every profile up to this ID is done
+    generated = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Wrap run {self.label}"
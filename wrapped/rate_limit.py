@@ -0,0 +1,194 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+# Refill the bucket, honour a fleet-wide pause and take one token, atomically on the Redis server.
+# Returns the number of seconds to wait before trying again (0 when a token was taken).
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+
+local paused_ms = redis.call('PTTL', KEYS[2])
+if paused_ms > 0 then
+    return tostring(paused_ms / 1000)
+end
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+class LocalTokenBucket:
+    """
+        A thread-safe token bucket shared by the threads of one process.
+
+        Args:
+            rate (float): Tokens added per second.
+            capacity (int): Maximum number of tokens, i.e. the allowed burst.
+        """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+            Take one token if available.
+
+            Returns:
+                float: 0 if a token was taken; otherwise the seconds to wait before trying again.
+            """
+
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout):
+        """
+            Wait for a token for at most `timeout` seconds.
+
+            Args:
+                timeout (float): The longest the caller is willing to wait.
+
+            Returns:
+                bool: True if a token was taken; False if none became available in time.
+            """
+
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+            Stop handing out tokens for `seconds`, e.g. after Spotify answered with a 429.
+            """
+
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class RedisTokenBucket(LocalTokenBucket):
+    """
+        A token bucket whose state lives in Redis, so every gunicorn worker draws from the same budget.
+
+        If Redis cannot be reached the bucket fails open and lets the request through, so an outage of
+        the limiter never takes the site down with it.
+
+        Args:
+            client (redis.Redis): The Redis connection.
+            key (str): Prefix of the Redis keys holding the bucket state.
+            rate (float): Tokens added per second.
+            capacity (int): Maximum number of tokens, i.e. the allowed burst.
+        """
+
+    def __init__(self, client, key, rate, capacity):
+        super().__init__(rate, capacity)
+        self.client = client
+        self.bucket_key = f"{key}:bucket"
+        self.pause_key = f"{key}:paused"
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def try_acquire(self):
+        import redis
+
+        try:
+            return float(self.script(keys=[self.bucket_key, self.pause_key], args=[self.rate, self.capacity]))
+        except redis.RedisError as e:
+            logging.warning(f"Spotify rate limiter unavailable, allowing request: {e}")
+            return 0
+
+    def pause(self, seconds):
+        import redis
+
+        try:
+            # Only ever extend an existing pause
+            if self.client.pttl(self.pause_key) < seconds * 1000:
+                self.client.set(self.pause_key, 1, px=max(1, int(seconds * 1000)))
+        except redis.RedisError as e:
+            logging.warning(f"Spotify rate limiter unavailable, could not pause: {e}")
+
+
+_redis_client = None
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_redis():
+    """
+        Return the process-wide Redis connection configured by `settings.REDIS_URL`.
+
+        Returns:
+            redis.Redis | None: The connection, or None when Redis is not configured.
+        """
+
+    global _redis_client
+    if _redis_client is None and settings.REDIS_URL:
+        import redis
+
+        _redis_client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+    return _redis_client
+
+
+def limiter_key():
+    """
+        Return the Redis key prefix for this app's Spotify quota, which Spotify enforces per client ID.
+        """
+
+    return f"spotify:ratelimit:{settings.SPOTIPY_CLIENT_ID}"
+
+
+def get_rate_limiter():
+    """
+        Return the token bucket guarding this app's Spotify quota, creating it on first use.
+
+        The bucket lives in Redis when `settings.REDIS_URL` is set, so the whole fleet shares one
+        budget; otherwise it is local to the process.
+
+        Returns:
+            LocalTokenBucket: The limiter.
+        """
+
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                rate = settings.SPOTIFY_RATE_LIMIT
+                capacity = settings.SPOTIFY_RATE_LIMIT_BURST
+                client = get_redis()
+                if client is not None:
+                    _limiter = RedisTokenBucket(client, limiter_key(), rate, capacity)
+                else:
+                    _limiter = LocalTokenBucket(rate, capacity)
+    return _limiter
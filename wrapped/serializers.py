@@ -0,0 +1,36 @@
+from rest_framework import serializers
+
+from .models import SpotifyWrap
+
+
+class WrapSummarySerializer(serializers.ModelSerializer):
+    """
+        The metadata of a wrap, as listed by the API. The wrap's data is left out.
+        """
+
+    url = serializers.HyperlinkedIdentityField(view_name='api_wrap_detail', lookup_url_kwarg='wrap_id')
+
+    class Meta:
+        model = SpotifyWrap
+        fields = ['id', 'url', 'created_at', 'top_genre']
+
+
+class WrapDetailSerializer(WrapSummarySerializer):
+    """
+        A wrap with its data, expanded by `load_wrap_data`.
+
+        Pass the expanded data as `context['wrap_data']`; `context['fields']` optionally limits which
+        of its keys are returned.
+        """
+
+    data = serializers.SerializerMethodField()
+
+    class Meta(WrapSummarySerializer.Meta):
+        fields = WrapSummarySerializer.Meta.fields + ['data']
+
+    def get_data(self, wrap):
+        wrap_data = self.context['wrap_data']
+        fields = self.context.get('fields')
+        if fields:
+            return {key: value for key, value in wrap_data.items() if key in fields}
+        return wrap_data
@@ -0,0 +1,71 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import caching, catalog
+from .models import SpotifyProfile, SpotifyWrap
+from .wrap_pages import forget_wrap_slides
+
+
+@receiver(post_delete, sender=SpotifyWrap)
+def forget_deleted_wrap_slides(sender, instance, **kwargs):
+    """
+        Drop the cached slides of a deleted wrap, the only time a cached rendering becomes invalid.
+        """
+
+    forget_wrap_slides(instance)
+
+
+@receiver(post_save, sender=SpotifyWrap)
+@receiver(post_delete, sender=SpotifyWrap)
+def forget_cached_wrap_lookups(sender, instance, **kwargs):
+    """
+        Drop the cached history page and replay lookup of a created or deleted wrap.
+        """
+
+    caching.forget_wraps([instance])
+
+
+@receiver(post_save, sender=User)
+def forget_cached_user(sender, instance, created, **kwargs):
+    """
+        Drop the cached user when it changes, and everything cached for its ID when it is created,
+        since a new user may reuse the ID of a deleted one.
+        """
+
+    if created:
+        caching.forget_user(instance.pk)
+    else:
+        caching.invalidate(caching.user_key(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance, **kwargs):
+    """
+        Drop everything cached for a deleted user.
+        """
+
+    caching.forget_user(instance.pk)
+
+
+@receiver(post_save, sender=SpotifyProfile)
+@receiver(post_delete, sender=SpotifyProfile)
+def forget_cached_profile(sender, instance, **kwargs):
+    """
+        Drop the cached Spotify profile of a user whenever it is linked, saved with new tokens or unlinked.
+        """
+
+    caching.invalidate(caching.profile_key(instance.user_id))
+
+
+def forget_deleted_catalog_entry(sender, instance, **kwargs):
+    """
+        Drop a deleted artist, album, track or audio features from the catalog cache.
+        """
+
+    kind = next(kind for kind, model in catalog.MODELS.items() if model is sender)
+    catalog.forget(kind, [instance.pk])
+
+
+for catalog_model in catalog.MODELS.values():
+    post_delete.connect(forget_deleted_catalog_entry, sender=catalog_model)
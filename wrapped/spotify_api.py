@@ -1,91 +1,550 @@
-import requests
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from functools import partial
 
-BASE_URL = "https://api.spotify.com/v1/me"
+from django.conf import settings
 
-# Function to get top artists
-def get_user_top_artists(access_token):
+from . import metrics, spotify_cache, spotify_client
+
+# Spotify's time ranges of top items: about 4 weeks, 6 months, and a year or more
+TIME_RANGES = ('short_term', 'medium_term', 'long_term')
+
+# The most items Spotify returns per page of the top items and followed artists endpoints
+PAGE_LIMIT = 50
+
+# Upper bound on the followed-artists pages walked per wrap, in case a cursor never runs out
+MAX_FOLLOWED_ARTISTS_PAGES = 200
+
+
+def top_items_endpoint(kind, time_range='medium_term'):
+    """
+        Return the wrap endpoint name of a user's top items over a time range.
+
+        The medium term is Spotify's default range and keeps the plain `top_artists` / `top_tracks` name,
+        so wraps saved before the other ranges were fetched read the same.
+
+        Args:
+            kind (str): `artists` or `tracks`.
+            time_range (str): One of `TIME_RANGES`.
+
+        Returns:
+            str: e.g. `top_tracks` or `top_tracks_short_term`.
+        """
+
+    return f"top_{kind}" if time_range == 'medium_term' else f"top_{kind}_{time_range}"
+
+
+# Path below /me of each wrap endpoint, the keys leading to its payload in the JSON body, and the
+# name its cache TTL and fetch timeout are configured under
+WRAP_ENDPOINT_ROUTES = {
+    'profile': ("", (), 'profile'),
+    **{
+        top_items_endpoint(kind, time_range): (
+            f"/top/{kind}?limit={PAGE_LIMIT}&time_range={time_range}", ('items',), f"top_{kind}",
+        )
+        for kind in ('artists', 'tracks') for time_range in TIME_RANGES
+    },
+    'recently_played': (f"/player/recently-played?limit={PAGE_LIMIT}", ('items',), 'recently_played'),
+    'followed_artists': (f"/following?type=artist&limit={PAGE_LIMIT}", ('artists', 'items'), 'followed_artists'),
+}
+
+
+def endpoint_setting(endpoint):
+    """
+        Return the name an endpoint is configured under in `SPOTIFY_CACHE_TTLS` and `SPOTIFY_FETCH_TIMEOUTS`.
+
+        Every time range of the top items shares the settings of `top_artists` or `top_tracks`.
+        """
+
+    route = WRAP_ENDPOINT_ROUTES.get(endpoint)
+    return route[2] if route else endpoint
+
+
+def _me_url(path=""):
     """
-        Fetch the top 10 artists for a user from the Spotify API.
+        Build a URL under the current user's `/me` endpoint of the Spotify Web API.
 
         Args:
+            path (str): The path below `/me`, including the leading slash and any query string.
+
+        Returns:
+            str: The absolute URL, rooted at `settings.SPOTIFY_API_BASE_URL`.
+        """
+
+    return f"{settings.SPOTIFY_API_BASE_URL}/me{path}"
+
+
+def _followed_artists_url(after=None):
+    # Spotify's `next` link is not used so that every page stays under SPOTIFY_API_BASE_URL
+    path = WRAP_ENDPOINT_ROUTES['followed_artists'][0]
+    return _me_url(path + (f"&after={after}" if after else ""))
+
+
+def _get_json(endpoint, url, access_token, timeout=None, spotify_user_id=None):
+    """
+        GET a Spotify endpoint, going through the response cache when the Spotify user is known.
+
+        Args:
+            endpoint (str): The endpoint name used for cache keys and TTLs.
+            url (str): The absolute URL.
             access_token (str): The access token used for authenticating the request.
+            timeout (float, optional): Seconds to wait for Spotify.
+            spotify_user_id (str, optional): The Spotify ID of the token's owner; enables caching.
 
         Returns:
-            list: A list of top artist objects if the request is successful; otherwise, an empty list.
+            dict | None: The decoded JSON body if the request is successful; otherwise, None.
         """
 
-    url = f"{BASE_URL}/top/artists?limit=10"  # Adjust the limit to 10 artists
     headers = {
         "Authorization": f"Bearer {access_token}",
     }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.json()['items']  # Returns a list of top artists
-    else:
-        return []
+    if spotify_user_id is None:
+        response = spotify_client.get(url, headers=headers, timeout=timeout)
+        return response.json() if response.status_code == 200 else None
+    return spotify_cache.get_json(spotify_user_id, endpoint, url, headers, timeout=timeout)
+
+
+def _get_route(endpoint, access_token, timeout=None, spotify_user_id=None):
+    """
+        Fetch one page of a wrap endpoint and extract its payload.
+
+        Args:
+            endpoint (str): A key of `WRAP_ENDPOINT_ROUTES`.
+            access_token (str): The access token used for authenticating the request.
+            timeout (float, optional): Seconds to wait for Spotify.
+            spotify_user_id (str, optional): The Spotify ID of the token's owner; enables the response cache.
+
+        Returns:
+            dict | list | None: The payload; None for a failed profile request, an empty list otherwise.
+        """
+
+    path, keys, setting = WRAP_ENDPOINT_ROUTES[endpoint]
+    data = _get_json(setting, _me_url(path), access_token, timeout, spotify_user_id)
+    if not data:
+        return None if endpoint == 'profile' else []
+    for key in keys:
+        data = data[key]
+    return data
+
+# Function to get the current user's profile
+def get_current_user_profile(access_token, timeout=None, spotify_user_id=None):
+    """
+        Fetch the profile of the user that owns the access token from the Spotify API.
+
+        Args:
+            access_token (str): The access token used for authenticating the request.
+            timeout (float, optional): Seconds to wait for Spotify; defaults to `SPOTIFY_HTTP_READ_TIMEOUT`.
+            spotify_user_id (str, optional): The Spotify ID of the token's owner; enables the response cache.
+
+        Returns:
+            dict: The user profile object if the request is successful; otherwise, None.
+        """
+
+    return _get_route('profile', access_token, timeout, spotify_user_id)
+
+# Function to get top artists
+def get_user_top_artists(access_token, timeout=None, spotify_user_id=None, time_range='medium_term'):
+    """
+        Fetch the top 50 artists of a user over a time range from the Spotify API.
+
+        Args:
+            access_token (str): The access token used for authenticating the request.
+            timeout (float, optional): Seconds to wait for Spotify; defaults to `SPOTIFY_HTTP_READ_TIMEOUT`.
+            spotify_user_id (str, optional): The Spotify ID of the token's owner; enables the response cache.
+            time_range (str): One of `TIME_RANGES`.
+
+        Returns:
+            list: A list of top artist objects if the request is successful; otherwise, an empty list.
+        """
+
+    return _get_route(top_items_endpoint('artists', time_range), access_token, timeout, spotify_user_id)
 
 # Function to get top tracks
-def get_user_top_tracks(access_token):
+def get_user_top_tracks(access_token, timeout=None, spotify_user_id=None, time_range='medium_term'):
     """
-        Fetch the top 10 tracks for a user from the Spotify API.
+        Fetch the top 50 tracks of a user over a time range from the Spotify API.
 
         Args:
             access_token (str): The access token used for authenticating the request.
+            timeout (float, optional): Seconds to wait for Spotify; defaults to `SPOTIFY_HTTP_READ_TIMEOUT`.
+            spotify_user_id (str, optional): The Spotify ID of the token's owner; enables the response cache.
+            time_range (str): One of `TIME_RANGES`.
 
         Returns:
             list: A list of top track objects if the request is successful; otherwise, an empty list.
         """
 
-    url = f"{BASE_URL}/top/tracks?limit=10"  # Adjust the limit to 10 tracks
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.json()['items']  # Returns a list of top tracks
-    else:
-        return []
+    return _get_route(top_items_endpoint('tracks', time_range), access_token, timeout, spotify_user_id)
 
 # Function to get recently played tracks
-def get_recently_played(access_token):
+def get_recently_played(access_token, timeout=None, spotify_user_id=None):
     """
-        Fetch the 10 most recently played tracks for a user from the Spotify API.
+        Fetch the 50 most recently played tracks for a user from the Spotify API.
 
         Args:
             access_token (str): The access token used for authenticating the request.
+            timeout (float, optional): Seconds to wait for Spotify; defaults to `SPOTIFY_HTTP_READ_TIMEOUT`.
+            spotify_user_id (str, optional): The Spotify ID of the token's owner; enables the response cache.
 
         Returns:
             list: A list of recently played track objects if the request is successful; otherwise, an empty list.
         """
 
-    url = f"{BASE_URL}/player/recently-played?limit=10"  # Adjust the limit to 10 tracks
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.json()['items']  # Returns a list of recently played tracks
-    else:
-        return []
+    return _get_route('recently_played', access_token, timeout, spotify_user_id)
 
-# Function to get followed artists (NEW FUNCTION)
-def get_user_followed_artists(access_token):
+# Generator over the pages of followed artists
+def iter_followed_artists(access_token, timeout=None, spotify_user_id=None):
     """
-        Fetch the 10 most recently followed artists for a user from the Spotify API.
+        Page through every artist a user follows, following the `after` cursor of each page.
+
+        Pages are requested one at a time, as each needs the cursor of the one before, and yielded as
+        soon as they arrive so callers never hold more than they consume.
+
+        Args:
+            access_token (str): The access token used for authenticating the requests.
+            timeout (float, optional): Seconds to wait for each page; defaults to `SPOTIFY_HTTP_READ_TIMEOUT`.
+            spotify_user_id (str, optional): The Spotify ID of the token's owner; enables the response cache.
+
+        Yields:
+            list: The artist objects of each page, up to 50. Paging stops at the first failed request.
+        """
+
+    after = None
+    for _ in range(MAX_FOLLOWED_ARTISTS_PAGES):
+        data = _get_json('followed_artists', _followed_artists_url(after), access_token, timeout, spotify_user_id)
+        if not data:
+            return
+        page = data['artists']
+        if page['items']:
+            yield page['items']
+        after = (page.get('cursors') or {}).get('after')
+        if not after or not page.get('next'):
+            return
+
+# Function to get followed artists
+def get_user_followed_artists(access_token, timeout=None, spotify_user_id=None):
+    """
+        Fetch every artist a user follows from the Spotify API. See `iter_followed_artists`.
+
+        Returns:
+            list: A list of followed artist objects, empty if the first request fails.
+        """
+
+    return [artist for page in iter_followed_artists(access_token, timeout, spotify_user_id) for artist in page]
+
+
+# Function to page through the listening history
+def get_recently_played_after(access_token, after=None, limit=50, timeout=None):
+    """
+        Fetch one page of the user's play history, limited to plays after a cursor.
+
+        Never cached: the cursor changes on every call.
 
         Args:
             access_token (str): The access token used for authenticating the request.
+            after (int, optional): A Unix timestamp in milliseconds; only plays after it are returned.
+            limit (int): The most plays returned (at most 50).
+            timeout (float, optional): Seconds to wait for Spotify; defaults to `SPOTIFY_HTTP_READ_TIMEOUT`.
 
         Returns:
-            list: A list of followed artist objects if the request is successful; otherwise, an empty list.
+            dict | None: The cursor-based paging object, with `items` and `cursors`, if the request is
+            successful; otherwise, None.
+        """
+
+    query = f"?limit={limit}" + (f"&after={after}" if after is not None else "")
+    return _get_json('recently_played_history', _me_url(f"/player/recently-played{query}"), access_token, timeout)
+
+
+# Catalog endpoints taking several IDs: path, key of the result list, and the most IDs per request
+SEVERAL_ENDPOINTS = {
+    'artists': ("/artists", 'artists', 50),
+    'tracks': ("/tracks", 'tracks', 50),
+    'audio_features': ("/audio-features", 'audio_features', 100),
+}
+
+
+def get_several(access_token, ids_by_endpoint, timeout=None):
+    """
+        Fetch catalog objects by ID with as few requests as possible.
+
+        The IDs of each endpoint are split into chunks of the most it accepts, and all the chunks, of
+        every endpoint, are fetched concurrently.
+
+        Args:
+            access_token (str): The access token used for authenticating the requests.
+            ids_by_endpoint (dict): Lists of Spotify IDs, without duplicates, keyed by a key of
+                `SEVERAL_ENDPOINTS`.
+            timeout (float, optional): Seconds to wait for Spotify; defaults to `SPOTIFY_HTTP_READ_TIMEOUT`.
+
+        Returns:
+            dict: The objects that Spotify returned, keyed by endpoint; unknown IDs are left out.
+
+        Raises:
+            requests.RequestException: If Spotify could not be reached.
+            SpotifyRateLimited: If Spotify kept throttling us.
+        """
+
+    def fetch_chunk(endpoint, chunk):
+        path, key, _ = SEVERAL_ENDPOINTS[endpoint]
+        url = f"{settings.SPOTIFY_API_BASE_URL}{path}?ids={','.join(chunk)}"
+        data = _get_json(endpoint, url, access_token, timeout)
+        # Unknown IDs are returned as null
+        return [item for item in (data or {}).get(key, []) if item]
+
+    chunks = []
+    for endpoint, ids in ids_by_endpoint.items():
+        batch_size = SEVERAL_ENDPOINTS[endpoint][2]
+        chunks += [(endpoint, ids[start:start + batch_size]) for start in range(0, len(ids), batch_size)]
+
+    results = {endpoint: [] for endpoint in ids_by_endpoint}
+    if len(chunks) == 1:
+        results[chunks[0][0]] = fetch_chunk(*chunks[0])
+    elif chunks:
+        for (endpoint, _), items in zip(chunks, _get_executor().map(lambda chunk: fetch_chunk(*chunk), chunks)):
+            results[endpoint] += items
+    return results
+
+
+# Functions to get several artists, tracks or audio features by ID
+def get_artists(access_token, artist_ids, timeout=None):
+    """
+        Fetch full artist objects, 50 per request. See `get_several`.
+        """
+
+    return get_several(access_token, {'artists': artist_ids}, timeout)['artists']
+
+
+def get_tracks(access_token, track_ids, timeout=None):
+    """
+        Fetch full track objects, 50 per request. See `get_several`.
+        """
+
+    return get_several(access_token, {'tracks': track_ids}, timeout)['tracks']
+
+
+def get_audio_features(access_token, track_ids, timeout=None):
+    """
+        Fetch the audio features of tracks, 100 tracks per request. See `get_several`.
+        """
+
+    return get_several(access_token, {'audio_features': track_ids}, timeout)['audio_features']
+
+
+# Endpoints fetched for every wrap, keyed by the name used in the fetch results
+WRAP_ENDPOINTS = {
+    'profile': get_current_user_profile,
+    **{
+        top_items_endpoint('artists', time_range): partial(get_user_top_artists, time_range=time_range)
+        for time_range in TIME_RANGES
+    },
+    **{
+        top_items_endpoint('tracks', time_range): partial(get_user_top_tracks, time_range=time_range)
+        for time_range in TIME_RANGES
+    },
+    'recently_played': get_recently_played,
+    'followed_artists': get_user_followed_artists,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+        Return the process-wide thread pool used to fan out Spotify API calls, creating it on first use.
+
+        Returns:
+            ThreadPoolExecutor: A pool bounded by `settings.SPOTIFY_FETCH_WORKERS`.
+        """
+
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.SPOTIFY_FETCH_WORKERS,
+                    thread_name_prefix='spotify-fetch',
+                )
+    return _executor
+
+
+def iter_wrap_payloads(access_token, endpoints=None, spotify_user_id=None):
+    """
+        Fetch every endpoint a wrap needs concurrently, yielding each outcome as soon as its call finishes.
+
+        Each endpoint is bounded by its own timeout from `settings.SPOTIFY_FETCH_TIMEOUTS`, per request for
+        paged endpoints. A failing or slow endpoint does not affect the others: its error is yielded and
+        the remaining calls go on.
+
+        Args:
+            access_token (str): The access token used for authenticating the requests.
+            endpoints (dict, optional): Mapping of result name to fetch function. Defaults to `WRAP_ENDPOINTS`.
+            spotify_user_id (str, optional): The Spotify ID of the token's owner; enables the response cache.
+
+        Yields:
+            tuple: `(name, payload, error)` for every endpoint, in completion order. `error` is the exception
+            raised by a call that did not complete, in which case `payload` is None. Calls still queued or
+            running when the overall deadline passes get a `TimeoutError`.
+        """
+
+    endpoints = endpoints or WRAP_ENDPOINTS
+    timeouts = settings.SPOTIFY_FETCH_TIMEOUTS
+    executor = _get_executor()
+
+    futures = {}
+    for name, fetch in endpoints.items():
+        timeout = timeouts.get(endpoint_setting(name))
+        future = executor.submit(fetch, access_token, timeout=timeout, spotify_user_id=spotify_user_id)
+        futures[future] = name
+
+    # Every call enforces its own timeout; the overall deadline guards against a stuck or saturated pool, where
+    # a call may time out before it even started, so callers must not treat its TimeoutError as a slow endpoint
+    default_timeout = settings.SPOTIFY_HTTP_READ_TIMEOUT
+    deadline = max(timeouts.get(endpoint_setting(name), default_timeout) for name in endpoints.keys()) * 2
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            pending.discard(future)
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+    except FuturesTimeoutError:
+        for future in pending:
+            future.cancel()
+            yield futures[future], None, TimeoutError(f"{futures[future]} did not finish within {deadline}s")
+
+
+def fetch_wrap_payloads(access_token, endpoints=None, spotify_user_id=None):
+    """
+        Fetch every endpoint a wrap needs concurrently, so the total latency is close to the slowest single call.
+
+        Each endpoint is bounded by its own timeout from `settings.SPOTIFY_FETCH_TIMEOUTS`. A failing or
+        slow endpoint does not affect the others: its error is reported and the remaining results are still returned.
+
+        Args:
+            access_token (str): The access token used for authenticating the requests.
+            endpoints (dict, optional): Mapping of result name to fetch function. Defaults to `WRAP_ENDPOINTS`.
+            spotify_user_id (str, optional): The Spotify ID of the token's owner; enables the response cache.
+
+        Returns:
+            tuple: A `(results, errors)` pair of dicts keyed by endpoint name. `results` holds the payloads
+            of the calls that completed; `errors` holds the exception raised by each call that did not.
+        """
+
+    results = {}
+    errors = {}
+    with metrics.span('fetch'):
+        for name, payload, error in iter_wrap_payloads(access_token, endpoints, spotify_user_id):
+            if error is None:
+                results[name] = payload
+            else:
+                errors[name] = error
+    return results, errors
+
+
+async def _aget_json(endpoint, url, access_token, timeout=None, spotify_user_id=None):
+    """
+        Async counterpart of `_get_json`, sending the request over the shared `httpx.AsyncClient`.
         """
 
-    url = f"{BASE_URL}/following?type=artist&limit=10"  # Adjust the limit to 10 followed artists
     headers = {
         "Authorization": f"Bearer {access_token}",
     }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.json()['artists']['items']  # Returns a list of followed artists
-    else:
-        return []
\ No newline at end of file
+    if spotify_user_id is None:
+        response = await spotify_client.aget(url, headers=headers, timeout=timeout)
+        return response.json() if response.status_code == 200 else None
+    return await spotify_cache.aget_json(spotify_user_id, endpoint, url, headers, timeout=timeout)
+
+
+async def aiter_followed_artists(access_token, timeout=None, spotify_user_id=None):
+    """
+        Async counterpart of `iter_followed_artists`.
+        """
+
+    after = None
+    for _ in range(MAX_FOLLOWED_ARTISTS_PAGES):
+        data = await _aget_json('followed_artists', _followed_artists_url(after), access_token, timeout,
+                                spotify_user_id)
+        if not data:
+            return
+        page = data['artists']
+        if page['items']:
+            yield page['items']
+        after = (page.get('cursors') or {}).get('after')
+        if not after or not page.get('next'):
+            return
+
+
+async def _afetch_endpoint(endpoint, access_token, timeout=None, spotify_user_id=None):
+    """
+        Async counterpart of the `get_*` helpers: fetch one wrap endpoint and extract its payload.
+
+        Args:
+            endpoint (str): A key of `WRAP_ENDPOINT_ROUTES`.
+            access_token (str): The access token used for authenticating the request.
+            timeout (float, optional): Seconds to wait for Spotify, per request.
+            spotify_user_id (str, optional): The Spotify ID of the token's owner; enables the response cache.
+
+        Returns:
+            dict | list | None: The same value the matching sync helper returns.
+        """
+
+    if endpoint == 'followed_artists':
+        return [artist async for page in aiter_followed_artists(access_token, timeout, spotify_user_id)
+                for artist in page]
+
+    path, keys, setting = WRAP_ENDPOINT_ROUTES[endpoint]
+    data = await _aget_json(setting, _me_url(path), access_token, timeout, spotify_user_id)
+    if not data:
+        return None if endpoint == 'profile' else []
+    for key in keys:
+        data = data[key]
+    return data
+
+
+async def aget_current_user_profile(access_token, timeout=None, spotify_user_id=None):
+    """
+        Async counterpart of `get_current_user_profile`.
+        """
+
+    return await _afetch_endpoint('profile', access_token, timeout, spotify_user_id)
+
+
+async def afetch_wrap_payloads(access_token, spotify_user_id=None):
+    """
+        Async counterpart of `fetch_wrap_payloads`, running every wrap endpoint concurrently on the event loop.
+
+        Args:
+            access_token (str): The access token used for authenticating the requests.
+            spotify_user_id (str, optional): The Spotify ID of the token's owner; enables the response cache.
+
+        Returns:
+            tuple: A `(results, errors)` pair of dicts keyed by endpoint name, as for `fetch_wrap_payloads`.
+        """
+
+    timeouts = settings.SPOTIFY_FETCH_TIMEOUTS
+    default_timeout = settings.SPOTIFY_HTTP_READ_TIMEOUT
+    names = list(WRAP_ENDPOINT_ROUTES)
+    with metrics.span('fetch'):
+        outcomes = await asyncio.gather(
+            *(
+                asyncio.wait_for(
+                    _afetch_endpoint(name, access_token, timeouts.get(endpoint_setting(name)), spotify_user_id),
+                    # Every call enforces its own timeout; this only guards against a stuck call
+                    timeout=timeouts.get(endpoint_setting(name), default_timeout) * 2,
+                )
+                for name in names
+            ),
+            return_exceptions=True,
+        )
+
+    results = {}
+    errors = {}
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, Exception):
+            errors[name] = outcome
+        else:
+            results[name] = outcome
+    return results, errors
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import spotify_client
+from .rate_limit import get_redis
+
+# Counters reported by `get_stats`
+STAT_NAMES = ('hits', 'misses', 'revalidated', 'stale')
+
+
+class LocMemLRUBackend:
+    """
+        A process-local cache that evicts the least recently used entry once `max_entries` is reached.
+
+        Args:
+            max_entries (int): The most entries kept at once.
+        """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires_at, entry = item
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, ttl):
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisBackend:
+    """
+        A cache shared by every worker process, stored as JSON in Redis with a native expiry.
+
+        Redis errors are logged and treated as cache misses.
+
+        Args:
+            client (redis.Redis): The Redis connection.
+        """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        import redis
+
+        try:
+            value = self.client.get(key)
+        except redis.RedisError as e:
+            logging.warning(f"Spotify response cache unavailable: {e}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, entry, ttl):
+        import redis
+
+        try:
+            self.client.set(key, json.dumps(entry), ex=max(1, int(ttl)))
+        except redis.RedisError as e:
+            logging.warning(f"Spotify response cache unavailable: {e}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_backend():
+    """
+        Return the cache backend selected by `settings.SPOTIFY_CACHE_BACKEND` ('locmem' or 'redis').
+
+        Returns:
+            LocMemLRUBackend | RedisBackend: The backend.
+        """
+
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if settings.SPOTIFY_CACHE_BACKEND == 'redis' and get_redis() is not None:
+                    _backend = RedisBackend(get_redis())
+                else:
+                    _backend = LocMemLRUBackend(settings.SPOTIFY_CACHE_MAX_ENTRIES)
+    return _backend
+
+
+def _record(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def get_stats():
+    """
+        Return this process's cache counters.
+
+        Returns:
+            dict: Counts of `hits`, `misses`, `revalidated` (answered 304 by Spotify) and `stale`
+            (served past their TTL because Spotify was throttling us), plus the resulting `hit_rate`.
+        """
+
+    with _stats_lock:
+        stats = {name: _stats[name] for name in STAT_NAMES}
+    lookups = sum(stats.values())
+    served_from_cache = lookups - stats['misses']
+    stats['hit_rate'] = served_from_cache / lookups if lookups else 0.0
+    return stats
+
+
+def cache_key(spotify_user_id, endpoint, url):
+    """
+        Build the cache key for one endpoint of one Spotify user.
+
+        The URL is hashed into the key so that different query strings (limits, time ranges, cursors)
+        of the same endpoint never share an entry.
+        """
+
+    url_hash = hashlib.sha1(url.encode()).hexdigest()[:12]
+    return f"spotify:response:{spotify_user_id}:{endpoint}:{url_hash}"
+
+
+def _conditional_headers(headers, entry):
+    """
+        Add `If-None-Match` to the request headers when the cached entry has an ETag.
+        """
+
+    if entry and entry.get('etag'):
+        return {**headers, 'If-None-Match': entry['etag']}
+    return headers
+
+
+def _serve_stale(entry):
+    """
+        Serve an expired entry while Spotify is throttling us.
+        """
+
+    _record('stale')
+    return entry['body']
+
+
+def _store_response(backend, key, entry, ttl, now, response):
+    """
+        Update the cache from a Spotify response and return the body to use.
+
+        Args:
+            backend (LocMemLRUBackend | RedisBackend): The cache backend.
+            key (str): The cache key.
+            entry (dict | None): The entry found in the cache before the request, if any.
+            ttl (int): The endpoint's TTL in seconds.
+            now (float): When the request was made, as a Unix timestamp.
+            response (requests.Response | httpx.Response): Spotify's response.
+
+        Returns:
+            dict | None: The decoded JSON body if Spotify answered 200 (or 304); otherwise, None.
+        """
+
+    stored_for = ttl + settings.SPOTIFY_CACHE_REVALIDATE_WINDOW
+    if response.status_code == 304 and entry:
+        _record('revalidated')
+        entry['fetched_at'] = now
+        backend.set(key, entry, stored_for)
+        return entry['body']
+
+    _record('misses')
+    if response.status_code != 200:
+        return None
+    body = response.json()
+    backend.set(key, {'body': body, 'etag': response.headers.get('ETag'), 'fetched_at': now}, stored_for)
+    return body
+
+
+def get_json(spotify_user_id, endpoint, url, headers, timeout=None):
+    """
+        GET a Spotify endpoint through the response cache.
+
+        Entries younger than the endpoint's TTL in `settings.SPOTIFY_CACHE_TTLS` are served without a
+        request. Older entries are kept for `SPOTIFY_CACHE_REVALIDATE_WINDOW` more seconds so they can be
+        revalidated with `If-None-Match` when Spotify sent an ETag, or served stale while Spotify is
+        throttling us. An endpoint with a TTL of 0 is never cached.
+
+        Args:
+            spotify_user_id (str): The Spotify ID of the user the token belongs to.
+            endpoint (str): The endpoint name, used for the TTL lookup and the key.
+            url (str): The absolute URL.
+            headers (dict): The request headers, including the Authorization header.
+            timeout (float, optional): The read timeout for the request.
+
+        Returns:
+            dict | None: The decoded JSON body if Spotify answered 200 (or 304); otherwise, None.
+        """
+
+    ttl = settings.SPOTIFY_CACHE_TTLS.get(endpoint, 0)
+    if not ttl:
+        response = spotify_client.get(url, headers=headers, timeout=timeout)
+        return response.json() if response.status_code == 200 else None
+
+    backend = get_backend()
+    key = cache_key(spotify_user_id, endpoint, url)
+    entry = backend.get(key)
+    now = time.time()
+    if entry and now - entry['fetched_at'] < ttl:
+        _record('hits')
+        return entry['body']
+
+    try:
+        response = spotify_client.get(url, headers=_conditional_headers(headers, entry), timeout=timeout)
+    except spotify_client.SpotifyRateLimited:
+        if not entry:
+            raise
+        return _serve_stale(entry)
+    return _store_response(backend, key, entry, ttl, now, response)
+
+
+async def aget_json(spotify_user_id, endpoint, url, headers, timeout=None):
+    """
+        Async counterpart of `get_json`, sending the request over the shared `httpx.AsyncClient`.
+
+        Cache backend calls run in a worker thread so a Redis round trip never blocks the event loop.
+        """
+
+    ttl = settings.SPOTIFY_CACHE_TTLS.get(endpoint, 0)
+    if not ttl:
+        response = await spotify_client.aget(url, headers=headers, timeout=timeout)
+        return response.json() if response.status_code == 200 else None
+
+    backend = get_backend()
+    key = cache_key(spotify_user_id, endpoint, url)
+    entry = await sync_to_async(backend.get, thread_sensitive=False)(key)
+    now = time.time()
+    if entry and now - entry['fetched_at'] < ttl:
+        _record('hits')
+        return entry['body']
+
+    try:
+        response = await spotify_client.aget(url, headers=_conditional_headers(headers, entry), timeout=timeout)
+    except spotify_client.SpotifyRateLimited:
+        if not entry:
+            raise
+        return _serve_stale(entry)
+    return await sync_to_async(_store_response, thread_sensitive=False)(backend, key, entry, ttl, now, response)
@@ -0,0 +1,399 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import Counter
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+from .rate_limit import get_rate_limiter, get_redis, limiter_key
+
+# Server errors worth retrying for idempotent requests
+RETRYABLE_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# Outcome counters for rate-limited traffic, see `get_stats`
+STAT_NAMES = ('throttled', 'retried', 'dropped')
+
+
+class SpotifyRateLimited(Exception):
+    """
+        Raised when a Spotify call could not be completed within its latency budget because of rate limiting.
+
+        Args:
+            retry_after (float | None): The last wait Spotify asked for, in seconds, if it sent one.
+        """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()  # One httpx.AsyncClient per event loop
+
+
+def build_session():
+    """
+        Build a `requests.Session` configured for Spotify traffic.
+
+        The session keeps connections alive and pools them per host (`SPOTIFY_HTTP_POOL_CONNECTIONS` hosts,
+        `SPOTIFY_HTTP_POOL_MAXSIZE` connections each), and retries with exponential backoff when a
+        connection cannot be established. Requests that reached Spotify are never retried here.
+
+        Returns:
+            requests.Session: The configured session.
+        """
+
+    retry = Retry(
+        total=settings.SPOTIFY_HTTP_RETRIES,
+        connect=settings.SPOTIFY_HTTP_RETRIES,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=settings.SPOTIFY_HTTP_BACKOFF,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings.SPOTIFY_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.SPOTIFY_HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """
+        Return the process-wide Spotify session, creating it on first use.
+
+        A new session is built after a fork (e.g. gunicorn's `--preload`), so worker processes never
+        share pooled sockets with their parent.
+
+        Returns:
+            requests.Session: The shared session.
+        """
+
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = build_session()
+                _session_pid = pid
+    return _session
+
+
+def _timeout(timeout):
+    """
+        Normalize a timeout into a `(connect, read)` tuple.
+
+        Args:
+            timeout (float | tuple | None): A read timeout, a full `(connect, read)` tuple, or None for the defaults.
+
+        Returns:
+            tuple: The `(connect, read)` timeout in seconds.
+        """
+
+    if timeout is None:
+        timeout = settings.SPOTIFY_HTTP_READ_TIMEOUT
+    if isinstance(timeout, tuple):
+        return timeout
+    return (settings.SPOTIFY_HTTP_CONNECT_TIMEOUT, timeout)
+
+
+def _record(stat):
+    """
+        Increment an outcome counter for this process and, when Redis is configured, for the whole fleet.
+
+        Args:
+            stat (str): One of `STAT_NAMES`.
+        """
+
+    with _stats_lock:
+        _stats[stat] += 1
+    client = get_redis()
+    if client is not None:
+        import redis
+
+        try:
+            client.hincrby(f"{limiter_key()}:stats", stat, 1)
+        except redis.RedisError:
+            pass
+
+
+def get_stats():
+    """
+        Return the throttled/retried/dropped counters.
+
+        Returns:
+            dict: `{'process': {...}, 'fleet': {...} | None}`, where `fleet` aggregates every worker
+            sharing the Redis limiter and is None when Redis is not configured or unreachable.
+        """
+
+    with _stats_lock:
+        process = {name: _stats[name] for name in STAT_NAMES}
+    fleet = None
+    client = get_redis()
+    if client is not None:
+        import redis
+
+        try:
+            stored = client.hgetall(f"{limiter_key()}:stats")
+            fleet = {name: int(stored.get(name.encode(), 0)) for name in STAT_NAMES}
+        except redis.RedisError:
+            pass
+    return {'process': process, 'fleet': fleet}
+
+
+class LoggedBody:
+    """
+        The body of a Spotify response, for logging: read and truncated to `SPOTIFY_LOG_BODY_CHARS`
+        only when a log record actually includes it.
+
+        Pass it as an argument of a logging call (`logging.debug("... %s", LoggedBody(response))`)
+        rather than formatting it into the message, so a disabled level costs nothing.
+        """
+
+    def __init__(self, response):
+        self.response = response
+
+    def __str__(self):
+        limit = settings.SPOTIFY_LOG_BODY_CHARS
+        text = self.response.text
+        if len(text) > limit:
+            return f"{text[:limit]}... ({len(text)} characters)"
+        return text
+
+
+def _observe(method, url, start, status):
+    metrics.observe('spotify_request_duration_seconds', time.perf_counter() - start,
+                    metrics.spotify_endpoint(url), method.upper(), str(status))
+
+
+def parse_retry_after(response):
+    """
+        Read the `Retry-After` header of a 429 response.
+
+        Args:
+            response (requests.Response): The throttled response.
+
+        Returns:
+            float: Seconds to wait; 1 when the header is missing or not a number of seconds.
+        """
+
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', 1)))
+    except ValueError:
+        return 1.0
+
+
+def _retry_delay(method, response, attempt, limiter):
+    """
+        Decide whether a response should be retried.
+
+        Args:
+            method (str): The HTTP method of the request.
+            response (requests.Response | httpx.Response): The response received.
+            attempt (int): How many retries were already made.
+            limiter (LocalTokenBucket): The rate limiter, paused for `Retry-After` on a 429.
+
+        Returns:
+            float | None: Seconds to wait before retrying, or None if the response should be returned as is.
+        """
+
+    if response.status_code == 429:
+        _record('throttled')
+        delay = parse_retry_after(response)
+        limiter.pause(delay)
+        return delay
+    if response.status_code in RETRYABLE_STATUSES and method.upper() in IDEMPOTENT_METHODS:
+        return settings.SPOTIFY_HTTP_BACKOFF * (2 ** attempt)
+    return None
+
+
+def _give_up(method, url, response, delay):
+    """
+        Record a dropped call and raise for a 429, or hand back the final 5xx response.
+        """
+
+    _record('dropped')
+    if response.status_code == 429:
+        raise SpotifyRateLimited(f"Spotify throttled {method} {url}", retry_after=delay)
+    return response
+
+
+def request(method, url, timeout=None, budget=None, **kwargs):
+    """
+        Send a request to Spotify over the shared session, within the app-wide rate limit.
+
+        Every attempt first takes a token from the shared rate limiter. A 429 pauses the limiter for
+        the `Retry-After` Spotify asked for and is retried; idempotent requests that hit a 5xx are
+        retried with exponential backoff. Retries stop once `SPOTIFY_MAX_RETRIES` is reached or the
+        next wait would exceed the latency budget.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The absolute URL.
+            timeout (float | tuple | None): The read timeout or `(connect, read)` tuple; defaults to the settings.
+            budget (float, optional): Seconds the call may spend waiting on the limiter and between retries;
+                defaults to `SPOTIFY_RETRY_BUDGET`.
+            **kwargs: Passed through to `requests.Session.request`.
+
+        Returns:
+            requests.Response: The response. A 5xx is returned as-is once retries are exhausted.
+
+        Raises:
+            SpotifyRateLimited: If the call was still throttled when retries ran out.
+        """
+
+    if budget is None:
+        budget = settings.SPOTIFY_RETRY_BUDGET
+    deadline = time.monotonic() + budget
+    limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        if not limiter.acquire(max(0, deadline - time.monotonic())):
+            _record('dropped')
+            raise SpotifyRateLimited(f"No rate limit budget left for {method} {url}")
+
+        start = time.perf_counter()
+        try:
+            response = get_session().request(method, url, timeout=_timeout(timeout), **kwargs)
+        except requests.RequestException as e:
+            _observe(method, url, start, e.__class__.__name__)
+            raise
+        _observe(method, url, start, response.status_code)
+        logging.debug("Spotify answered %s for %s %s: %s", response.status_code, method, url, LoggedBody(response))
+        delay = _retry_delay(method, response, attempt, limiter)
+        if delay is None:
+            return response
+
+        attempt += 1
+        if attempt > settings.SPOTIFY_MAX_RETRIES or time.monotonic() + delay > deadline:
+            return _give_up(method, url, response, delay)
+
+        _record('retried')
+        logging.warning(f"Spotify answered {response.status_code} for {method} {url}; retrying in {delay:.2f}s")
+        if response.status_code != 429:
+            # After a 429 the paused limiter already makes the next attempt wait
+            time.sleep(delay)
+
+
+def get(url, **kwargs):
+    """
+        Send a GET request to Spotify over the shared session. See `request`.
+        """
+
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    """
+        Send a POST request to Spotify over the shared session. See `request`.
+        """
+
+    return request('POST', url, **kwargs)
+
+
+def get_async_client():
+    """
+        Return the `httpx.AsyncClient` shared by all coroutines of the running event loop, creating it on first use.
+
+        The client keeps up to `SPOTIFY_HTTP_ASYNC_MAX_CONNECTIONS` connections open, so one ASGI worker can
+        keep many Spotify calls in flight, and retries connection errors like the sync session does.
+
+        Returns:
+            httpx.AsyncClient: The client for the current event loop.
+        """
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.SPOTIFY_HTTP_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.SPOTIFY_HTTP_POOL_MAXSIZE,
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=settings.SPOTIFY_HTTP_RETRIES),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def arequest(method, url, timeout=None, budget=None, **kwargs):
+    """
+        Async counterpart of `request`, sent over the event loop's shared `httpx.AsyncClient`.
+
+        Takes the same arguments, applies the same rate limit and retry rules, and returns an `httpx.Response`.
+        """
+
+    if budget is None:
+        budget = settings.SPOTIFY_RETRY_BUDGET
+    deadline = time.monotonic() + budget
+    limiter = get_rate_limiter()
+    connect_timeout, read_timeout = _timeout(timeout)
+    client = get_async_client()
+    attempt = 0
+    while True:
+        # The limiter may talk to Redis, so keep it off the event loop
+        wait = await sync_to_async(limiter.try_acquire, thread_sensitive=False)()
+        if wait:
+            if time.monotonic() + wait > deadline:
+                _record('dropped')
+                raise SpotifyRateLimited(f"No rate limit budget left for {method} {url}")
+            await asyncio.sleep(wait)
+            continue
+
+        start = time.perf_counter()
+        try:
+            response = await client.request(
+                method, url, timeout=httpx.Timeout(read_timeout, connect=connect_timeout), **kwargs
+            )
+        except httpx.HTTPError as e:
+            _observe(method, url, start, e.__class__.__name__)
+            raise
+        _observe(method, url, start, response.status_code)
+        logging.debug("Spotify answered %s for %s %s: %s", response.status_code, method, url, LoggedBody(response))
+        delay = await sync_to_async(_retry_delay, thread_sensitive=False)(method, response, attempt, limiter)
+        if delay is None:
+            return response
+
+        attempt += 1
+        if attempt > settings.SPOTIFY_MAX_RETRIES or time.monotonic() + delay > deadline:
+            return _give_up(method, url, response, delay)
+
+        _record('retried')
+        logging.warning(f"Spotify answered {response.status_code} for {method} {url}; retrying in {delay:.2f}s")
+        if response.status_code != 429:
+            await asyncio.sleep(delay)
+
+
+async def aget(url, **kwargs):
+    """
+        Send a GET request to Spotify over the shared async client. See `arequest`.
+        """
+
+    return await arequest('GET', url, **kwargs)
+
+
+async def apost(url, **kwargs):
+    """
+        Send a POST request to Spotify over the shared async client. See `arequest`.
+        """
+
+    return await arequest('POST', url, **kwargs)
@@ -0,0 +1,77 @@
+document.addEventListener("DOMContentLoaded", function () {
+    const slides = document.querySelectorAll('.slide');
+    const indicatorsContainer = document.querySelector('.slide-indicators');
+    const darkModeToggle = document.getElementById('dark-mode-toggle');
+    let currentSlide = 0;
+
+    // Create indicators
+    slides.forEach((_, index) => {
+        const indicator = document.createElement('div');
+        indicator.classList.add('indicator');
+        if (index === 0) indicator.classList.add('active');
+        indicator.addEventListener('click', () => goToSlide(index));
+        indicatorsContainer.appendChild(indicator);
+    });
+
+    const indicators = document.querySelectorAll('.indicator');
+
+    function showSlide(index) {
+        slides.forEach((slide, slideIndex) => {
+            if (slideIndex === index) {
+                slide.classList.add('active');
+                slide.classList.remove('inactive');
+            } else if (slideIndex < index) {
+                slide.classList.add('inactive');
+                slide.classList.remove('active');
+            } else {
+                slide.classList.add('inactive');
+                slide.classList.remove('active');
+            }
+        });
+
+        indicators.forEach((indicator, indicatorIndex) => {
+            indicator.classList.toggle('active', indicatorIndex === index);
+        });
+
+        currentSlide = index;
+    }
+
+    function goToSlide(index) {
+        currentSlide = index;
+        showSlide(currentSlide);
+    }
+
+    document.getElementById('next-slide').addEventListener('click', function () {
+        currentSlide = (currentSlide + 1) % slides.length;
+        showSlide(currentSlide);
+    });
+
+    document.getElementById('prev-slide').addEventListener('click', function () {
+        currentSlide = (currentSlide - 1 + slides.length) % slides.length;
+        showSlide(currentSlide);
+    });
+
+    // Dark mode toggle
+    function updateDarkModeButton() {
+        const isDarkMode = document.body.classList.contains('dark-mode');
+        darkModeToggle.textContent = isDarkMode
+            ? darkModeToggle.dataset.lightLabel
+            : darkModeToggle.dataset.darkLabel;
+    }
+
+    // Check initial dark mode state from localStorage
+    if (localStorage.getItem('darkMode') === 'enabled') {
+        document.body.classList.add('dark-mode');
+        updateDarkModeButton();
+    }
+
+    darkModeToggle.addEventListener('click', function () {
+        document.body.classList.toggle('dark-mode');
+        const isDarkMode = document.body.classList.contains('dark-mode');
+        localStorage.setItem('darkMode', isDarkMode ? 'enabled' : 'disabled');
+        updateDarkModeButton();
+    });
+
+    // Initial load
+    showSlide(currentSlide);
+});
@@ -0,0 +1,196 @@
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import catalog as catalog_store
+from .models import Artist, ListeningStats, PlayEvent, Track
+
+# Plays loaded per query when stats are rebuilt from the whole history
+REBUILD_BATCH_SIZE = 2000
+
+
+def _empty(stats):
+    stats.play_count = 0
+    stats.total_ms = 0
+    stats.artist_counts = {}
+    stats.track_counts = {}
+    stats.genre_counts = {}
+    stats.hour_counts = [0] * 24
+    stats.weekday_counts = [0] * 7
+    stats.last_played_at = None
+
+
+def _add_plays(stats, plays):
+    """
+        Add plays to the aggregates of `stats`, in memory.
+
+        Args:
+            stats (ListeningStats): The aggregates to update.
+            plays (list): `PlayEvent`s of the stats' user. Their tracks and the tracks' artists are
+                looked up with one query each.
+        """
+
+    if not plays:
+        return
+    if len(stats.hour_counts) != 24 or len(stats.weekday_counts) != 7:
+        stats.hour_counts, stats.weekday_counts = [0] * 24, [0] * 7
+
+    tracks = Track.objects.only('spotify_id', 'artist_ids', 'duration_ms').in_bulk({play.track_id for play in plays})
+    artist_ids = {artist_id for track in tracks.values() for artist_id in track.artist_ids}
+    genres = dict(Artist.objects.filter(spotify_id__in=artist_ids).values_list('spotify_id', 'genres'))
+
+    artist_counts = Counter(stats.artist_counts)
+    track_counts = Counter(stats.track_counts)
+    genre_counts = Counter(stats.genre_counts)
+    for play in plays:
+        track = tracks.get(play.track_id)
+        track_artists = track.artist_ids if track else []
+        played_at = timezone.localtime(play.played_at)
+
+        stats.play_count += 1
+        stats.total_ms += (track.duration_ms or 0) if track else 0
+        stats.hour_counts[played_at.hour] += 1
+        stats.weekday_counts[played_at.weekday()] += 1
+        track_counts[play.track_id] += 1
+        artist_counts.update(track_artists)
+        # A play counts once per genre, however many of its artists share it
+        genre_counts.update({genre for artist_id in track_artists for genre in genres.get(artist_id) or []})
+        if not stats.last_played_at or play.played_at > stats.last_played_at:
+            stats.last_played_at = play.played_at
+
+    stats.artist_counts = dict(artist_counts)
+    stats.track_counts = dict(track_counts)
+    stats.genre_counts = dict(genre_counts)
+
+
+def lock_listening_stats(user_id):
+    """
+        Fetch the listening stats of a user for update, creating them if needed.
+
+        Must be called inside a transaction; the row stays locked until it ends, so plays ingested
+        concurrently for the same user are never counted twice or lost.
+        """
+
+    ListeningStats.objects.get_or_create(
+        user_id=user_id, defaults={'hour_counts': [0] * 24, 'weekday_counts': [0] * 7},
+    )
+    return ListeningStats.objects.select_for_update().get(user_id=user_id)
+
+
+def apply_plays(stats, plays):
+    """
+        Add newly ingested plays to a user's listening stats and save them.
+
+        Args:
+            stats (ListeningStats): The user's stats, locked with `lock_listening_stats`.
+            plays (list): The new `PlayEvent`s; each play must be applied exactly once.
+        """
+
+    if not plays:
+        return
+    _add_plays(stats, plays)
+    stats.save()
+
+
+def rebuild_listening_stats(user_id):
+    """
+        Recompute a user's listening stats from their whole listening history.
+
+        Used for backfills, and to pick up genres that were added to the catalog after the plays
+        were counted.
+
+        Args:
+            user_id (int): The ID of the user.
+
+        Returns:
+            ListeningStats: The rebuilt stats.
+        """
+
+    with transaction.atomic():
+        stats = lock_listening_stats(user_id)
+        _empty(stats)
+        plays = PlayEvent.objects.filter(user_id=user_id).only('track_id', 'played_at').order_by('played_at', 'id')
+        last_played_at = None
+        while True:
+            page = plays.filter(played_at__gt=last_played_at) if last_played_at else plays
+            batch = list(page[:REBUILD_BATCH_SIZE])
+            if not batch:
+                break
+            _add_plays(stats, batch)
+            last_played_at = batch[-1].played_at
+        stats.save()
+    return stats
+
+
+def top_genre(stats):
+    """
+        Return the genre a user played most, or None if no played artist has a known genre.
+        """
+
+    if not stats.genre_counts:
+        return None
+    # Ties go to the alphabetically first genre, so the result does not depend on the update order
+    return min(stats.genre_counts.items(), key=lambda item: (-item[1], item[0]))[0]
+
+
+def wrap_top_genre(user_id, wrap_data):
+    """
+        Pick the top genre of a new wrap.
+
+        It comes from the user's listening stats when they have any genre; otherwise from the
+        wrap's own genre analysis, based on its top artists.
+
+        Args:
+            user_id (int): The ID of the user the wrap belongs to.
+            wrap_data (dict): The compact wrap data.
+
+        Returns:
+            str: The genre, or None if none is known.
+        """
+
+    stats = ListeningStats.objects.filter(user_id=user_id).only('genre_counts').first()
+    genre = top_genre(stats) if stats else None
+    if not genre:
+        genres = (wrap_data.get('analysis') or {}).get('top_genres')
+        genre = genres[0] if genres else None
+    return genre[:255] if genre else None
+
+
+def _top(counts, limit):
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+def stats_summary(stats, limit=5):
+    """
+        Summarize a user's listening stats for display, without reading their plays.
+
+        Args:
+            stats (ListeningStats): The user's stats.
+            limit (int): How many top artists, tracks and genres to include.
+
+        Returns:
+            dict: Total plays and minutes, the top artists, tracks and genres with their play counts,
+            and the plays per hour of day and per day of week.
+        """
+
+    top_artists = _top(stats.artist_counts, limit)
+    top_tracks = _top(stats.track_counts, limit)
+    artists = catalog_store.get_many('artists', [i for i, _ in top_artists])
+    tracks = catalog_store.get_many('tracks', [i for i, _ in top_tracks])
+    return {
+        'play_count': stats.play_count,
+        'minutes': stats.total_ms // 60000,
+        'top_artists': [
+            {'id': i, 'name': artists[i].name if i in artists else None, 'plays': plays} for i, plays in top_artists
+        ],
+        'top_tracks': [
+            {'id': i, 'name': tracks[i].name if i in tracks else None,
+             'artist': tracks[i].artist_names if i in tracks else None, 'plays': plays}
+            for i, plays in top_tracks
+        ],
+        'top_genres': [{'name': genre, 'plays': plays} for genre, plays in _top(stats.genre_counts, limit)],
+        'hours': stats.hour_counts,
+        'weekdays': stats.weekday_counts,
+        'last_played_at': stats.last_played_at,
+    }
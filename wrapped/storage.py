@@ -0,0 +1,295 @@
+import copy
+
+from . import catalog as catalog_store
+from .models import Album, Artist, AudioFeatures, Track
+
+# Marks `SpotifyWrap.data` written in the compact, catalog-referencing format
+WRAP_DATA_VERSION = 2
+
+# Columns of `AudioFeatures` besides its ID, in the order Spotify documents them
+AUDIO_FEATURE_FIELDS = ('danceability', 'energy', 'valence', 'acousticness', 'instrumentalness',
+                        'speechiness', 'liveness', 'tempo')
+
+# Time ranges kept under `time_ranges`; the medium term is the wrap's own `top_artists` and `top_tracks`
+OTHER_TIME_RANGES = ('short_term', 'long_term')
+
+
+def _first_image_url(obj):
+    images = obj.get('images') or []
+    return images[0]['url'] if images else None
+
+
+def _play_history_items(recently_played_raw):
+    # Accept the paging object as well as its items
+    if isinstance(recently_played_raw, dict):
+        return recently_played_raw.get('items', [])
+    if isinstance(recently_played_raw, list):
+        return recently_played_raw
+    return []
+
+
+def artist_from_api(artist):
+    """
+        Build an `Artist` row from a full Spotify artist object.
+        """
+
+    return Artist(
+        spotify_id=artist['id'],
+        name=artist['name'][:255],
+        image_url=_first_image_url(artist),
+        genres=artist.get('genres', []),
+    )
+
+
+def simplified_artist_from_api(artist):
+    """
+        Build an `Artist` row from a simplified Spotify artist object, as credited on a track.
+        """
+
+    return Artist(spotify_id=artist['id'], name=artist['name'][:255], is_simplified=True)
+
+
+def album_from_api(album):
+    """
+        Build an `Album` row from a (simplified) Spotify album object.
+        """
+
+    return Album(spotify_id=album['id'], name=album['name'][:255], cover_url=_first_image_url(album))
+
+
+def track_from_api(track):
+    """
+        Build a `Track` row from a Spotify track object; its album is referenced by ID.
+        """
+
+    album = track.get('album')
+    return Track(
+        spotify_id=track['id'],
+        name=track['name'][:255],
+        album_id=album['id'] if album else None,
+        artist_ids=[artist['id'] for artist in track['artists'] if artist.get('id')],
+        artist_names=', '.join(artist['name'] for artist in track['artists'])[:500],
+        duration_ms=track.get('duration_ms'),
+    )
+
+
+def audio_features_from_api(features):
+    """
+        Build an `AudioFeatures` row from a Spotify audio features object.
+        """
+
+    return AudioFeatures(spotify_id=features['id'], **{field: features.get(field) or 0 for field in AUDIO_FEATURE_FIELDS})
+
+
+def normalize_wrap_payloads(results):
+    """
+        Split the payloads of a wrap into catalog rows and the compact data stored on the wrap.
+
+        Only full artist objects (top and followed artists) become `Artist` rows; the simplified
+        artists credited on tracks are kept on the `Track` as IDs and a display name.
+
+        Args:
+            results (dict): Payloads keyed by endpoint name, as returned by `fetch_wrap_payloads`.
+                Must include the user's `profile`.
+
+        Returns:
+            tuple: The compact wrap data (dict) and the catalog, a dict with `artists`, `albums` and
+            `tracks`, each mapping Spotify IDs to unsaved model instances.
+        """
+
+    catalog = {'artists': {}, 'albums': {}, 'tracks': {}}
+
+    def add_artist(artist):
+        catalog['artists'][artist['id']] = artist_from_api(artist)
+        return artist['id']
+
+    def add_track(track):
+        if track.get('album'):
+            catalog['albums'][track['album']['id']] = album_from_api(track['album'])
+        catalog['tracks'][track['id']] = track_from_api(track)
+        return track['id']
+
+    # Tracks without an ID (e.g. local files) cannot be stored in the catalog
+    recently_played = [
+        {'track': add_track(item['track']), 'played_at': item['played_at']}
+        for item in _play_history_items(results.get('recently_played', []))
+        if item['track'].get('id')
+    ]
+    wrap_data = {
+        'version': WRAP_DATA_VERSION,
+        'spotify_username': results['profile'].get('display_name', 'Spotify User'),
+        'top_artists': [add_artist(artist) for artist in results.get('top_artists', [])],
+        'top_tracks': [add_track(track) for track in results.get('top_tracks', []) if track.get('id')],
+        'recently_played': recently_played,
+        'followed_artists': [add_artist(artist) for artist in results.get('followed_artists', [])],
+        'time_ranges': {
+            time_range: {
+                'top_artists': [add_artist(artist) for artist in results.get(f'top_artists_{time_range}', [])],
+                'top_tracks': [
+                    add_track(track) for track in results.get(f'top_tracks_{time_range}', []) if track.get('id')
+                ],
+            }
+            for time_range in OTHER_TIME_RANGES
+        },
+    }
+    return wrap_data, catalog
+
+
+def save_catalog(catalog):
+    """
+        Insert or update the catalog rows of a wrap, with one query per table.
+
+        Every row is upserted, even when the catalog cache holds an identical copy: the cache may be
+        ahead of the database (e.g. after a rolled back transaction), so it is only used for reads.
+
+        Args:
+            catalog (dict): The catalog returned by `normalize_wrap_payloads`.
+        """
+
+    artists = list(catalog['artists'].values())
+    albums = list(catalog['albums'].values())
+    tracks = list(catalog['tracks'].values())
+    Artist.objects.bulk_create(
+        artists, update_conflicts=True,
+        unique_fields=['spotify_id'], update_fields=['name', 'image_url', 'genres', 'is_simplified'],
+    )
+    Album.objects.bulk_create(
+        albums, update_conflicts=True,
+        unique_fields=['spotify_id'], update_fields=['name', 'cover_url'],
+    )
+    Track.objects.bulk_create(
+        tracks, update_conflicts=True,
+        unique_fields=['spotify_id'], update_fields=['name', 'album', 'artist_ids', 'artist_names', 'duration_ms'],
+    )
+    catalog_store.put_many('artists', artists)
+    catalog_store.put_many('albums', albums)
+    catalog_store.put_many('tracks', tracks)
+
+
+def _artist_data(artist):
+    return {'name': artist.name, 'profile_pic': artist.image_url}
+
+
+def _followed_artist_data(artist):
+    # The subset of Spotify's artist object that is kept
+    return {
+        'id': artist.spotify_id,
+        'name': artist.name,
+        'genres': artist.genres,
+        'images': [{'url': artist.image_url}] if artist.image_url else [],
+    }
+
+
+def _track_data(track):
+    return {
+        'name': track.name,
+        'artist': track.artist_names,
+        'album_name': track.album.name if track.album else '',
+        'album_cover': track.album.cover_url if track.album else None,
+    }
+
+
+def _played_data(track, played_at):
+    return {
+        'track': track.name,
+        'artist': track.artist_names,
+        'album_name': track.album.name if track.album else '',
+        'album_cover': track.album.cover_url if track.album else None,
+        'played_at': played_at,
+    }
+
+
+def _expand(data, artists, tracks):
+    # Keep any extra per-wrap keys, and skip references whose rows were removed from the catalog
+    return {
+        **{key: value for key, value in data.items() if key != 'version'},
+        'top_artists': [_artist_data(artists[i]) for i in data['top_artists'] if i in artists],
+        'top_tracks': [_track_data(tracks[i]) for i in data['top_tracks'] if i in tracks],
+        'recently_played': [
+            _played_data(tracks[item['track']], item['played_at'])
+            for item in data['recently_played'] if item['track'] in tracks
+        ],
+        'followed_artists': [_followed_artist_data(artists[i]) for i in data['followed_artists'] if i in artists],
+        # Wraps saved before the short and long terms were fetched have no time ranges
+        'time_ranges': {
+            time_range: {
+                'top_artists': [_artist_data(artists[i]) for i in top_items['top_artists'] if i in artists],
+                'top_tracks': [_track_data(tracks[i]) for i in top_items['top_tracks'] if i in tracks],
+            }
+            for time_range, top_items in data.get('time_ranges', {}).items()
+        },
+    }
+
+
+def load_wraps_data(wraps):
+    """
+        Expand the compact data of several wraps into the dicts rendered by `wrap.html`.
+
+        The catalog rows of all the wraps are looked up together in the catalog cache, which falls
+        back to one query per table for the rows it does not hold, however many wraps are loaded.
+        Data saved before the catalog existed is returned unchanged.
+
+        Args:
+            wraps (Iterable[SpotifyWrap]): The wraps to load.
+
+        Returns:
+            list: One dict per wrap, in the same order, with `spotify_username`, `top_artists`,
+            `top_tracks`, `recently_played`, `followed_artists` and `time_ranges` (the top artists and
+            tracks of the short and long terms, empty for older wraps).
+        """
+
+    wraps = list(wraps)
+    compact = [wrap.data for wrap in wraps if wrap.data.get('version') == WRAP_DATA_VERSION]
+    artist_ids = {artist_id for data in compact for artist_id in data['top_artists'] + data['followed_artists']}
+    track_ids = {track_id for data in compact for track_id in data['top_tracks']}
+    track_ids.update(item['track'] for data in compact for item in data['recently_played'])
+    for data in compact:
+        for top_items in data.get('time_ranges', {}).values():
+            artist_ids.update(top_items['top_artists'])
+            track_ids.update(top_items['top_tracks'])
+
+    artists = catalog_store.get_many('artists', artist_ids)
+    tracks = catalog_store.get_tracks(track_ids)
+
+    loaded = []
+    for wrap in wraps:
+        data = wrap.data
+        if data.get('version') != WRAP_DATA_VERSION:
+            loaded.append(data)
+            continue
+        loaded.append(_expand(data, artists, tracks))
+    return loaded
+
+
+def expand_wrap_data(wrap_data, catalog):
+    """
+        Expand compact wrap data that is not saved yet, using the catalog rows built along with it.
+
+        Args:
+            wrap_data (dict): The compact data, as returned by `normalize_wrap_payloads`.
+            catalog (dict): Its catalog, as returned by `normalize_wrap_payloads`; it is not modified.
+
+        Returns:
+            dict: The wrap data, as described in `load_wraps_data`.
+        """
+
+    tracks = {}
+    for spotify_id, track in catalog['tracks'].items():
+        # Attach the album to a copy so the rows can still be saved as they were built
+        tracks[spotify_id] = copy.copy(track)
+        tracks[spotify_id].album = catalog['albums'].get(track.album_id)
+    return _expand(wrap_data, catalog['artists'], tracks)
+
+
+def load_wrap_data(wrap):
+    """
+        Expand the compact data of one wrap into the dict rendered by `wrap.html`.
+
+        Args:
+            wrap (SpotifyWrap): The wrap to load.
+
+        Returns:
+            dict: The wrap data, as described in `load_wraps_data`.
+        """
+
+    return load_wraps_data([wrap])[0]
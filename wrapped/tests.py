@@ -1,3 +1,1017 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import math
+import socket
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, router
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone, translation
+
+from spotify_wrapped import urls
+
+from . import analytics, async_views, caching, catalog, db_routing, metrics, spotify_cache, spotify_client
+from .bulk import TOKEN_MARGIN, _build
+from .db_routing import read_from_replica
+from .fake_spotify import FOLLOWED_ARTISTS, FakeSpotifyServer, fake_artist
+from .history import ingest_recent_plays, record_plays
+from .jobs import claim_next_job, enqueue_wrap_job, heartbeat_jobs, requeue_stale_jobs, run_job
+from .loaders import CatalogLoader
+from .models import Album, Artist, ListeningStats, PlayEvent, SpotifyProfile, SpotifyWrap, WrapJob
+from .spotify_api import WRAP_ENDPOINTS, afetch_wrap_payloads, fetch_wrap_payloads, get_several
+from .stats import apply_plays, lock_listening_stats, rebuild_listening_stats
+from .storage import WRAP_DATA_VERSION, artist_from_api, load_wrap_data, save_catalog
+from .tokens import aensure_valid_token, ensure_valid_token
+from .wrap_pages import render_wrap_slides
+from .wraps import WrapBuildError, create_wrap, save_wrap
+
+WRAP_DATA = {
+    'spotify_username': 'Listener',
+    'top_artists': [{'name': 'Artist', 'profile_pic': None}],
+    'top_tracks': [{'name': 'Track', 'artist': 'Artist', 'album_name': 'Album', 'album_cover': None}],
+    'recently_played': [{'track': 'Track', 'artist': 'Artist', 'album_name': 'Album', 'album_cover': None,
+                         'played_at': '2024-11-01T12:00:00.000Z'}],
+    'followed_artists': [],
+}
+
+
+# Keep rendered wrap pages out of the development cache directory
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'wrap_pages': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'TIMEOUT': None},
+}
+
+
+# Serve static files without the collectstatic manifest the production storage needs
+TEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class DatabaseOnlyPagesTests(TestCase):
+    """
+        History and replay are served from the database and must never reach out to Spotify,
+        not even to refresh an expired access token.
+        """
+
+    def setUp(self):
+        # LANGUAGE_CODE is not one of LANGUAGES, so URLs reversed before any request are not routable
+        translation.activate('en')
+        self.addCleanup(translation.deactivate)
+        self.user = User.objects.create_user('listener', password='password')
+        self.profile = SpotifyProfile.objects.create(
+            user=self.user, spotify_id='listener', access_token='expired', refresh_token='refresh',
+            expires_at=int(time.time()) - 3600,
+        )
+        self.wrap = SpotifyWrap.objects.create(user=self.user, data=WRAP_DATA)
+        self.client.force_login(self.user)
+
+    def assertNoOutboundConnections(self, url):
+        # Every HTTP client resolves the host and connects a socket before sending anything
+        with mock.patch.object(socket, 'getaddrinfo', side_effect=OSError("network disabled")) as resolve, \
+                mock.patch.object(socket.socket, 'connect', side_effect=OSError("network disabled")) as connect:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(resolve.call_count + connect.call_count, 0)
+
+    def test_history_makes_no_outbound_http(self):
+        self.assertNoOutboundConnections(reverse('wrap_history'))
+
+    def test_replay_makes_no_outbound_http(self):
+        self.assertNoOutboundConnections(reverse('replay_wrap', args=[self.wrap.id]))
+
+    def test_expired_token_is_left_alone(self):
+        self.client.get(reverse('wrap_history'))
+        self.client.get(reverse('replay_wrap', args=[self.wrap.id]))
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.access_token, 'expired')
+
+    def test_warm_pages_make_no_queries(self):
+        history, replay = reverse('wrap_history'), reverse('replay_wrap', args=[self.wrap.id])
+        self.client.get(history)
+        self.client.get(replay)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(history).status_code, 200)
+            self.assertEqual(self.client.get(replay).status_code, 200)
+
+    def test_replay_etag_covers_only_the_wrap(self):
+        replay = reverse('replay_wrap', args=[self.wrap.id])
+        response = self.client.get(replay)
+        self.assertIn('Cookie', response['Vary'])
+        self.client.cookies['csrftoken'] = 'another-csrf-secret-of-the-right-length0'
+        self.assertEqual(self.client.get(replay)['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(replay, headers={'If-None-Match': response['ETag']}).status_code, 304)
+
+    def test_cached_profile_has_no_tokens(self):
+        self.profile.expires_at = int(time.time()) + 3600
+        self.profile.save()
+        profile = caching.get_profile(self.user)
+        cached = cache.get(caching.profile_key(self.user.pk))
+        self.assertEqual(cached.spotify_id, 'listener')
+        self.assertTrue(set(caching.SECRET_PROFILE_FIELDS).isdisjoint(vars(cached)))
+        self.assertTrue(ensure_valid_token(profile))
+        self.assertEqual((profile.access_token, profile.refresh_token), ('expired', 'refresh'))
+
+    def test_replay_etag_changes_with_the_page_and_static_versions(self):
+        replay = reverse('replay_wrap', args=[self.wrap.id])
+        etag = self.client.get(replay)['ETag']
+        with mock.patch('wrapped.wrap_pages.staticfiles_storage', SimpleNamespace(manifest_hash='next-deploy')):
+            response = self.client.get(replay, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        with self.settings(CACHES={**TEST_CACHES, 'wrap_pages': {**TEST_CACHES['wrap_pages'], 'VERSION': 2}}):
+            response = self.client.get(replay, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_cached_history_page_is_read_from_primary(self):
+        # No replica exists here, so any query routed to it would fail
+        with mock.patch.object(db_routing, 'replica_configured', return_value=True):
+            response = self.client.get(reverse('wrap_history'))
+        self.assertContains(response, reverse('replay_wrap', args=[self.wrap.id]))
+
+    @mock.patch('wrapped.views.HISTORY_PAGE_SIZE', 2)
+    def test_history_pages_follow_the_cursor(self):
+        # Three wraps created at the same instant straddle the first page boundary
+        tied = timezone.now() - timedelta(days=1)
+        for days in (0, 0, 0, 2):
+            SpotifyWrap.objects.filter(pk=SpotifyWrap.objects.create(user=self.user, data=WRAP_DATA).pk).update(
+                created_at=tied - timedelta(days=days)
+            )
+        expected = list(SpotifyWrap.objects.filter(user=self.user).order_by('-created_at', '-id')
+                        .values_list('id', flat=True))
+
+        seen, url = [], reverse('wrap_history')
+        while url:
+            response = self.client.get(url)
+            seen += [wrap.id for wrap in response.context['wraps']]
+            self.assertEqual(response.context['is_first_page'], len(seen) <= 2)
+            cursor = response.context['next_cursor']
+            self.assertEqual('Newest wraps' in response.content.decode(), not response.context['is_first_page'])
+            self.assertEqual('Older wraps' in response.content.decode(), cursor is not None)
+            url = f"{reverse('wrap_history')}?{urlencode({'before': cursor})}" if cursor else None
+        self.assertEqual(seen, expected)
+
+    def test_malformed_history_cursor_shows_the_first_page(self):
+        for cursor in ('garbage', 'yesterday,1', '2024-11-25T12:00:00+00:00,x'):
+            response = self.client.get(reverse('wrap_history'), {'before': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['is_first_page'])
+            self.assertEqual([wrap.id for wrap in response.context['wraps']], [self.wrap.id])
+
+    def test_new_and_deleted_wraps_show_up_in_cached_pages(self):
+        history = reverse('wrap_history')
+        self.client.get(history)
+        wrap = SpotifyWrap.objects.create(user=self.user, data=WRAP_DATA)
+        replay = reverse('replay_wrap', args=[wrap.id])
+        self.assertContains(self.client.get(history), replay)
+        self.client.get(replay)
+        wrap.delete()
+        self.assertEqual(self.client.get(replay).status_code, 404)
+        self.assertNotContains(self.client.get(history), replay)
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class WrapApiTests(TestCase):
+    """
+        The JSON API lists, reads and generates the signed-in user's wraps.
+        """
+
+    def setUp(self):
+        self.user = User.objects.create_user('listener', password='password')
+        self.client.force_login(self.user)
+        self.wraps = [SpotifyWrap.objects.create(user=self.user, data=WRAP_DATA) for _ in range(5)]
+
+    def test_list_pages_with_cursor(self):
+        other = User.objects.create_user('other', password='password')
+        SpotifyWrap.objects.create(user=other, data=WRAP_DATA)
+        ids = []
+        url = reverse('api_wrap_list') + '?page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 2)
+            self.assertNotIn('data', page['results'][0])
+            ids += [wrap['id'] for wrap in page['results']]
+            url = page['next']
+        self.assertEqual(ids, sorted((wrap.id for wrap in self.wraps), reverse=True))
+
+    def test_detail_selects_fields(self):
+        url = reverse('api_wrap_detail', args=[self.wraps[0].id])
+        data = self.client.get(url, {'fields': 'top_tracks,unknown'}).json()['data']
+        self.assertEqual(list(data), ['top_tracks'])
+        self.assertEqual(data['top_tracks'][0]['name'], 'Track')
+        self.assertEqual(self.client.get(reverse('api_wrap_detail', args=[0])).status_code, 404)
+
+    def test_detail_revalidates_with_etag(self):
+        url = reverse('api_wrap_detail', args=[self.wraps[0].id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        # Another selection of fields is another representation
+        response = self.client.get(url, {'fields': 'top_tracks'}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_is_gzipped(self):
+        url = reverse('api_wrap_detail', args=[self.wraps[0].id])
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_generate_returns_wrap_and_pins_reads(self):
+        SpotifyProfile.objects.create(user=self.user, spotify_id='listener', access_token='token',
+                                      refresh_token='refresh', expires_at=int(time.time()) + 3600)
+        with mock.patch('wrapped.api_views.create_wrap', return_value=self.wraps[0]), \
+                mock.patch('wrapped.db_routing.replica_configured', return_value=True):
+            response = self.client.post(reverse('api_wrap_generate'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['id'], self.wraps[0].id)
+        self.assertTrue(response['Location'].endswith(reverse('api_wrap_detail', args=[self.wraps[0].id])))
+        self.assertIn(db_routing.PRIMARY_COOKIE, response.cookies)
+
+    @override_settings(WRAP_GENERATION_MODE='background')
+    def test_generate_queues_job_in_background_mode(self):
+        SpotifyProfile.objects.create(user=self.user, spotify_id='listener', access_token='token',
+                                      refresh_token='refresh')
+        response = self.client.post(reverse('api_wrap_generate'))
+        self.assertEqual(response.status_code, 202)
+        job = WrapJob.objects.get(user=self.user)
+        self.assertEqual(response.json()['status_url'], reverse('wrap_job_status', args=[job.id]))
+
+    def test_generate_without_profile_asks_to_connect(self):
+        response = self.client.post(reverse('api_wrap_generate'))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['code'], WrapBuildError.RECONNECT)
+
+
+def play_item(track_number, played_at):
+    # A play history object shaped like Spotify's, with two artists on every third track
+    artists = [{'id': f'artist{track_number % 4}', 'name': f'Artist {track_number % 4}'}]
+    if track_number % 3 == 0:
+        artists.append({'id': 'artist9', 'name': 'Artist 9'})
+    return {
+        'played_at': played_at.isoformat().replace('+00:00', 'Z'),
+        'track': {
+            'id': f'track{track_number}', 'name': f'Track {track_number}', 'artists': artists,
+            'album': {'id': f'album{track_number % 2}', 'name': f'Album {track_number % 2}', 'images': []},
+            'duration_ms': 180000 + track_number * 1000,
+        },
+    }
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class ListeningStatsTests(TestCase):
+    """
+        Stats updated play by play as history is ingested must equal a recompute from the whole history.
+        """
+
+    STAT_FIELDS = ['play_count', 'total_ms', 'artist_counts', 'track_counts', 'genre_counts',
+                   'hour_counts', 'weekday_counts', 'last_played_at']
+
+    def setUp(self):
+        # The catalog LRU outlives the rolled back rows of earlier tests
+        catalog.clear_local()
+        self.user = User.objects.create_user('listener', password='password')
+        Artist.objects.bulk_create([
+            artist_from_api({'id': 'artist0', 'name': 'Artist 0', 'genres': ['indie', 'pop']}),
+            artist_from_api({'id': 'artist1', 'name': 'Artist 1', 'genres': ['pop']}),
+            artist_from_api({'id': 'artist9', 'name': 'Artist 9', 'genres': ['pop', 'jazz']}),
+        ])
+        start = datetime(2024, 11, 25, 22, 0, tzinfo=dt_timezone.utc)
+        # Plays across midnight and several weekdays, with tracks played more than once
+        self.items = [play_item(i % 7, start + timedelta(minutes=37 * i)) for i in range(60)]
+
+    def ingest(self, batches):
+        for batch in batches:
+            stats = lock_listening_stats(self.user.id)
+            apply_plays(stats, record_plays(self.user.id, batch))
+
+    def snapshot(self):
+        stats = ListeningStats.objects.get(user=self.user)
+        return {field: getattr(stats, field) for field in self.STAT_FIELDS}
+
+    def test_incremental_matches_full_recompute(self):
+        # Uneven batches, some of them replaying plays that are already stored
+        self.ingest([self.items[:7], self.items[5:20], self.items[20:21], self.items[:40], self.items[39:]])
+        incremental = self.snapshot()
+
+        rebuild_listening_stats(self.user.id)
+        self.assertEqual(incremental, self.snapshot())
+        self.assertEqual(incremental['play_count'], 60)
+        self.assertEqual(sum(incremental['hour_counts']), 60)
+        self.assertEqual(sum(incremental['weekday_counts']), 60)
+
+    def test_genre_counts_once_per_play(self):
+        # Track 0 is by artist0 (indie, pop) and artist9 (pop, jazz)
+        self.ingest([[play_item(0, datetime(2024, 11, 25, 12, 0, tzinfo=dt_timezone.utc))]])
+        stats = ListeningStats.objects.get(user=self.user)
+        self.assertEqual(stats.genre_counts, {'indie': 1, 'pop': 1, 'jazz': 1})
+        self.assertEqual(stats.artist_counts, {'artist0': 1, 'artist9': 1})
+        self.assertEqual(stats.hour_counts[12], 1)
+        self.assertEqual(stats.weekday_counts[0], 1)
+
+    def test_ingestion_updates_stats(self):
+        profile = SpotifyProfile.objects.create(
+            user=self.user, spotify_id='listener', access_token='token', refresh_token='refresh',
+        )
+        pages = [{'items': self.items[:50]}, {'items': self.items[50:]}, {'items': []}]
+        with mock.patch('wrapped.history.get_recently_played_after', side_effect=pages), \
+                mock.patch('wrapped.loaders.get_several', return_value={'artists': []}):
+            events = ingest_recent_plays(profile)
+        self.assertEqual(len(events), 60)
+        incremental = self.snapshot()
+
+        rebuild_listening_stats(self.user.id)
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_wrap_top_genre_comes_from_stats(self):
+        self.ingest([self.items])
+        wrap_data = {'top_artists': [], 'top_tracks': [], 'recently_played': [], 'followed_artists': []}
+        wrap = save_wrap(self.user.id, wrap_data, {'artists': {}, 'albums': {}, 'tracks': {}})
+        self.assertEqual(wrap.top_genre, 'pop')
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class CatalogCacheTests(TestCase):
+    """
+        The catalog cache only serves reads; the database stays the source of truth.
+        """
+
+    def setUp(self):
+        catalog.clear_local()
+
+    def test_save_writes_rows_the_cache_already_holds(self):
+        # A cached copy of a row that is not in the database, e.g. left over from a rolled back transaction
+        artist = artist_from_api({'id': 'artist0', 'name': 'Artist 0', 'genres': ['pop']})
+        catalog._fill('artists', {'artist0': catalog._values('artists', artist)}, shared=False)
+
+        save_catalog({'artists': {'artist0': artist}, 'albums': {}, 'tracks': {}})
+        self.assertTrue(Artist.objects.filter(pk='artist0').exists())
+
+    def test_database_reads_are_cached_after_commit(self):
+        Artist.objects.create(spotify_id='artist0', name='Artist 0')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertIn('artist0', catalog.get_many('artists', ['artist0']))
+            self.assertEqual(catalog.get_stats()['local_entries'], 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(catalog.get_stats()['local_entries'], 1)
+
+    def test_forgotten_rows_leave_the_local_cache(self):
+        artist = artist_from_api({'id': 'artist0', 'name': 'Artist 0', 'genres': ['pop']})
+        catalog._fill('artists', {'artist0': catalog._values('artists', artist)}, shared=False)
+        catalog.forget('artists', ['artist0'])
+        self.assertEqual(catalog.get_stats()['local_entries'], 0)
+        self.assertEqual(catalog.get_many('artists', ['artist0']), {})
+
+
+class FakeSpotifyMixin:
+    """
+        Point the app at a fake Spotify server started by the test.
+        """
+
+    def spotify(self, **faults):
+        server = FakeSpotifyServer(**faults).start()
+        self.addCleanup(server.stop)
+        # The async client needs app credentials to send; the fake server accepts any
+        overrides = override_settings(SPOTIFY_API_BASE_URL=server.base_url,
+                                      SPOTIFY_ACCOUNTS_BASE_URL=server.accounts_url,
+                                      SPOTIPY_CLIENT_ID='client-id', SPOTIPY_CLIENT_SECRET='client-secret')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        return server
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES, SPOTIFY_RETRY_BUDGET=2, SPOTIFY_MAX_RETRIES=1)
+class FakeSpotifyServerTests(FakeSpotifyMixin, TestCase):
+    """
+        The app runs end to end against the fake Spotify server, including its failures.
+        """
+
+    def setUp(self):
+        catalog.clear_local()
+        # LANGUAGE_CODE is not one of LANGUAGES, so URLs reversed before any request are not routable
+        translation.activate('en')
+        self.addCleanup(translation.deactivate)
+        self.user = User.objects.create_user('listener', password='password')
+        self.client.force_login(self.user)
+
+    def test_concurrent_fetch_matches_sequential(self):
+        self.spotify(latency=0.01)
+        sequential = {name: fetch('token') for name, fetch in WRAP_ENDPOINTS.items()}
+        self.assertEqual(fetch_wrap_payloads('token'), (sequential, {}))
+        self.assertEqual(async_to_sync(afetch_wrap_payloads)('token'), (sequential, {}))
+
+    def test_failed_endpoint_keeps_other_results(self):
+        self.spotify()
+
+        def fail(access_token, **kwargs):
+            raise TimeoutError("too slow")
+
+        results, errors = fetch_wrap_payloads('token', {**WRAP_ENDPOINTS, 'recently_played': fail})
+        self.assertEqual(set(results), set(WRAP_ENDPOINTS) - {'recently_played'})
+        self.assertIsInstance(errors['recently_played'], TimeoutError)
+
+    def test_sequential_calls_reuse_one_connection(self):
+        server = self.spotify()
+        connect, connected = socket.socket.connect, []
+
+        def counting_connect(sock, address):
+            connected.append(address)
+            return connect(sock, address)
+
+        with mock.patch.object(socket.socket, 'connect', counting_connect):
+            for _ in range(5):
+                self.assertEqual(spotify_client.get(f"{server.base_url}/me").status_code, 200)
+        self.assertEqual(len(connected), 1)
+
+    @override_settings(SPOTIFY_HTTP_BACKOFF=0)
+    def test_server_error_is_retried(self):
+        # With this seed the first request is answered 503 and the second one normally
+        server = self.spotify(error_rate=0.5, seed=1)
+        self.assertEqual(spotify_client.get(f"{server.base_url}/me").status_code, 200)
+        self.assertEqual(server.requests_served, 2)
+        # Requests that are not idempotent are never sent twice
+        server = self.spotify(error_rate=0.5, seed=1)
+        self.assertEqual(spotify_client.post(f"{server.accounts_url}/api/token").status_code, 503)
+        self.assertEqual(server.requests_served, 1)
+
+    def test_throttled_call_is_retried_once(self):
+        # With this seed the first request is answered 429 and the second one normally
+        server = self.spotify(throttle_rate=0.5, retry_after=0, seed=1)
+        before = spotify_client.get_stats()['process']
+        response = spotify_client.get(f"{server.base_url}/me")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(server.requests_served, 2)
+
+        self.user.is_staff = True
+        self.user.save()
+        after = self.client.get(reverse('spotify_client_stats')).json()['rate_limit']['process']
+        self.assertEqual({name: after[name] - before[name] for name in spotify_client.STAT_NAMES},
+                         {'throttled': 1, 'retried': 1, 'dropped': 0})
+
+    @override_settings(SPOTIFY_CACHE_TTLS={'me': 60})
+    def test_revalidated_response_serves_cached_body(self):
+        server = self.spotify()
+        url = f"{server.base_url}/me"
+        body = spotify_cache.get_json('revalidated-user', 'me', url, {})
+        # Expire the entry, so the next call asks Spotify whether it changed
+        key = spotify_cache.cache_key('revalidated-user', 'me', url)
+        entry = spotify_cache.get_backend().get(key)
+        entry['fetched_at'] -= 120
+        spotify_cache.get_backend().set(key, entry, 60)
+
+        self.user.is_staff = True
+        self.user.save()
+        before = self.client.get(reverse('spotify_client_stats')).json()['response_cache']
+        self.assertEqual(spotify_cache.get_json('revalidated-user', 'me', url, {}), body)
+        after = self.client.get(reverse('spotify_client_stats')).json()['response_cache']
+        self.assertEqual(server.requests_served, 2)
+        self.assertEqual(after['revalidated'] - before['revalidated'], 1)
+        self.assertEqual(after['misses'], before['misses'])
+
+    def test_oauth_callback_links_profile(self):
+        self.spotify()
+        response = self.client.get(reverse('spotify_callback'), {'code': 'fake-code'})
+        self.assertRedirects(response, reverse('generate_wrap'), fetch_redirect_response=False)
+        profile = SpotifyProfile.objects.get(user=self.user)
+        self.assertEqual(profile.spotify_id, 'fakeuser')
+        self.assertEqual(profile.refresh_token, 'fake-refresh-fake-code')
+
+    def test_expired_token_is_refreshed_before_generating(self):
+        self.spotify()
+        SpotifyProfile.objects.create(user=self.user, spotify_id='listener', access_token='expired',
+                                      refresh_token='refresh', expires_at=int(time.time()) - 60)
+        response = self.client.get(reverse('generate_wrap'))
+        self.assertEqual(response.status_code, 200)
+        profile = SpotifyProfile.objects.get(user=self.user)
+        self.assertTrue(profile.access_token.startswith('fake-access-'))
+        self.assertEqual(profile.refresh_token, 'refresh')
+        self.assertEqual(len(SpotifyWrap.objects.get(user=self.user).data['top_tracks']), 50)
+
+    def test_ingestion_refreshes_token_and_fetches_only_new_plays(self):
+        server = self.spotify()
+        SpotifyProfile.objects.create(user=self.user, spotify_id='listener', access_token='expired',
+                                      refresh_token='refresh', expires_at=int(time.time()) - 60)
+        call_command('ingest_listening_history', stdout=StringIO())
+        profile = SpotifyProfile.objects.get(user=self.user)
+        self.assertTrue(profile.access_token.startswith('fake-access-'))
+        self.assertEqual(PlayEvent.objects.filter(user=self.user).count(), 10)
+        self.assertEqual(ListeningStats.objects.get(user=self.user).play_count, 10)
+        self.assertIsNotNone(profile.recently_played_after)
+
+        # The next poll asks for the plays after the cursor only, and there are none
+        served = server.requests_served
+        call_command('ingest_listening_history', stdout=StringIO())
+        self.assertEqual(server.requests_served - served, 1)
+        self.assertEqual(PlayEvent.objects.filter(user=self.user).count(), 10)
+
+    def test_streamed_wrap_matches_inline_wrap(self):
+        server = self.spotify()
+        SpotifyProfile.objects.create(user=self.user, spotify_id='listener', access_token='token',
+                                      refresh_token='refresh', expires_at=int(time.time()) + 3600)
+        self.client.get(reverse('generate_wrap'))
+        inline = SpotifyWrap.objects.get(user=self.user)
+
+        with override_settings(WRAP_GENERATION_MODE='stream'):
+            response = self.client.get(reverse('generate_wrap'))
+            chunks = iter(response.streaming_content)
+            # The page head is sent before Spotify is called
+            served = server.requests_served
+            self.assertIn(b'<head', next(chunks))
+            self.assertEqual(server.requests_served, served)
+            page = b''.join(chunks).decode()
+
+        streamed = SpotifyWrap.objects.filter(user=self.user).exclude(pk=inline.pk).get()
+        self.assertEqual(streamed.data, inline.data)
+        # The sections are rendered one template at a time, which only changes the blank lines between them
+        self.assertIn(' '.join(render_wrap_slides(streamed).split()), ' '.join(page.split()))
+
+    def test_wrap_covers_every_time_range_and_followed_artist(self):
+        self.spotify()
+        profile = SpotifyProfile.objects.create(user=self.user, spotify_id='listener', access_token='token',
+                                                refresh_token='refresh', expires_at=int(time.time()) + 3600)
+        data = create_wrap(profile).data
+        self.assertEqual(len(data['followed_artists']), FOLLOWED_ARTISTS)
+        self.assertEqual(data['time_ranges']['short_term']['top_tracks'][0], 'track0005')
+        self.assertEqual(data['time_ranges']['long_term']['top_artists'][0], 'artist0010')
+        self.assertEqual(len(data['time_ranges']['long_term']['top_tracks']), 50)
+
+    def test_throttled_wrap_is_not_saved(self):
+        self.spotify(throttle_rate=1.0, retry_after=0)
+        profile = SpotifyProfile.objects.create(user=self.user, spotify_id='listener', access_token='token',
+                                                refresh_token='refresh', expires_at=int(time.time()) + 3600)
+        with self.assertRaises(WrapBuildError) as raised:
+            create_wrap(profile)
+        self.assertEqual(raised.exception.reason, WrapBuildError.THROTTLED)
+        self.assertFalse(SpotifyWrap.objects.exists())
+
+    def test_wrap_past_fetch_deadline_is_not_saved(self):
+        profile = SpotifyProfile.objects.create(user=self.user, spotify_id='listener', access_token='token',
+                                                refresh_token='refresh', expires_at=int(time.time()) + 3600)
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def stuck(access_token, **kwargs):
+            release.wait(5)
+            return []
+
+        # Calls still running once the test is over must not page on to the real Spotify
+        endpoints = {name: lambda access_token, **kwargs: [] for name in WRAP_ENDPOINTS}
+        timeouts = {name: 0.05 for name in settings.SPOTIFY_FETCH_TIMEOUTS}
+        with self.settings(SPOTIFY_FETCH_TIMEOUTS=timeouts), \
+                mock.patch.dict(WRAP_ENDPOINTS, {**endpoints, 'recently_played': stuck}):
+            with self.assertRaises(WrapBuildError) as raised:
+                create_wrap(profile)
+        self.assertEqual(raised.exception.reason, WrapBuildError.THROTTLED)
+        self.assertFalse(SpotifyWrap.objects.exists())
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class CatalogLoaderTests(FakeSpotifyMixin, TestCase):
+    """
+        Catalog misses are fetched in full-size chunks, and only the misses are fetched.
+        """
+
+    def setUp(self):
+        catalog.clear_local()
+
+    def test_misses_are_fetched_in_chunks(self):
+        server = self.spotify()
+        artists = [fake_artist(i) for i in range(120)]
+        ids = [artist['id'] for artist in artists]
+        # The first 20 artists are in the catalog already
+        save_catalog({'artists': {artist['id']: artist_from_api(artist) for artist in artists[:20]},
+                      'albums': {}, 'tracks': {}})
+
+        loader = CatalogLoader('token')
+        loader.want('artists', ids)
+        self.assertEqual(set(loader.load()['artists']), set(ids))
+        # 100 misses fit in two requests of 50
+        self.assertEqual(server.requests_served, 2)
+        self.assertEqual(Artist.objects.count(), 120)
+
+        loader = CatalogLoader('token')
+        loader.want('artists', ids)
+        self.assertEqual(len(loader.load()['artists']), 120)
+        self.assertEqual(server.requests_served, 2)
+
+    def test_get_several_splits_every_endpoint(self):
+        server = self.spotify()
+        fetched = get_several('token', {
+            'artists': [f"artist{i}" for i in range(51)],
+            'audio_features': [f"track{i}" for i in range(100)],
+            'tracks': ['track0', 'unknown'],
+        })
+        self.assertEqual({endpoint: len(items) for endpoint, items in fetched.items()},
+                         {'artists': 51, 'audio_features': 100, 'tracks': 1})
+        self.assertEqual(server.requests_served, 4)
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES, SPOTIFY_RETRY_BUDGET=2, SPOTIFY_MAX_RETRIES=1)
+class AsyncViewTests(FakeSpotifyMixin, TestCase):
+    """
+        The async views, routed when WRAP_ASYNC_VIEWS is on, link Spotify and build wraps against the fake server.
+        """
+
+    def setUp(self):
+        catalog.clear_local()
+        # The views are picked when the URLconf is imported
+        with self.settings(WRAP_ASYNC_VIEWS=True):
+            importlib.reload(urls)
+        self.addCleanup(clear_url_caches)
+        self.addCleanup(importlib.reload, urls)
+        clear_url_caches()
+        # LANGUAGE_CODE is not one of LANGUAGES, so URLs reversed before any request are not routable
+        translation.activate('en')
+        self.addCleanup(translation.deactivate)
+        self.user = User.objects.create_user('listener', password='password')
+        self.generate, self.callback = reverse('generate_wrap'), reverse('spotify_callback')
+        self.connect = reverse('spotify_connect')
+        self.assertIs(resolve(self.generate).func, async_views.agenerate_wrap)
+
+    def link(self, expires_in=3600):
+        return SpotifyProfile.objects.create(user=self.user, spotify_id='fakeuser', access_token='token',
+                                             refresh_token='refresh', expires_at=int(time.time()) + expires_in)
+
+    async def test_callback_links_the_profile(self):
+        self.spotify()
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.callback, {'code': 'fake-code'})
+        self.assertRedirects(response, self.generate, fetch_redirect_response=False)
+        profile = await SpotifyProfile.objects.aget(user=self.user)
+        self.assertEqual((profile.spotify_id, profile.refresh_token), ('fakeuser', 'fake-refresh-fake-code'))
+
+    async def test_throttled_callback_shows_an_error(self):
+        self.spotify(throttle_rate=1.0, retry_after=0)
+        await self.async_client.aforce_login(self.user)
+        with self.assertLogs(level='WARNING'):
+            response = await self.async_client.get(self.callback, {'code': 'fake-code'})
+        self.assertContains(response, 'Failed to obtain token information from Spotify.')
+        self.assertFalse(await SpotifyProfile.objects.filter(user=self.user).aexists())
+
+    async def test_wrap_is_generated(self):
+        self.spotify()
+        await sync_to_async(self.link)()
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.generate)
+        self.assertTemplateUsed(response, 'wrap.html')
+        wrap = await SpotifyWrap.objects.aget(user=self.user)
+        self.assertEqual(len(wrap.data['top_tracks']), 50)
+
+    async def test_expired_token_is_refreshed_first(self):
+        server = self.spotify()
+        await sync_to_async(self.link)(expires_in=-60)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.generate)
+        self.assertTemplateUsed(response, 'wrap.html')
+        profile = await SpotifyProfile.objects.aget(user=self.user)
+        self.assertTrue(profile.access_token.startswith('fake-access-'))
+        self.assertGreater(profile.expires_at, time.time())
+        self.assertGreater(server.requests_served, 1)
+
+    async def test_failed_refresh_asks_to_reconnect(self):
+        self.spotify(error_rate=1.0)
+        await sync_to_async(self.link)(expires_in=-60)
+        await self.async_client.aforce_login(self.user)
+        with self.assertLogs(level='ERROR'):
+            response = await self.async_client.get(self.generate)
+        self.assertRedirects(response, self.connect, fetch_redirect_response=False)
+        self.assertFalse(await SpotifyWrap.objects.filter(user=self.user).aexists())
+
+    async def test_throttled_wrap_shows_an_error(self):
+        self.spotify(throttle_rate=1.0, retry_after=0)
+        await sync_to_async(self.link)()
+        await self.async_client.aforce_login(self.user)
+        with self.assertLogs(level='ERROR'):
+            response = await self.async_client.get(self.generate)
+        self.assertContains(response, 'Spotify is receiving too many requests right now.')
+        self.assertFalse(await SpotifyWrap.objects.filter(user=self.user).aexists())
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class TokenRefreshTests(FakeSpotifyMixin, TransactionTestCase):
+    """
+        Concurrent refreshes of one profile are coalesced into a single call to Spotify's accounts service.
+        """
+
+    def setUp(self):
+        user = User.objects.create_user('listener', password='password')
+        self.profile = SpotifyProfile.objects.create(user=user, spotify_id='listener', access_token='expired',
+                                                     refresh_token='refresh', expires_at=int(time.time()) - 60)
+
+    def test_concurrent_refreshes_make_one_call(self):
+        # Without REDIS_URL the process lock and the conditional write back coalesce the refreshes
+        server = self.spotify(latency=0.1)
+        results = []
+
+        def refresh():
+            profile = SpotifyProfile.objects.get(pk=self.profile.pk)
+            results.append((ensure_valid_token(profile), profile.access_token))
+            connection.close()
+
+        threads = [threading.Thread(target=refresh) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(server.requests_served, 1)
+        access_token = SpotifyProfile.objects.get(pk=self.profile.pk).access_token
+        self.assertTrue(access_token.startswith('fake-access-'))
+        self.assertEqual(results, [(True, access_token)] * 5)
+
+    def test_token_rotated_elsewhere_is_kept(self):
+        self.spotify()
+        post = spotify_client.post
+
+        def rotate_then_post(**kwargs):
+            # Another process refreshes the token while our call to Spotify is in flight
+            SpotifyProfile.objects.filter(pk=self.profile.pk).update(
+                access_token='theirs', refresh_token='rotated', expires_at=int(time.time()) + 3600)
+            return post(**kwargs)
+
+        with mock.patch('wrapped.tokens.spotify_client.post', side_effect=rotate_then_post):
+            self.assertTrue(ensure_valid_token(self.profile))
+        self.assertEqual((self.profile.access_token, self.profile.refresh_token), ('theirs', 'rotated'))
+        stored = SpotifyProfile.objects.get(pk=self.profile.pk)
+        self.assertEqual((stored.access_token, stored.refresh_token), ('theirs', 'rotated'))
+
+    def test_expired_shared_lock_does_not_fail_the_refresh(self):
+        import redis
+
+        self.spotify()
+        client = mock.Mock()
+        client.lock.return_value.acquire.return_value = True
+        client.lock.return_value.release.side_effect = redis.exceptions.LockNotOwnedError("expired")
+        with mock.patch('wrapped.tokens.get_redis', return_value=client):
+            self.assertTrue(ensure_valid_token(self.profile))
+        self.assertTrue(self.profile.access_token.startswith('fake-access-'))
+
+    def test_async_refresh_is_coalesced(self):
+        server = self.spotify(latency=0.1)
+
+        async def refresh_all():
+            profiles = [await SpotifyProfile.objects.aget(pk=self.profile.pk) for _ in range(5)]
+            return await asyncio.gather(*(aensure_valid_token(profile) for profile in profiles))
+
+        self.assertEqual(async_to_sync(refresh_all)(), [True] * 5)
+        self.assertEqual(server.requests_served, 1)
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class NormalizeWrapDataMigrationTests(TransactionTestCase):
+    """
+        Wraps saved in the expanded format before the catalog load back unchanged once normalized.
+        """
+
+    LEGACY_DATA = {
+        'spotify_username': 'Listener',
+        'top_artists': [{'name': 'Artist', 'profile_pic': 'https://i.scdn.co/artist.jpg'},
+                        {'name': 'Other Artist', 'profile_pic': None}],
+        'top_tracks': [{'name': 'Track', 'artist': 'Artist', 'album_name': 'Album', 'album_cover': None},
+                       {'name': 'B-Side', 'artist': 'Artist, Other Artist', 'album_name': 'Album',
+                        'album_cover': None}],
+        'recently_played': [{'track': 'Track', 'artist': 'Artist', 'album_name': 'Album', 'album_cover': None,
+                             'played_at': '2024-11-01T12:00:00.000Z'}],
+        # Followed artists were saved as Spotify's paging object
+        'followed_artists': {'artists': {'items': [
+            {'id': 'followed1', 'name': 'Followed', 'genres': ['indie'], 'popularity': 40,
+             'images': [{'url': 'https://i.scdn.co/followed.jpg', 'height': 640, 'width': 640}]},
+        ]}},
+    }
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(target)
+        return executor.loader.project_state(target).apps
+
+    def setUp(self):
+        catalog.clear_local()
+        self.addCleanup(self.migrate, MigrationExecutor(connection).loader.graph.leaf_nodes('wrapped'))
+
+    def test_normalized_wrap_loads_like_the_legacy_one(self):
+        apps = self.migrate([('wrapped', '0008_artist_album_track')])
+        user = apps.get_model('auth', 'User').objects.create(username='listener')
+        wrap_id = apps.get_model('wrapped', 'SpotifyWrap').objects.create(user=user, data=self.LEGACY_DATA).pk
+
+        self.migrate([('wrapped', '0009_normalize_wrap_data')])
+        # The current models, used to load the wrap, need the later migrations too
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('wrapped'))
+        wrap = SpotifyWrap.objects.get(pk=wrap_id)
+        self.assertEqual(wrap.data['version'], WRAP_DATA_VERSION)
+        followed = self.LEGACY_DATA['followed_artists']['artists']['items'][0]
+        self.assertEqual(load_wrap_data(wrap), {
+            **self.LEGACY_DATA,
+            'followed_artists': [{'id': 'followed1', 'name': 'Followed', 'genres': ['indie'],
+                                  'images': [{'url': followed['images'][0]['url']}]}],
+            'time_ranges': {},
+        })
+        # Both tracks share one album row
+        self.assertEqual(Album.objects.count(), 1)
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class WrapJobTests(TestCase):
+    """
+        A claimed job always finishes, so the user can queue another one.
+        """
+
+    def test_error_before_building_fails_the_job(self):
+        user = User.objects.create_user('listener', password='password')
+        SpotifyProfile.objects.create(user=user, spotify_id='listener', access_token='token',
+                                      refresh_token='refresh', expires_at=int(time.time()) - 60)
+        enqueue_wrap_job(user)
+        job = claim_next_job()
+        with mock.patch('wrapped.jobs.ensure_valid_token', side_effect=RuntimeError("database is locked")), \
+                self.assertLogs(level='ERROR'):
+            run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (WrapJob.FAILED, "database is locked"))
+        self.assertNotEqual(enqueue_wrap_job(user).id, job.id)
+
+    def test_only_jobs_without_recent_heartbeat_are_requeued(self):
+        slow, dead = (enqueue_wrap_job(User.objects.create_user(name)) for name in ('slow', 'dead'))
+        for _ in range(2):
+            claim_next_job()
+        long_ago = timezone.now() - timedelta(hours=1)
+        WrapJob.objects.update(started_at=long_ago, heartbeat_at=long_ago)
+        heartbeat_jobs([slow.id])
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=5)), 1)
+        self.assertEqual(WrapJob.objects.get(id=slow.id).status, WrapJob.RUNNING)
+        self.assertEqual(WrapJob.objects.get(id=dead.id).status, WrapJob.PENDING)
+
+    def test_worker_backs_off_when_claiming_fails(self):
+        claims = mock.Mock(side_effect=[RuntimeError("database is locked"), RuntimeError("database is locked"), None])
+        with mock.patch('wrapped.management.commands.run_wrap_worker.claim_next_job', claims), \
+                mock.patch('wrapped.management.commands.run_wrap_worker.time.sleep') as sleep, \
+                self.assertLogs(level='ERROR'):
+            call_command('run_wrap_worker', '--once', '--poll-interval', '1', stdout=StringIO())
+        self.assertEqual(claims.call_count, 3)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [2, 4])
+
+
+class BulkTokenRefreshTests(SimpleTestCase):
+    """
+        Bulk runs only refresh the tokens that would expire while their wrap is being built.
+        """
+
+    def build(self, expires_in):
+        profile = SpotifyProfile(pk=1, user_id=1, access_token='token', refresh_token='refresh',
+                                 expires_at=int(time.time()) + expires_in)
+        with mock.patch('wrapped.bulk.refresh_token_single_flight', return_value=True) as refresh, \
+                mock.patch('wrapped.bulk.build_wrap_data', return_value=({}, {})), \
+                mock.patch('wrapped.bulk.close_old_connections'):
+            _build(profile, TOKEN_MARGIN)
+        return refresh.call_count
+
+    def test_token_valid_for_an_hour_is_not_refreshed(self):
+        self.assertEqual(self.build(3600), 0)
+
+    def test_token_expiring_during_the_build_is_refreshed(self):
+        self.assertEqual(self.build(60), 1)
+
+
+class RequestMetricsTests(SimpleTestCase):
+    """
+        Requests are timed in sync and async middleware chains, and the Spotify counters are exported.
+        """
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_async_chain_is_timed(self):
+        async def view(request):
+            return HttpResponse(status=201)
+
+        middleware = metrics.RequestMetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('http_request_duration_seconds_count{view="unmatched",method="GET",status="201"} 1',
+                      metrics.render_prometheus())
+
+    def test_sync_chain_is_timed(self):
+        middleware = metrics.RequestMetricsMiddleware(lambda request: HttpResponse())
+        self.assertFalse(iscoroutinefunction(middleware))
+        self.assertEqual(middleware(RequestFactory().get('/')).status_code, 200)
+        self.assertIn('http_request_duration_seconds_count{view="unmatched",method="GET",status="200"} 1',
+                      metrics.render_prometheus())
+
+    def test_spotify_counters_are_exported(self):
+        exposition = metrics.render_prometheus()
+        self.assertIn('# TYPE spotify_rate_limit_calls_total counter', exposition)
+        throttled = spotify_client.get_stats()['process']['throttled']
+        self.assertIn(f'spotify_rate_limit_calls_total{{outcome="throttled"}} {throttled}', exposition)
+        self.assertIn('# TYPE spotify_response_cache_lookups_total counter', exposition)
+        self.assertIn('spotify_response_cache_lookups_total{result="revalidated"}', exposition)
+
+
+class GenreAnalyticsTests(SimpleTestCase):
+    """
+        The genre analytics agree with a plain count on a small fixture.
+        """
+
+    # Artist d has no known genres and artist e is not in the catalog
+    ARTIST_GENRES = {'a': ['pop', 'indie'], 'b': ['pop'], 'c': ['jazz'], 'd': None}
+    PLAYS = {'a': 3, 'b': 1, 'c': 4, 'd': 5, 'e': 2}
+
+    def test_distribution_matches_plain_count(self):
+        genres, weights = analytics.genre_distribution(self.PLAYS, self.ARTIST_GENRES)
+        expected = Counter()
+        for artist_id, plays in self.PLAYS.items():
+            for genre in self.ARTIST_GENRES.get(artist_id) or ():
+                expected[genre] += plays
+        self.assertEqual(dict(zip(genres, weights.tolist())), expected)
+        self.assertEqual(genres, ['pop', 'indie', 'jazz'])
+
+    def test_top_genres_break_ties_alphabetically(self):
+        genres, weights = analytics.genre_distribution(self.PLAYS, self.ARTIST_GENRES)
+        self.assertEqual(analytics.top_genres(genres, weights, limit=2), ['jazz', 'pop'])
+        self.assertEqual(analytics.top_genres([], weights[:0]), [])
+
+    def test_diversity_is_normalized_entropy(self):
+        _, weights = analytics.genre_distribution(self.PLAYS, self.ARTIST_GENRES)
+        entropy, diversity = analytics.genre_diversity(weights)
+        expected = -sum(w / 11 * math.log2(w / 11) for w in (4, 3, 4))
+        self.assertAlmostEqual(entropy, expected)
+        self.assertAlmostEqual(diversity, expected / math.log2(3))
+        self.assertEqual(analytics.genre_diversity(weights[:1]), (0.0, 0.0))
+
+    def test_sound_slide_is_translated(self):
+        mood = dict.fromkeys(analytics.MOOD_FEATURES, 0.5)
+        with translation.override('fr'):
+            slide = render_to_string('wrap_slides/your_sound.html', {'wrap_data': {'analysis': {'mood': mood}}})
+        for label in ('Votre son', 'Énergie', 'Positivité', 'Dansabilité', 'Caractère acoustique'):
+            self.assertIn(label, slide)
+
+
+class TimeRangesSlideTests(SimpleTestCase):
+    """
+        The lately vs. all time slide shows whichever time ranges have top tracks.
+        """
+
+    TRACKS = [{'name': 'Song', 'artist': 'Singer'}]
+    ARTISTS = [{'name': 'Singer'}]
+
+    def render(self, short_term, long_term):
+        time_ranges = {'short_term': short_term, 'long_term': long_term}
+        return render_to_string('wrap_slides/time_ranges.html', {'wrap_data': {'time_ranges': time_ranges}})
+
+    def test_slide_is_skipped_without_top_tracks(self):
+        self.assertNotIn('time-ranges-slide', self.render({'top_tracks': [], 'top_artists': self.ARTISTS}, {}))
+        self.assertNotIn('time-ranges-slide', render_to_string('wrap_slides/time_ranges.html', {'wrap_data': {}}))
+
+    def test_one_empty_time_range_keeps_the_slide(self):
+        with translation.override('fr'):
+            slide = self.render({'top_tracks': [], 'top_artists': []},
+                                {'top_tracks': self.TRACKS, 'top_artists': self.ARTISTS})
+        self.assertIn('Récemment vs. depuis toujours', slide)
+        self.assertIn('Depuis toujours', slide)
+        self.assertIn('<li>Song par Singer</li>', slide)
+        self.assertEqual(slide.count('<li>'), 1)
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    """
+        Replica-routed views read from the replica, except for writes and right after generating a wrap.
+        """
+
+    def read_alias(self, request):
+        @read_from_replica
+        def view(request):
+            return router.db_for_read(SpotifyWrap)
+
+        with mock.patch.object(db_routing, 'replica_configured', return_value=True):
+            return view(request)
+
+    def test_get_reads_from_replica(self):
+        self.assertEqual(self.read_alias(RequestFactory().get('/')), db_routing.REPLICA_ALIAS)
+        self.assertEqual(router.db_for_read(SpotifyWrap), DEFAULT_DB_ALIAS)
+
+    def test_post_reads_from_primary(self):
+        self.assertEqual(self.read_alias(RequestFactory().post('/')), DEFAULT_DB_ALIAS)
+
+    def test_generated_wrap_pins_reads_to_primary(self):
+        with mock.patch.object(db_routing, 'replica_configured', return_value=True):
+            response = db_routing.pin_reads_to_primary(HttpResponse())
+        request = RequestFactory().get('/')
+        request.COOKIES[db_routing.PRIMARY_COOKIE] = response.cookies[db_routing.PRIMARY_COOKIE].value
+        self.assertEqual(self.read_alias(request), DEFAULT_DB_ALIAS)
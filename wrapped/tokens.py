@@ -0,0 +1,351 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import caching, metrics, spotify_client
+from .models import SpotifyProfile
+from .rate_limit import get_redis
+from .spotify_client import SpotifyRateLimited
+
+
+def is_token_expired(profile, margin=60):
+    """
+        Check if the access token for a given profile is expired or about to expire.
+
+        Args:
+            profile (SpotifyProfile): The profile object containing the access token and its expiration time.
+            margin (int): Seconds of remaining validity below which the token counts as expired.
+
+        Returns:
+            bool: True if the token is expired or will expire in less than `margin` seconds; False otherwise.
+        """
+
+    if not profile.expires_at:
+        # `expires_at` is missing; consider the token expired
+        return True
+    now = int(time.time())
+    return profile.expires_at - now < margin  # By default, expired if less than 1 minute remains
+
+
+def code_exchange_request(code):
+    """
+        Build the arguments of the request exchanging an OAuth authorization code for tokens.
+
+        Args:
+            code (str): The authorization code Spotify passed to the callback.
+
+        Returns:
+            dict: Keyword arguments for `spotify_client.post` / `spotify_client.apost`.
+        """
+
+    token_url = f"{settings.SPOTIFY_ACCOUNTS_BASE_URL}/api/token"
+    redirect_uri = settings.SPOTIPY_REDIRECT_URI
+    client_id = settings.SPOTIPY_CLIENT_ID
+    client_secret = settings.SPOTIPY_CLIENT_SECRET
+
+    data = {
+        'grant_type': 'authorization_code',
+        'code': code,
+        'redirect_uri': redirect_uri
+    }
+
+    headers = {
+        'Content-Type': 'application/x-www-form-urlencoded'
+    }
+
+    auth = (client_id, client_secret)
+    return {'url': token_url, 'data': data, 'headers': headers, 'auth': auth}
+
+
+def _refresh_request(profile):
+    """
+        Build the arguments of the refresh-token request to Spotify's accounts service.
+
+        Args:
+            profile (SpotifyProfile): The profile object containing the current refresh token.
+
+        Returns:
+            dict: Keyword arguments for `spotify_client.post` / `spotify_client.apost`.
+        """
+
+    token_url = f"{settings.SPOTIFY_ACCOUNTS_BASE_URL}/api/token"
+    client_id = settings.SPOTIPY_CLIENT_ID
+    client_secret = settings.SPOTIPY_CLIENT_SECRET
+
+    data = {
+        'grant_type': 'refresh_token',
+        'refresh_token': profile.refresh_token,
+    }
+
+    headers = {
+        'Content-Type': 'application/x-www-form-urlencoded'
+    }
+
+    auth = (client_id, client_secret)
+    return {'url': token_url, 'data': data, 'headers': headers, 'auth': auth}
+
+
+def _apply_token_info(profile, token_info):
+    """
+        Copy a refreshed token from Spotify's response onto the profile, without saving it.
+        """
+
+    profile.access_token = token_info['access_token']
+    if 'refresh_token' in token_info:
+        profile.refresh_token = token_info['refresh_token']
+    expires_in = token_info.get('expires_in')
+    profile.expires_at = int(time.time()) + expires_in
+
+
+# The fields holding a profile's token, written back together after a refresh
+TOKEN_FIELDS = ('access_token', 'refresh_token', 'expires_at')
+
+
+def _store_token(profile, used_refresh_token):
+    """
+        Write a refreshed token back with a single short UPDATE, unless another process rotated the
+        refresh token in the meantime, in which case the profile takes the token it stored instead.
+        """
+
+    updated = SpotifyProfile.objects.filter(pk=profile.pk, refresh_token=used_refresh_token).update(
+        **{field: getattr(profile, field) for field in TOKEN_FIELDS}
+    )
+    if not updated:
+        profile.refresh_from_db(fields=TOKEN_FIELDS)
+    # An UPDATE sends no post_save signal
+    caching.invalidate(caching.profile_key(profile.user_id))
+
+
+async def _astore_token(profile, used_refresh_token):
+    """
+        Async counterpart of `_store_token`.
+        """
+
+    updated = await SpotifyProfile.objects.filter(pk=profile.pk, refresh_token=used_refresh_token).aupdate(
+        **{field: getattr(profile, field) for field in TOKEN_FIELDS}
+    )
+    if not updated:
+        await profile.arefresh_from_db(fields=TOKEN_FIELDS)
+    await sync_to_async(caching.invalidate, thread_sensitive=False)(caching.profile_key(profile.user_id))
+
+
+def refresh_spotify_token(profile):
+    """
+        Refresh the access token for a given Spotify profile using the refresh token.
+
+        No transaction is held during the call to Spotify; the new token is written back afterwards
+        (see `_store_token`).
+
+        Args:
+            profile (SpotifyProfile): The profile object containing the current refresh token and other details.
+
+        Returns:
+            bool: True if the token was successfully refreshed; False otherwise.
+        """
+
+    used_refresh_token = profile.refresh_token
+    with metrics.span('token_refresh'):
+        try:
+            response = spotify_client.post(**_refresh_request(profile))
+        except (requests.RequestException, SpotifyRateLimited) as e:
+            logging.warning(f"Error refreshing token: {e}")
+            return False
+        if response.status_code != 200:
+            logging.warning("Error refreshing token: %s %s", response.status_code, spotify_client.LoggedBody(response))
+            return False
+
+        _apply_token_info(profile, response.json())
+        _store_token(profile, used_refresh_token)
+    return True
+
+
+async def arefresh_spotify_token(profile):
+    """
+        Async counterpart of `refresh_spotify_token`, using the shared async client and the async ORM.
+        """
+
+    used_refresh_token = profile.refresh_token
+    with metrics.span('token_refresh'):
+        try:
+            response = await spotify_client.apost(**_refresh_request(profile))
+        except (httpx.HTTPError, SpotifyRateLimited) as e:
+            logging.warning(f"Error refreshing token: {e}")
+            return False
+        if response.status_code != 200:
+            logging.warning("Error refreshing token: %s %s", response.status_code, spotify_client.LoggedBody(response))
+            return False
+
+        _apply_token_info(profile, response.json())
+        await _astore_token(profile, used_refresh_token)
+    return True
+
+
+# Locks shared by the profiles whose IDs are equal modulo their number, so the set stays bounded
+# however many profiles a process refreshes; two profiles sharing one only wait for each other
+PROCESS_LOCK_STRIPES = 64
+
+_process_locks = [threading.Lock() for _ in range(PROCESS_LOCK_STRIPES)]
+_async_locks = weakref.WeakKeyDictionary()  # The same stripes as asyncio locks, per event loop
+
+
+def _process_lock(profile_pk):
+    """
+        Return the lock that serialises token refreshes of one profile within this process.
+        """
+
+    return _process_locks[profile_pk % PROCESS_LOCK_STRIPES]
+
+
+def _async_process_lock(profile_pk):
+    """
+        Return the lock that serialises token refreshes of one profile within the running event loop.
+        """
+
+    locks = _async_locks.get(asyncio.get_running_loop())
+    if locks is None:
+        locks = _async_locks[asyncio.get_running_loop()] = [asyncio.Lock() for _ in range(PROCESS_LOCK_STRIPES)]
+    return locks[profile_pk % PROCESS_LOCK_STRIPES]
+
+
+def _acquire_shared_lock(profile_pk):
+    """
+        Take the Redis lock that serialises token refreshes of one profile across the fleet.
+
+        Returns:
+            tuple: `(acquired, lock)`. `acquired` is False if the lock could not be taken in time;
+            `lock` is None when Redis is not configured or unreachable, in which case only the
+            process lock applies.
+        """
+
+    client = get_redis()
+    if client is None:
+        return True, None
+    import redis
+
+    lock = client.lock(f"spotify:token-refresh:{profile_pk}", timeout=30, blocking_timeout=30)
+    try:
+        if not lock.acquire():
+            logging.warning(f"Timed out waiting for the token refresh lock of profile {profile_pk}")
+            return False, None
+    except redis.RedisError as e:
+        logging.warning(f"Token refresh lock unavailable, refreshing under the process lock only: {e}")
+        return True, None
+    return True, lock
+
+
+def _release_shared_lock(lock, profile_pk):
+    """
+        Release a lock taken by `_acquire_shared_lock`. A lock that expired during a slow refresh is only
+        logged: the refresh itself went through and its token is stored.
+        """
+
+    if lock is None:
+        return
+    import redis
+
+    try:
+        lock.release()
+    except redis.RedisError as e:
+        logging.warning(f"Could not release the token refresh lock of profile {profile_pk}: {e}")
+
+
+def _copy_token(source, target):
+    """
+        Copy the token fields of one in-memory profile onto another.
+        """
+
+    for field in TOKEN_FIELDS:
+        setattr(target, field, getattr(source, field))
+
+
+def refresh_token_single_flight(profile, margin=60):
+    """
+        Refresh the profile's token so that only one refresh per profile is in flight at a time.
+
+        Concurrent callers for the same profile queue on a lock: a process lock, plus a Redis lock across
+        the fleet when `settings.REDIS_URL` is set. The first one refreshes; the others re-read the profile
+        once they get the lock, see the rotated token and reuse it. That way two requests never both spend
+        the same refresh token. No transaction is open during the call to Spotify, and without Redis the
+        write back only applies if no other process rotated the token meanwhile (see `_store_token`).
+
+        Args:
+            profile (SpotifyProfile): The profile to refresh; updated in place with the current token.
+            margin (int): Seconds of remaining validity below which the token is refreshed.
+
+        Returns:
+            bool: True if the profile's token is valid now; False if it could not be refreshed.
+        """
+
+    with _process_lock(profile.pk):
+        acquired, lock = _acquire_shared_lock(profile.pk)
+        if not acquired:
+            return False
+        try:
+            current = SpotifyProfile.objects.get(pk=profile.pk)
+            # Someone else may have refreshed the token while we were waiting for the lock
+            refreshed = not is_token_expired(current, margin) or refresh_spotify_token(current)
+        finally:
+            _release_shared_lock(lock, profile.pk)
+    _copy_token(current, profile)
+    return refreshed
+
+
+async def arefresh_token_single_flight(profile, margin=60):
+    """
+        Async counterpart of `refresh_token_single_flight`: the token is refreshed over the shared async
+        client, callers on the event loop queue on an asyncio lock, and the Redis lock is taken and
+        released in a worker thread so waiting for it never blocks the loop or the sync thread.
+        """
+
+    async with _async_process_lock(profile.pk):
+        acquired, lock = await sync_to_async(_acquire_shared_lock, thread_sensitive=False)(profile.pk)
+        if not acquired:
+            return False
+        try:
+            current = await SpotifyProfile.objects.aget(pk=profile.pk)
+            refreshed = not is_token_expired(current, margin) or await arefresh_spotify_token(current)
+        finally:
+            await sync_to_async(_release_shared_lock, thread_sensitive=False)(lock, profile.pk)
+    _copy_token(current, profile)
+    return refreshed
+
+
+def ensure_valid_token(profile):
+    """
+        Make sure the profile holds a usable access token, refreshing it if it is expired or about to expire.
+
+        The tokens of a profile read through the cache are deferred and loaded here from the database.
+
+        Args:
+            profile (SpotifyProfile): The profile whose token should be checked.
+
+        Returns:
+            bool: True if the profile's access token can be used; False if it could not be refreshed.
+        """
+
+    if not is_token_expired(profile):
+        deferred = profile.get_deferred_fields().intersection(caching.SECRET_PROFILE_FIELDS)
+        if deferred:
+            profile.refresh_from_db(fields=deferred)
+        return True
+    return refresh_token_single_flight(profile)
+
+
+async def aensure_valid_token(profile):
+    """
+        Async counterpart of `ensure_valid_token`.
+        """
+
+    if not is_token_expired(profile):
+        deferred = profile.get_deferred_fields().intersection(caching.SECRET_PROFILE_FIELDS)
+        if deferred:
+            await profile.arefresh_from_db(fields=deferred)
+        return True
+    return await arefresh_token_single_flight(profile)
@@ -1,77 +1,39 @@
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db import DEFAULT_DB_ALIAS, router
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import translation
+from django.utils.safestring import mark_safe
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+from datetime import datetime
 import time
+import hmac
 import requests
 import logging
 from urllib.parse import urlencode
-from .models import SpotifyProfile, SpotifyWrap
-from .spotify_api import (
-    get_user_followed_artists,
-    get_user_top_artists,
-    get_user_top_tracks,
-    get_recently_played,
-)
+from . import caching, catalog, metrics, spotify_cache, spotify_client
+from .db_routing import pin_reads_to_primary, read_from_replica
+from .decorators import spotify_profile_required, spotify_token_required
+from .jobs import enqueue_wrap_job, queue_stats
+from .models import SpotifyProfile, SpotifyWrap, WrapJob
+from .spotify_api import get_current_user_profile
+from .spotify_client import SpotifyRateLimited
+from .tokens import code_exchange_request
+from .wrap_pages import render_wrap_slides, replay_etag, stream_wrap_slides
+from .wraps import WrapBuildError, create_wrap
 
+# Wraps listed per page of the history
+HISTORY_PAGE_SIZE = 20
 
-def is_token_expired(profile):
-    """
-        Check if the access token for a given profile is expired or about to expire.
-
-        Args:
-            profile (SpotifyProfile): The profile object containing the access token and its expiration time.
-
-        Returns:
-            bool: True if the token is expired or will expire in less than 60 seconds; False otherwise.
-        """
-
-    if not profile.expires_at:
-        # `expires_at` is missing; consider the token expired
-        return True
-    now = int(time.time())
-    return profile.expires_at - now < 60  # Consider expired if less than 1 minute remains
-
-
-def refresh_spotify_token(profile):
-    """
-        Refresh the access token for a given Spotify profile using the refresh token.
-
-        Args:
-            profile (SpotifyProfile): The profile object containing the current refresh token and other details.
-
-        Returns:
-            bool: True if the token was successfully refreshed; False otherwise.
-        """
-
-    token_url = "https://accounts.spotify.com/api/token"
-    client_id = settings.SPOTIPY_CLIENT_ID
-    client_secret = settings.SPOTIPY_CLIENT_SECRET
-
-    data = {
-        'grant_type': 'refresh_token',
-        'refresh_token': profile.refresh_token,
-    }
-
-    headers = {
-        'Content-Type': 'application/x-www-form-urlencoded'
-    }
-
-    auth = (client_id, client_secret)
-
-    response = requests.post(token_url, data=data, headers=headers, auth=auth)
-    if response.status_code != 200:
-        print("Error refreshing token:", response.text)
-        return False
-
-    token_info = response.json()
-    profile.access_token = token_info['access_token']
-    if 'refresh_token' in token_info:
-        profile.refresh_token = token_info['refresh_token']
-    expires_in = token_info.get('expires_in')
-    profile.expires_at = int(time.time()) + expires_in
-    profile.save()
-    return True
+# Stands in for the slides when wrap.html is split around them for streaming
+SLIDES_PLACEHOLDER = mark_safe('<!-- wrap slides -->')
 
 
 @login_required
@@ -95,7 +57,7 @@ def spotify_connect(request):
         "redirect_uri": redirect_uri,
         "scope": scope,
     }
-    auth_url = "https://accounts.spotify.com/authorize?" + urlencode(params)
+    auth_url = f"{settings.SPOTIFY_ACCOUNTS_BASE_URL}/authorize?" + urlencode(params)
     return redirect(auth_url)
 
 
@@ -115,30 +77,16 @@ def spotify_callback(request):
     if not code:
         return render(request, 'error.html', {'message': 'No code provided in the callback.'})
 
-    token_url = "https://accounts.spotify.com/api/token"
-    redirect_uri = settings.SPOTIPY_REDIRECT_URI
-    client_id = settings.SPOTIPY_CLIENT_ID
-    client_secret = settings.SPOTIPY_CLIENT_SECRET
-
-    data = {
-        'grant_type': 'authorization_code',
-        'code': code,
-        'redirect_uri': redirect_uri
-    }
-
-    headers = {
-        'Content-Type': 'application/x-www-form-urlencoded'
-    }
-
-    auth = (client_id, client_secret)
-
-    response = requests.post(token_url, data=data, headers=headers, auth=auth)
+    try:
+        response = spotify_client.post(**code_exchange_request(code))
+    except (requests.RequestException, SpotifyRateLimited) as e:
+        logging.warning(f"Spotify token exchange failed: {e}")
+        return render(request, 'error.html', {'message': 'Failed to obtain token information from Spotify.'})
     if response.status_code != 200:
-        print("Failed to obtain token_info. Response:", response.text)
+        logging.warning(f"Spotify token exchange answered {response.status_code}")
         return render(request, 'error.html', {'message': 'Failed to obtain token information from Spotify.'})
 
     token_info = response.json()
-    print("Received token_info:", token_info)
 
     if token_info:
         access_token = token_info.get('access_token')
@@ -147,39 +95,34 @@ def spotify_callback(request):
         expires_at = int(time.time()) + expires_in
 
         # Use the access token to get user profile
-        user_profile_url = "https://api.spotify.com/v1/me"
-        headers = {
-            'Authorization': f'Bearer {access_token}'
-        }
-        response = requests.get(user_profile_url, headers=headers)
-        if response.status_code != 200:
-            print("Failed to get user profile. Response:", response.text)
+        try:
+            spotify_user = get_current_user_profile(access_token)
+        except (requests.RequestException, SpotifyRateLimited) as e:
+            logging.warning(f"Failed to get the Spotify profile of user {request.user.id}: {e}")
+            spotify_user = None
+        if not spotify_user:
             return render(request, 'error.html', {'message': 'Failed to get user profile from Spotify.'})
 
-        spotify_user = response.json()
         spotify_id = spotify_user['id']
-        print("Authenticated Spotify user ID:", spotify_id)
 
         try:
             # Check if a SpotifyProfile with this spotify_id already exists
             profile = SpotifyProfile.objects.get(spotify_id=spotify_id)
             if profile.user != request.user:
                 # The Spotify account is already linked to another user
-                print("Spotify account is already linked to another user.")
+                logging.warning(f"Spotify account {spotify_id} is already linked to another user")
                 return render(request, 'error.html', {
                     'message': 'This Spotify account is already linked to another user.'
                 })
             else:
                 # Update the existing profile
-                print("Updating existing SpotifyProfile for the same user.")
                 profile.access_token = access_token
                 profile.refresh_token = refresh_token
                 profile.expires_at = expires_at
                 profile.save()
-                print("SpotifyProfile updated successfully.")
+                logging.info(f"Spotify profile {spotify_id} reconnected")
         except SpotifyProfile.DoesNotExist:
             # Create a new profile
-            print("Creating new SpotifyProfile.")
             profile = SpotifyProfile.objects.create(
                 user=request.user,
                 spotify_id=spotify_id,
@@ -187,192 +130,300 @@ def spotify_callback(request):
                 refresh_token=refresh_token,
                 expires_at=expires_at
             )
-            print("SpotifyProfile created successfully.")
+            logging.info(f"Spotify profile {spotify_id} linked")
 
         return redirect('generate_wrap')
 
-    print("Failed to obtain token_info.")
+    logging.warning("Spotify token exchange returned no token")
     return render(request, 'error.html', {'message': 'Failed to obtain token information from Spotify.'})
 
 
 @login_required
+@spotify_profile_required
 def generate_wrap(request):
     """
         Generate and display a personalized Spotify wrap for the authenticated user.
 
+        When `settings.WRAP_GENERATION_MODE` is 'background', the wrap is queued for a worker instead and a
+        page that polls `wrap_job_status` is returned right away. When it is 'stream', the page is streamed
+        and each slide is sent as soon as its data arrives from Spotify.
+
         Args:
             request (HttpRequest): The HTTP request object.
 
         Returns:
-            HttpResponse: Renders the 'wrap.html' template with wrap data or redirects to the Spotify connection page if an error occurs.
+            HttpResponse: Renders the 'wrap.html' template with wrap data (or 'wrap_pending.html' for a queued job),
+            or redirects to the Spotify connection page if an error occurs.
         """
 
     logging.debug("Starting generate_wrap method")
 
-    # Get access token
-    profile = SpotifyProfile.objects.filter(user=request.user).first()
-    if not profile:
-        logging.warning("No Spotify profile found for the user")
-        return redirect('spotify_connect')
+    if settings.WRAP_GENERATION_MODE == 'background':
+        job = enqueue_wrap_job(request.user)
+        return render(request, 'wrap_pending.html', {'job': job})
+    if settings.WRAP_GENERATION_MODE == 'stream':
+        return _stream_wrap_now(request)
+    return _generate_wrap_now(request)
 
-    # Refresh token if needed
-    if is_token_expired(profile):
-        logging.info("Access token expired. Attempting to refresh.")
-        refreshed = refresh_spotify_token(profile)
-        if not refreshed:
-            logging.error("Failed to refresh token. Redirecting to Spotify connect.")
-            return redirect('spotify_connect')
 
-    access_token = profile.access_token
-    logging.debug("Access token acquired successfully")
+@spotify_token_required
+def _generate_wrap_now(request):
+    """
+        Build, save and render a wrap right away, with a usable access token ensured by the decorator.
+        """
 
+    profile = request.spotify_profile
     try:
-        # Fetch user profile
-        user_profile_url = "https://api.spotify.com/v1/me"
-        headers = {
-            'Authorization': f'Bearer {access_token}'
-        }
-        response = requests.get(user_profile_url, headers=headers)
-        if response.status_code != 200:
-            logging.error(f"Failed to get user profile. Response: {response.text}")
-            return redirect('spotify_connect')
-
-        user_profile = response.json()
-        spotify_username = user_profile.get('display_name', 'Spotify User')
-        logging.debug(f"Fetched Spotify user profile: {spotify_username}")
-
-        # Fetch top artists
-        top_artists_raw = get_user_top_artists(access_token)
-        logging.debug(f"Raw top artists data: {top_artists_raw}")
-        top_artists = [
-            {
-                'name': artist['name'],
-                'profile_pic': artist['images'][0]['url'] if artist.get('images') else None
-            }
-            for artist in top_artists_raw
-        ]
-        logging.debug(f"Processed top artists data: {top_artists}")
-
-        # Fetch top tracks
-        top_tracks_raw = get_user_top_tracks(access_token)
-        logging.debug(f"Raw top tracks data: {top_tracks_raw}")
-        top_tracks = [
-            {
-                'name': track['name'],
-                'artist': ', '.join(artist['name'] for artist in track['artists']),
-                'album_name': track['album']['name'],
-                'album_cover': track['album']['images'][0]['url'] if track['album']['images'] else None,
-            }
-            for track in top_tracks_raw
-        ]
-        logging.debug(f"Processed top tracks data: {top_tracks}")
-
-        # Process recently played tracks
-        recently_played_raw = get_recently_played(access_token)
-        logging.debug(f"Raw recently played data: {recently_played_raw}")
-
-        # Handle recently_played_raw depending on its type
-        if isinstance(recently_played_raw, dict):
-            recently_played_items = recently_played_raw.get('items', [])
-        elif isinstance(recently_played_raw, list):
-            recently_played_items = recently_played_raw
-        else:
-            recently_played_items = []
-
-        logging.debug(f"Processed recently played items: {recently_played_items}")
-
-        # Extract track details
-        recently_played = [
-            {
-                'track': item['track']['name'],
-                'artist': ', '.join(artist['name'] for artist in item['track']['artists']),
-                'album_name': item['track']['album']['name'],
-                'album_cover': item['track']['album']['images'][0]['url']
-                if item['track']['album']['images'] else None,
-                'played_at': item['played_at'],
-            }
-            for item in recently_played_items
-        ]
-        logging.debug(f"Processed recently played tracks: {recently_played}")
-
-        # Fetch followed artists
-        followed_artists = get_user_followed_artists(access_token)
-        logging.debug(f"Fetched followed artists: {followed_artists}")
-
-        # Prepare wrap data
-        wrap_data = {
-            'spotify_username': spotify_username,
-            'top_artists': top_artists,
-            'top_tracks': top_tracks,
-            'recently_played': recently_played,
-            'followed_artists': followed_artists,
-        }
-        logging.info(f"Wrap data prepared successfully: {wrap_data}")
-
-        # Save wrap to the database
-        SpotifyWrap.objects.create(
-            user=request.user,
-            data=wrap_data  # Ensure data is JSON-serializable
-        )
-        logging.info("Wrap data saved to the database successfully")
-
-        # Pass data to the template
-        return render(request, 'wrap.html', {'wrap_data': wrap_data})
-
+        wrap = create_wrap(profile)
+    except WrapBuildError as e:
+        logging.error(f"Failed to build wrap: {e}")
+        if e.reason == WrapBuildError.THROTTLED:
+            return render(request, 'error.html', {'message': str(e)})
+        return redirect('spotify_connect')
     except Exception as e:
         logging.error(f"Unexpected error: {e}")
         return redirect('spotify_connect')
 
+    # Pass data to the template; the user's next history and replay reads must see the new wrap
+    return pin_reads_to_primary(render(request, 'wrap.html', {'wrap_slides': render_wrap_slides(wrap)}))
+
+
+@spotify_token_required
+def _stream_wrap_now(request):
+    """
+        Stream the wrap page while the wrap is built and saved, with a usable access token ensured by the decorator.
+
+        The page up to the slides and the welcome slide are sent before Spotify is called, so the first
+        paint no longer waits for the slowest endpoint and the database write.
+        """
+
+    head, tail = render_to_string('wrap.html', {'wrap_slides': SLIDES_PLACEHOLDER}, request).split(SLIDES_PLACEHOLDER)
+    profile = request.spotify_profile
+    language = translation.get_language()
+
+    def page():
+        # The body is rendered while the response is sent, once the view and the middleware have returned
+        with translation.override(language):
+            yield head
+            yield from stream_wrap_slides(profile)
+            yield tail
+
+    response = StreamingHttpResponse(page(), content_type='text/html; charset=utf-8')
+    # Keep proxies such as nginx from buffering the slides until the page is complete
+    response['X-Accel-Buffering'] = 'no'
+    return pin_reads_to_primary(response)
+
 
 @login_required
+def wrap_job_status(request, job_id):
+    """
+        Report the progress of a queued wrap generation job as JSON.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            job_id (int): The ID of the job, which must belong to the authenticated user.
+
+        Returns:
+            JsonResponse: The job's `status` and `progress`, plus the `replay_url` of the finished wrap or
+            the `error` and a `redirect_url` the user should be sent to if the job failed.
+        """
+
+    job = get_object_or_404(WrapJob, id=job_id, user=request.user)
+    payload = {'status': job.status, 'progress': job.progress}
+    if job.status == WrapJob.DONE and job.wrap_id:
+        payload['replay_url'] = reverse('replay_wrap', args=[job.wrap_id])
+        # The page is about to open the new wrap, which the replica may not have yet
+        return pin_reads_to_primary(JsonResponse(payload))
+    if job.status == WrapJob.FAILED:
+        payload['error'] = job.error
+        payload['redirect_url'] = reverse('spotify_connect') if job.error == WrapBuildError.RECONNECT \
+            else reverse('wrap_history')
+    return JsonResponse(payload)
+
+
+@staff_member_required
+def wrap_queue_stats(request):
+    """
+        Report queue depth and job latency of background wrap generation as JSON, for staff only.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            JsonResponse: The output of `queue_stats`.
+        """
+
+    return JsonResponse(queue_stats())
+
+
+@staff_member_required
+def catalog_cache_stats(request):
+    """
+        Report the hit rate of this process's catalog cache as JSON, for staff only.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            JsonResponse: The output of `catalog.get_stats`.
+        """
+
+    return JsonResponse(catalog.get_stats())
+
+
+@staff_member_required
+def spotify_client_stats(request):
+    """
+        Report how Spotify calls fared against the rate limit and the response cache as JSON, for staff only.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            JsonResponse: The output of `spotify_client.get_stats` under `rate_limit` and of
+            `spotify_cache.get_stats` under `response_cache`.
+        """
+
+    return JsonResponse({'rate_limit': spotify_client.get_stats(), 'response_cache': spotify_cache.get_stats()})
+
+
+def metrics_view(request):
+    """
+        Serve this process's request, wrap step and Spotify call histograms, and its rate limiter and
+        response cache counters, in the Prometheus text format.
+
+        Open to staff users, and to scrapers that send `settings.METRICS_TOKEN` as a bearer token.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            HttpResponse: The output of `metrics.render_prometheus`, or 403 without a valid token.
+        """
+
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    scraper = bool(token) and hmac.compare_digest(authorization, f"Bearer {token}")
+    if not scraper and not request.user.is_staff:
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _parse_history_cursor(cursor):
+    """
+        Decode a `wrap_history` cursor into the `created_at` and `id` of the last wrap already shown.
+
+        Returns:
+            tuple | None: `(created_at, id)`, or None if the cursor is missing or malformed.
+        """
+
+    try:
+        created_at, wrap_id = cursor.rsplit(',', 1)
+        return datetime.fromisoformat(created_at), int(wrap_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+@login_required
+@read_from_replica
 def wrap_history(request):
     """
-        Display the history of Spotify wraps for the authenticated user.
+        Display the history of Spotify wraps for the authenticated user, newest first.
+
+        Served from the database alone, from the read replica when there is one; it never calls Spotify,
+        so it does not need a usable access token. Only the columns the page shows are loaded, and pages
+        are selected with a keyset cursor on `(created_at, id)` passed as `?before=`, so each page costs
+        the same however long the history is.
+        The first page, the one most visits show, is kept in the default cache until the user's wraps change.
+        It is always loaded from the primary, so a lagging replica never puts a page missing a new wrap back
+        in the cache, including wraps made by the worker or a bulk run.
 
         Args:
             request (HttpRequest): The HTTP request object.
 
         Returns:
-            HttpResponse: Renders the 'history.html' template with wrap history or redirects to the Spotify connection page if the user is not authenticated or has issues with the access token.
+            HttpResponse: Renders the 'history.html' template with one page of wrap history.
         """
 
-    profile = SpotifyProfile.objects.filter(user=request.user).first()
-    if not profile:
-        return redirect('spotify_connect')
+    wraps = SpotifyWrap.objects.filter(user=request.user).only('id', 'created_at').order_by('-created_at', '-id')
+    cursor = _parse_history_cursor(request.GET.get('before'))
+    if cursor:
+        created_at, wrap_id = cursor
+        wraps = wraps.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=wrap_id))
+
+    # Fetch one extra row to learn whether there is an older page
+    page = wraps[:HISTORY_PAGE_SIZE + 1]
+    if cursor:
+        wraps = list(page)
+    else:
+        wraps = caching.get_or_set(caching.history_key(request.user.pk), lambda: list(page.using(DEFAULT_DB_ALIAS)))
+    next_cursor = None
+    if len(wraps) > HISTORY_PAGE_SIZE:
+        wraps = wraps[:HISTORY_PAGE_SIZE]
+        next_cursor = f"{wraps[-1].created_at.isoformat()},{wraps[-1].id}"
+
+    return render(request, 'history.html', {
+        'wraps': wraps,
+        'next_cursor': next_cursor,
+        'is_first_page': cursor is None,
+    })
+
+
+def _replay_wrap_created_at(request, wrap_id):
+    """
+        Return when the requested wrap was created, or None if the user has no such wrap.
 
-    # Check if access token is expired or expires_at is missing
-    if is_token_expired(profile):
-        refreshed = refresh_spotify_token(profile)
-        if not refreshed:
-            return redirect('spotify_connect')
+        Looked up once per request and shared by the ETag and Last-Modified functions and the view, through
+        the default cache: wraps never change, and the entry is dropped if the wrap is deleted. A wrap
+        the replica does not have is looked up again on the primary before its absence is cached, as
+        the replica may just not have caught up yet.
+        """
 
-    wraps = SpotifyWrap.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'history.html', {'wraps': wraps})
+    def load():
+        wraps = SpotifyWrap.objects.filter(id=wrap_id, user=request.user).values_list('created_at', flat=True)
+        created_at = wraps.first()
+        if created_at is None and router.db_for_read(SpotifyWrap) != DEFAULT_DB_ALIAS:
+            created_at = wraps.using(DEFAULT_DB_ALIAS).first()
+        return created_at
+
+    if not hasattr(request, '_replay_wrap_created_at'):
+        request._replay_wrap_created_at = caching.get_or_set(caching.replay_key(request.user.pk, wrap_id), load)
+    return request._replay_wrap_created_at
+
+
+def _replay_wrap_etag(request, wrap_id):
+    created_at = _replay_wrap_created_at(request, wrap_id)
+    return replay_etag(wrap_id, created_at) if created_at else None
 
 
 @login_required
+@read_from_replica
+@cache_control(private=True, no_cache=True)
+@vary_on_cookie
+@condition(etag_func=_replay_wrap_etag, last_modified_func=_replay_wrap_created_at)
 def replay_wrap(request, wrap_id):
     """
         Display a specific wrap from the user's wrap history.
 
+        Served from the database alone, from the read replica when there is one; it never calls Spotify,
+        so it does not need a usable access token. A wrap never changes, so the rendered slides are cached
+        per wrap and language, and browsers revalidating with the ETag or Last-Modified of a page they
+        already have get a 304 without any rendering. The page embeds a CSRF token, so it varies on the
+        cookies: a browser whose CSRF cookie changed fetches it again instead of revalidating.
+
         Args:
             request (HttpRequest): The HTTP request object.
             wrap_id (int): The ID of the specific wrap to be displayed.
 
         Returns:
-            HttpResponse: Renders the 'wrap.html' template with the specified wrap data or redirects to the Spotify connection page if the user is not authenticated or has issues with the access token.
+            HttpResponse: Renders the 'wrap.html' template with the specified wrap's slides.
         """
 
-    profile = SpotifyProfile.objects.filter(user=request.user).first()
-    if not profile:
-        return redirect('spotify_connect')
-
-    # Check if access token is expired or expires_at is missing
-    if is_token_expired(profile):
-        refreshed = refresh_spotify_token(profile)
-        if not refreshed:
-            return redirect('spotify_connect')
-
-    wrap = get_object_or_404(SpotifyWrap, id=wrap_id, user=request.user)
-    wrap_data = wrap.data
-    return render(request, 'wrap.html', {'wrap_data': wrap_data})
\ No newline at end of file
+    created_at = _replay_wrap_created_at(request, wrap_id)
+    if created_at is None:
+        raise Http404("No such wrap.")
+    # Rebuilt from the cached lookup without a query; the JSON payload is only loaded if the slides are
+    # not cached yet
+    wrap = SpotifyWrap.from_db(router.db_for_read(SpotifyWrap), ['id', 'user_id', 'created_at'],
+                               [wrap_id, request.user.pk, created_at])
+    return render(request, 'wrap.html', {'wrap_slides': render_wrap_slides(wrap)})
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+from . import metrics
+from .spotify_api import top_items_endpoint
+from .storage import OTHER_TIME_RANGES, expand_wrap_data, load_wrap_data, normalize_wrap_payloads
+from .wraps import WrapBuildError, iter_create_wrap
+
+# Rendered wrap slides, one entry per wrap and language (see CACHES in settings.py)
+CACHE_ALIAS = 'wrap_pages'
+
+# Sections of wrap_slides.html streamed as soon as the endpoints they show return, in page order
+STREAMED_SECTIONS = (
+    ('top_tracks', ('top_tracks',)),
+    ('top_artists', ('top_artists',)),
+    ('recently_played', ('recently_played',)),
+    ('time_ranges', tuple(top_items_endpoint(kind, time_range)
+                          for kind in ('artists', 'tracks') for time_range in OTHER_TIME_RANGES)),
+)
+
+
+def slides_cache_key(wrap, language):
+    """
+        Build the cache key of a wrap's slides rendered in one language.
+
+        The creation time is part of the key so that a wrap ID reused after the database was reset
+        never picks up another wrap's slides. The theme is not: dark mode is applied in the browser,
+        so the same HTML serves both themes.
+        """
+
+    return f"wrap-slides:{wrap.id}:{wrap.created_at.timestamp():.6f}:{language}"
+
+
+def render_wrap_slides(wrap):
+    """
+        Render the slides of a wrap in the active language, or return them from the cache.
+
+        Wraps never change once created, so a cached rendering stays valid until the wrap is deleted.
+        Cache errors are logged and the slides rendered anyway, so an unreachable cache never breaks
+        the page.
+
+        Args:
+            wrap (SpotifyWrap): The wrap to render. Its `data` is only loaded on a cache miss, so it may
+                be deferred.
+
+        Returns:
+            SafeString: The HTML of `wrap_slides.html`.
+        """
+
+    cache = caches[CACHE_ALIAS]
+    key = slides_cache_key(wrap, get_language())
+    try:
+        slides = cache.get(key)
+    except Exception as e:
+        logging.warning(f"Wrap page cache unavailable: {e}")
+        slides = None
+    if slides is not None:
+        return mark_safe(slides)
+
+    with metrics.span('render'):
+        slides = render_to_string('wrap_slides.html', {'wrap_data': load_wrap_data(wrap)})
+    try:
+        cache.set(key, slides)
+    except Exception as e:
+        logging.warning(f"Wrap page cache unavailable: {e}")
+    return mark_safe(slides)
+
+
+def _render_section(section, context):
+    return render_to_string(f'wrap_slides/{section}.html', context)
+
+
+def stream_wrap_slides(profile):
+    """
+        Build and save a wrap, yielding the HTML of its slides as their data arrives.
+
+        The welcome slide comes first, before any Spotify call returns. Each section of `wrap_slides.html`
+        follows as soon as its endpoints and those of the sections before it have completed, so the
+        slides keep their order; the sections of endpoints that failed, "Your Sound" and the closing
+        slides follow once the whole wrap is built. The result is the same HTML `render_wrap_slides`
+        returns for the saved wrap.
+
+        The page has already started when a build error shows up, so instead of redirecting, a message
+        takes the place of the slides that are still missing.
+
+        Args:
+            profile (SpotifyProfile): The profile to build the wrap for; its access token must be valid.
+
+        Yields:
+            str: Chunks of HTML.
+        """
+
+    yield _render_section('start', {})
+    results = {}
+    sections = list(STREAMED_SECTIONS)
+    try:
+        for name, value in iter_create_wrap(profile):
+            if name == 'wrap':
+                # Saved with the data rendered below
+                continue
+            if name == 'wrap_data':
+                ready, sections = [section for section, _ in sections] + ['your_sound'], []
+                wrap_data = expand_wrap_data(*value)
+            else:
+                results[name] = value
+                ready = []
+                while sections and all(endpoint in results for endpoint in sections[0][1]):
+                    ready.append(sections.pop(0)[0])
+                if not ready:
+                    continue
+                # The sections do not show the profile, which may not be there yet
+                wrap_data = expand_wrap_data(*normalize_wrap_payloads({**results, 'profile': {}}))
+            for section in ready:
+                yield _render_section(section, {'wrap_data': wrap_data})
+    except WrapBuildError as e:
+        logging.error(f"Failed to build wrap: {e}")
+        yield _render_section('failed', {'message': str(e), 'reconnect': e.reason == WrapBuildError.RECONNECT})
+    except Exception as e:
+        logging.error(f"Unexpected error: {e}")
+        yield _render_section('failed', {'message': 'Failed to build your wrap.', 'reconnect': True})
+    yield _render_section('end', {})
+
+
+def forget_wrap_slides(wrap):
+    """
+        Drop the cached slides of a wrap in every language.
+        """
+
+    try:
+        caches[CACHE_ALIAS].delete_many([slides_cache_key(wrap, language) for language, _ in settings.LANGUAGES])
+    except Exception as e:
+        logging.warning(f"Wrap page cache unavailable, could not forget wrap {wrap.id}: {e}")
+
+
+def replay_etag(wrap_id, created_at):
+    """
+        Build the ETag of a replay page from the wrap, which never changes, and the versions of what renders it.
+
+        The wrap page cache version (bumped when the slides or their translations change) and the hash of the
+        collectstatic manifest (which changes whenever a deploy changes a static file the page links to) are
+        folded in, so browsers fetch the page again after such a deploy instead of revalidating a stale copy.
+        The page also embeds a CSRF token and depends on the language, so the view varies on the
+        cookies holding both rather than folding them into the ETag.
+        """
+
+    # Only the manifest storage used in production has a manifest hash
+    static_version = getattr(staticfiles_storage, 'manifest_hash', '')
+    key = f"{wrap_id}:{created_at.isoformat()}:{caches[CACHE_ALIAS].version}:{static_version}"
+    return hashlib.sha1(key.encode()).hexdigest()
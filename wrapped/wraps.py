@@ -0,0 +1,224 @@
+import logging
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from . import metrics
+from .analytics import feature_rows, wrap_analysis
+from .loaders import CatalogLoader
+from .models import SpotifyWrap
+from .spotify_api import afetch_wrap_payloads, fetch_wrap_payloads, iter_wrap_payloads
+from .spotify_client import SpotifyRateLimited
+from .stats import wrap_top_genre
+from .storage import normalize_wrap_payloads, save_catalog
+
+THROTTLED_MESSAGE = 'Spotify is receiving too many requests right now. Please try again in a minute.'
+TIMED_OUT_MESSAGE = 'Spotify is taking too long to respond right now. Please try again in a minute.'
+
+
+class WrapBuildError(Exception):
+    """
+        Raised when a wrap cannot be built.
+
+        Args:
+            message (str): A message that can be shown to the user.
+            reason (str): `RECONNECT` if the user has to connect Spotify again, `THROTTLED` if Spotify
+                is rate limiting us or too slow to answer and the user should retry later.
+        """
+
+    RECONNECT = 'reconnect'
+    THROTTLED = 'throttled'
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+def assemble_wrap_data(results, errors, progress=None):
+    """
+        Check the fetched Spotify payloads and split them into the compact wrap data and its catalog rows.
+
+        Args:
+            results (dict): Payloads keyed by endpoint name, as returned by `fetch_wrap_payloads`.
+            errors (dict): Exceptions keyed by endpoint name, as returned by `fetch_wrap_payloads`.
+            progress (callable, optional): Called with a completion percentage as the build advances.
+
+        Returns:
+            tuple: The data stored in `SpotifyWrap.data` and the catalog to save with `save_catalog`,
+            as returned by `normalize_wrap_payloads`.
+
+        Raises:
+            WrapBuildError: If Spotify throttled us, a call outlived its fetch deadline, or the user profile
+                could not be fetched.
+        """
+
+    for endpoint, error in errors.items():
+        logging.warning(f"Failed to fetch {endpoint} from Spotify: {error}")
+
+    # Never save a wrap that is missing data only because Spotify throttled us
+    if any(isinstance(error, SpotifyRateLimited) for error in errors.values()):
+        raise WrapBuildError(THROTTLED_MESSAGE, WrapBuildError.THROTTLED)
+    # Likewise when a call missed its deadline: it may have been queued behind others rather than slow itself
+    if any(isinstance(error, TimeoutError) for error in errors.values()):
+        raise WrapBuildError(TIMED_OUT_MESSAGE, WrapBuildError.THROTTLED)
+
+    user_profile = results.get('profile')
+    if not user_profile:
+        raise WrapBuildError('Failed to get user profile from Spotify.', WrapBuildError.RECONNECT)
+    if progress:
+        progress(70)
+
+    with metrics.span('transform'):
+        wrap_data, catalog = normalize_wrap_payloads(results)
+    logging.info(
+        f"Wrap data prepared successfully: {len(wrap_data['top_artists'])} top artists, "
+        f"{len(wrap_data['top_tracks'])} top tracks, {len(wrap_data['recently_played'])} recent plays"
+    )
+    if progress:
+        progress(90)
+    return wrap_data, catalog
+
+
+def analyze_wrap(access_token, wrap_data, catalog):
+    """
+        Add the genre and mood analysis of a wrap to its data, under `analysis`.
+
+        The audio features of its tracks, and the details of the artists credited on them, are
+        loaded together first; only those missing from the catalog are fetched. The credited
+        artists' genres are not part of the wrap but feed the listening stats.
+
+        Args:
+            access_token (str): The access token used for fetching from the catalog endpoints.
+            wrap_data (dict): The compact wrap data; updated in place.
+            catalog (dict): The catalog rows referenced by `wrap_data`.
+        """
+
+    with metrics.span('analysis'):
+        loader = CatalogLoader(access_token)
+        loader.want('audio_features',
+                    wrap_data['top_tracks'] + [item['track'] for item in wrap_data['recently_played']])
+        loader.want('artists', [
+            artist_id for track in catalog['tracks'].values() for artist_id in track.artist_ids
+            if artist_id not in catalog['artists']
+        ])
+        loaded = loader.load()
+        wrap_data['analysis'] = wrap_analysis(wrap_data, catalog, feature_rows(loaded['audio_features']))
+
+
+def build_wrap_data(profile, progress=None):
+    """
+        Fetch everything a wrap shows from Spotify and split it into the compact wrap data and its catalog rows.
+
+        Args:
+            profile (SpotifyProfile): The profile to build the wrap for; its access token must be valid.
+            progress (callable, optional): Called with a completion percentage as the build advances.
+
+        Returns:
+            tuple: The data stored in `SpotifyWrap.data` and the catalog to save with `save_catalog`.
+
+        Raises:
+            WrapBuildError: If Spotify throttled us, a call outlived its fetch deadline, or the user profile
+                could not be fetched.
+        """
+
+    # Fetch the user profile and every wrap endpoint concurrently
+    results, errors = fetch_wrap_payloads(profile.access_token, spotify_user_id=profile.spotify_id)
+    wrap_data, catalog = assemble_wrap_data(results, errors, progress=progress)
+    analyze_wrap(profile.access_token, wrap_data, catalog)
+    return wrap_data, catalog
+
+
+def save_wrap(user_id, wrap_data, catalog):
+    """
+        Save a wrap together with the catalog rows it references, and fill in its top genre.
+
+        Args:
+            user_id (int): The ID of the user the wrap belongs to.
+            wrap_data (dict): The compact wrap data.
+            catalog (dict): The catalog rows referenced by `wrap_data`.
+
+        Returns:
+            SpotifyWrap: The saved wrap.
+        """
+
+    with metrics.span('db_write'), transaction.atomic():
+        save_catalog(catalog)
+        wrap = SpotifyWrap.objects.create(
+            user_id=user_id, data=wrap_data, top_genre=wrap_top_genre(user_id, wrap_data),
+        )
+    logging.info("Wrap data saved to the database successfully")
+    return wrap
+
+
+def create_wrap(profile, progress=None):
+    """
+        Build a wrap for the profile's user and save it.
+
+        Args:
+            profile (SpotifyProfile): The profile to build the wrap for; its access token must be valid.
+            progress (callable, optional): Called with a completion percentage as the build advances.
+
+        Returns:
+            SpotifyWrap: The saved wrap; render it with `load_wrap_data`.
+
+        Raises:
+            WrapBuildError: If the wrap could not be built.
+        """
+
+    wrap_data, catalog = build_wrap_data(profile, progress=progress)
+    return save_wrap(profile.user_id, wrap_data, catalog)
+
+
+def iter_create_wrap(profile):
+    """
+        Build a wrap for the profile's user and save it like `create_wrap`, reporting what arrives on the way.
+
+        The wrap endpoints are fetched concurrently, as for `create_wrap`, and the saved wrap holds
+        the same data; the payloads are only handed out as soon as each call finishes, so a page can
+        show them before the slowest one returns.
+
+        Args:
+            profile (SpotifyProfile): The profile to build the wrap for; its access token must be valid.
+
+        Yields:
+            tuple: `(name, value)` pairs: each endpoint's payload under its name as it completes, then the
+            `(wrap_data, catalog)` pair, analysis included, under `'wrap_data'`, and finally the saved wrap
+            under `'wrap'`.
+
+        Raises:
+            WrapBuildError: If the wrap could not be built.
+        """
+
+    results, errors = {}, {}
+    for name, payload, error in iter_wrap_payloads(profile.access_token, spotify_user_id=profile.spotify_id):
+        if error is None:
+            results[name] = payload
+            yield name, payload
+        else:
+            errors[name] = error
+    wrap_data, catalog = assemble_wrap_data(results, errors)
+    analyze_wrap(profile.access_token, wrap_data, catalog)
+    yield 'wrap_data', (wrap_data, catalog)
+    yield 'wrap', save_wrap(profile.user_id, wrap_data, catalog)
+
+
+async def acreate_wrap(profile):
+    """
+        Async counterpart of `create_wrap`, fetching on the event loop.
+
+        The analysis and saving run in a worker thread because they use the database.
+
+        Args:
+            profile (SpotifyProfile): The profile to build the wrap for; its access token must be valid.
+
+        Returns:
+            SpotifyWrap: The saved wrap; render it with `load_wrap_data`.
+
+        Raises:
+            WrapBuildError: If the wrap could not be built.
+        """
+
+    results, errors = await afetch_wrap_payloads(profile.access_token, spotify_user_id=profile.spotify_id)
+    wrap_data, catalog = assemble_wrap_data(results, errors)
+    await sync_to_async(analyze_wrap)(profile.access_token, wrap_data, catalog)
+    return await sync_to_async(save_wrap)(profile.user_id, wrap_data, catalog)